@@ -1,14 +1,18 @@
 #!/usr/bin/env python3
-from config import load_configs, load_settings
+from config import get_client_config, load_configs, load_settings
+from fanout import run_for_clients
 from error import send_notification
 import os
 import es
+from policy import get_policy_matcher
+from cluster import get_cluster_snapshot
 import json
 import time
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import threading
 from datetime import datetime
 from os import path
+notification = False
 
 def get_allocation_policy(client_config):
     # Grab the client specific allocation policy (tiering policy)
@@ -34,21 +38,23 @@ def calculate_accounting(client_config, client_name):
         print("Calculating accounting data for " + client_name)
         # Check cluster health - Expect Yellow to continue
         if es.check_cluster_health_status(client_config, settings['accounting']['health_check_level']):
-            elastic_connection = es.build_es_connection(client_config)
+            elastic_connection = es.get_es_connection(client_config)
             # Grab the client specific allocation policy (tiering policy)
             index_allocation_policies = get_allocation_policy(client_config)
+            allocation_matcher = get_policy_matcher(client_config, 'allocation', index_allocation_policies)
 
             # Next, get information on all current indices in client cluster
-            indices = es.es_get_indices(client_config)
+            snapshot = get_cluster_snapshot(client_config, 'accounting')
+            indices = snapshot.indices
             print("Client " + client_name + " has " + str(len(indices)) + ' indices')
 
             accounting_records = []
             special_index_size = 0
             # Loop through each index
             for index in indices:
-                if not es.check_special_index(index['index']):
+                if not es.check_special_index(index['index'], client_config):
                     # Grab the current index's allocation policy based on index name
-                    policy = es.check_index_allocation_policy(index['index'], index_allocation_policies)
+                    policy = allocation_matcher.match(index['index'])
                     # Lookup the policy's # of days setting
                     policy_days = index_allocation_policies[policy]
 
@@ -71,7 +77,7 @@ def calculate_accounting(client_config, client_name):
                     else:
                         cost = round(float(index_size_in_gb) * settings['accounting']['ssd_cost'], 8)
                         disk_type = 'ssd'
-                    index_group = es.get_index_group(index['index'])
+                    index_group = snapshot.get_index_group(index['index'])
                     accounting_record = {
                         'name': index['index'],
                         'client': client_name,
@@ -190,7 +196,6 @@ def calculate_accounting(client_config, client_name):
             else:
                 print("Debug enabled or no data to save. Not creating accounting file")
 
-            elastic_connection.close()
 
             cluster_stats = es.get_cluster_stats(client_config)
             # Convert cluster size from bytes to gigabytes
@@ -230,18 +235,15 @@ def calculate_accounting(client_config, client_name):
 
                 if len(accounting_records) != 0 and not settings['settings']['debug'] and settings['accounting']['output_to_es']:
                     print("Sending accounting records to ES")
-                    elasticsearch_connection = es.build_es_connection(client_config)
+                    elasticsearch_connection = es.get_es_connection(client_config)
                     results = es.get_list_by_chunk_size(accounting_records, 100)
                     for result in results:
                         es.bulk_insert_data_to_es(elasticsearch_connection, result, "accounting", bulk_size=100)
-                    elasticsearch_connection.close()
-                    clients = load_configs()
                     if client_name != settings['accounting']['send_copy_to_client_name'] and settings['accounting']['send_copy_to_client_name'] != '':
-                        elasticsearch_connection = es.build_es_connection(clients[settings['accounting']['send_copy_to_client_name']])
+                        elasticsearch_connection = es.get_es_connection(get_client_config(settings['accounting']['send_copy_to_client_name']))
                         results = es.get_list_by_chunk_size(accounting_records, 100)
                         for result in results:
                             es.bulk_insert_data_to_es(elasticsearch_connection, result, "accounting", bulk_size=100)
-                        elasticsearch_connection.close()
                     return True
                 else:
                     if not settings['settings']['debug']:
@@ -256,58 +258,52 @@ def calculate_accounting(client_config, client_name):
             print("Accounting operation failed for " + client_name + ". Cluster health does not meet level:  " + settings['accounting']['health_check_level'])
             return False
 
+def run_client_accounting(client_config):
+    """Runs accounting for one client, retrying until its cluster is healthy
+
+    Args:
+        client_config (dict): Client configuration
+    """
+    settings = load_settings()
+    retry_count = settings['accounting']['retry_attempts']
+    sleep_time = settings['accounting']['retry_wait_in_seconds']
+    client_name = client_config['client_name']
+    while retry_count >= 0:
+        if retry_count == 0:
+            # If on the last attempt, accept a health level of yellow
+            message = "Accounting operation failed.\n\nDue to failing 10 times, the health level was set to " + settings['accounting']['fallback_health_check_level'] + " and ran for client " + client_name + ". \n\nThis is not optimal. Please check to see if data should be purged and re-inserted with a green cluster."
+            send_notification(client_config, "accounting", "Failed", message, jira=settings['accounting']['ms-teams'], teams=settings['accounting']['jira'])
+        # Trigger calculate accounting process
+        result = calculate_accounting(client_config, client_name)
+        if result:
+            return
+        print("Client " + client_name + " did not process correctly.")
+        if retry_count == 0:
+            if notification:
+                message = "Accounting operation failed.\n\nIt is also possible that connections are unable to be made to the client/nginx node. Please fix.\n\nRemember that in order for client's to be properly build you will need to get their cluster status to **Green** and then re-run the following command:\n\npython3 /opt/cloud_operations/accounting.py --client " + client_name + "\n\nIf a green cluster is not possible by end of day, please run the following command to force run with a different color cluster:\n\npython3 /opt/cloud_operations/accounting.py --client " + client_name + " --health yellow"
+                send_notification(client_config, "accounting", "Failed", message, jira=settings['accounting']['ms-teams'], teams=settings['accounting']['jira'])
+        # Lower the retry_count by 1
+        retry_count = retry_count - 1
+        if retry_count >= 0:
+            print("Client " + client_name + " failed to process. Retry necessary")
+            print("Retry count set to " + str(retry_count) + " sleeping for " + str(sleep_time) + " seconds")
+            time.sleep(sleep_time)
+
 def run_accounting(manual_client=""):
     settings = load_settings()
     if settings['accounting']['enabled']:
-        retry_count = settings['accounting']['retry_attempts']
-        initial_retry_count = retry_count
-        retry_list = []
-        sleep_time = settings['accounting']['retry_wait_in_seconds']
         # Load all client configurations
         clients = load_configs()
-        # Add all clients initially to retry_list for first run
-        for client in clients:
-            # If client set at command line only run it otherwise
-            # execute for all clients
-            if manual_client == "" or clients[client]['client_name'] == manual_client:
-                retry_list.append(clients[client]['client_name'])
-        # Loop through each client to perform accounting per client
-        while retry_count >= 0 and len(retry_list) > 0:
-            print("Accounting job processing for:")
-            print(retry_list)
-            if initial_retry_count != retry_count:
-                print("Retry count set to " + str(retry_count))
-                print("------------------------------\n")
-            for client in clients:
-                # Set nice variable names
-                client_name = clients[client]['client_name']
-                if client_name in retry_list:
-                    client_config = clients[client]
-                    if retry_count == 0:
-                        # If on the last attempt, accept a health level of yellow
-                        message = "Accounting operation failed.\n\nDue to failing 10 times, the health level was set to " + settings['accounting']['fallback_health_check_level'] + " and ran for client " + clients[client]['client_name'] + ". \n\nThis is not optimal. Please check to see if data should be purged and re-inserted with a green cluster."
-                        send_notification(clients[client], "accounting", "Failed", message, jira=settings['accounting']['ms-teams'], teams=settings['accounting']['jira'])
-                    # If client set at command line only run it otherwise
-                    # execute for all clients
-                    if manual_client == "" or client_name == manual_client:
-                        # Trigger calculate accounting process
-                        result = calculate_accounting(client_config, client_name)
-                        if result:
-                            # Remove successful client from retry_list
-                            retry_list.remove(clients[client]['client_name'])
-                        else:
-                            print("Client " + client_name + " did not process correctly.")
-                            if retry_count == 0:
-                                if notification:
-                                    message = "Accounting operation failed.\n\nIt is also possible that connections are unable to be made to the client/nginx node. Please fix.\n\nRemember that in order for client's to be properly build you will need to get their cluster status to **Green** and then re-run the following command:\n\npython3 /opt/cloud_operations/accounting.py --client " + client_name + "\n\nIf a green cluster is not possible by end of day, please run the following command to force run with a different color cluster:\n\npython3 /opt/cloud_operations/accounting.py --client " + client_name + " --health yellow"
-                                    send_notification(client_config, "accounting", "Failed", message, jira=settings['accounting']['ms-teams'], teams=settings['accounting']['jira'])
-            # Lower the retry_count by 1
-            retry_count = retry_count - 1
-            if retry_count >= 0 and len(retry_list) > 0:
-                print("The below client(s) failed to process. Retry necessary:")
-                print(retry_list)
-                print("Retry count set to " + str(retry_count) + " sleeping for " + str(sleep_time) + " seconds")
-                time.sleep(sleep_time)
+        # If client set at command line only run it otherwise
+        # execute for all clients
+        clients = {
+            client: client_config
+            for client, client_config in clients.items()
+            if manual_client == "" or client_config['client_name'] == manual_client
+        }
+        print("Accounting job processing for:")
+        print(list(clients))
+        run_for_clients('accounting', clients, run_client_accounting)
 
 if __name__ == "__main__":
     import argparse
@@ -5,6 +5,11 @@ from concurrent.futures import ThreadPoolExecutor
 from config import load_configs, load_settings
 #from error import send_notification
 import es
+from policy import get_policy_matcher
+from cluster import get_cluster_snapshot
+from limiter import get_adaptive_limiter
+from fanout import run_for_clients
+from async_engine import gather_bounded, get_engine, run_job_async, run_sync
 
 NOTIFICATION = False
 
@@ -27,129 +32,185 @@ def get_allocation_policy(client_config):
     return index_allocation_policies
 
 
-def allocate_indices(client_config, index, index_allocation_policies):
-    """Processes index allocations per index age
+def get_allocation_settings(client_config, index, index_allocation_policies, snapshot):
+    """Returns the settings that move an index to warm nodes if it is due
 
     Args:
         client_config (dict): Client configuration
         index (str): Index name
         index_allocation_policies (dict): Allocation policy
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
+
+    Returns:
+        dict: Index settings to apply, or None if the index stays put
     """
-    elastic_connection = es.build_es_connection(client_config)
-    newest_record = ""
-    newest_record = es.get_newest_document_date_in_index(
-        client_config, index, elastic_connection)
+    newest_record = snapshot.get_newest_document_date(index)
     # make sure newest record is not empty
-    if newest_record != "":
-        # Get the index specific allocation policy
-        policy = es.check_index_allocation_policy(
-            index, index_allocation_policies)
-        # Get policy allocation days from specific policy
-        policy_days = index_allocation_policies[policy]
-        # Get current datetime
-        current_date = datetime.utcnow()
-        # Figure out how many days since current_date vs. newest_record
-        days_ago = (current_date - newest_record).days
-        # Check if days_ago is greater than or equal to policy date
-        # If greater than or equal to policy date, delete index
-        if days_ago >= policy_days:
-          allocation_type = 'warm'
-        else:
-          allocation_type = 'hot'
-        if allocation_type == 'warm':
-            # Change index allocation per policy
-            index_settings = elastic_connection.indices.get_settings(
-                index=index
-            )
-            index_settings = index_settings[index]['settings']['index']
-            box_type = 'hot'
-            if 'routing' in index_settings:
-                if 'allocation' in index_settings['routing']:
-                    if "include" in index_settings['routing']['allocation']:
-                        if "_tier_preference" in index_settings['routing']['allocation']['include']:
-                            if "data_hot" in index_settings['routing']['allocation']['include']['_tier_preference']:
-                                box_type = "hot"
-                            if "data_warm" in index_settings['routing']['allocation']['include']['_tier_preference']:
-                                box_type = "warm"
-                    if 'require' in index_settings['routing']['allocation']:
-                        if 'box_type' in index_settings['routing']['allocation']['require']:
-                            box_type= index_settings['routing']['allocation']['require']['box_type']
-            if allocation_type != box_type:
-                tier_preference = False
-                if 'routing' in index_settings:
-                  if 'allocation' in index_settings['routing']:
-                    if "include" in index_settings['routing']['allocation']:
-                      if "_tier_preference" in index_settings['routing']['allocation']['include']:
-                        tier_preference = True
-
-                if tier_preference:
-                  print(f"Changing allocation of index {index} to tier preference of data_warm")
-                  elastic_connection.indices.put_settings(
-                    index=index,
-                    body={"index.routing.allocation.include._tier_preference": "data_warm"}
-                  )
-                else:
-                  print(f"Changing allocation of index {index} to box type warm")
-                  elastic_connection.indices.put_settings(
-                    index=index,
-                    body={"index.routing.allocation.require.box_type": allocation_type}
-                  )
-
-    elastic_connection.close()
-
-def apply_allocation_to_indices(indices, index_allocation_policies, client_config):
+    if newest_record == "":
+        return None
+    # Get the index specific allocation policy
+    policy = get_policy_matcher(
+        client_config, 'allocation', index_allocation_policies).match(index)
+    # Get policy allocation days from specific policy
+    policy_days = index_allocation_policies[policy]
+    # Figure out how many days since current_date vs. newest_record
+    days_ago = (datetime.utcnow() - newest_record).days
+    # Check if days_ago is greater than or equal to policy date
+    if days_ago < policy_days:
+        return None
+    allocation_type = 'warm'
+    # Change index allocation per policy
+    index_settings = snapshot.get_index_settings(index)
+    box_type = 'hot'
+    tier_preference = False
+    if 'routing' in index_settings:
+        if 'allocation' in index_settings['routing']:
+            if "include" in index_settings['routing']['allocation']:
+                if "_tier_preference" in index_settings['routing']['allocation']['include']:
+                    tier_preference = True
+                    if "data_hot" in index_settings['routing']['allocation']['include']['_tier_preference']:
+                        box_type = "hot"
+                    if "data_warm" in index_settings['routing']['allocation']['include']['_tier_preference']:
+                        box_type = "warm"
+            if 'require' in index_settings['routing']['allocation']:
+                if 'box_type' in index_settings['routing']['allocation']['require']:
+                    box_type= index_settings['routing']['allocation']['require']['box_type']
+    if allocation_type == box_type:
+        return None
+    if tier_preference:
+        return {"index.routing.allocation.include._tier_preference": "data_warm"}
+    return {"index.routing.allocation.require.box_type": allocation_type}
+
+
+def print_allocation_change(index, body):
+    """Prints the allocation change about to be made to an index"""
+    if "index.routing.allocation.include._tier_preference" in body:
+        print(f"Changing allocation of index {index} to tier preference of data_warm")
+    else:
+        print(f"Changing allocation of index {index} to box type warm")
+
+
+def allocate_indices(client_config, index, index_allocation_policies, snapshot):
+    """Processes index allocations per index age
+
+    Args:
+        client_config (dict): Client configuration
+        index (str): Index name
+        index_allocation_policies (dict): Allocation policy
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
+    """
+    body = get_allocation_settings(
+        client_config, index, index_allocation_policies, snapshot)
+    if body is not None:
+        apply_allocation_settings(client_config, index, body)
+
+
+def apply_allocation_settings(client_config, index, body):
+    """Applies allocation settings to an index
+
+    Args:
+        client_config (dict): Client configuration
+        index (str): Index name
+        body (dict): Result of get_allocation_settings
+
+    Returns:
+        bool: True if the settings change was acknowledged
+    """
+    print_allocation_change(index, body)
+    elastic_connection = es.get_es_connection(client_config)
+    status = elastic_connection.indices.put_settings(index=index, body=body)
+    return es.check_acknowledged_true(status)
+
+
+def apply_allocation_to_indices(indices, index_allocation_policies, client_config, snapshot):
     """Get indices and submit for allocation
 
     Args:
         indices (array): List of indices
         index_allocation_policies (dict): Allocation policy
         client_config (dict): Client configuration
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
 
     """
-    elastic_connection = es.build_es_connection(client_config)
-    with ThreadPoolExecutor(
-        max_workers=es.get_lowest_data_node_thread_count(client_config)
-    ) as executor:
+    limiter = get_adaptive_limiter(client_config, 'allocation')
+    special_indices = snapshot.get_special_indices()
+    with ThreadPoolExecutor(max_workers=limiter.max_limit) as executor:
         for index in indices:
             index = str(index['index'])
             # Only proceed if index is not a special index
-            if not es.check_special_index(index):
+            if index not in special_indices:
                 executor.submit(
-                    allocate_indices, client_config, index, index_allocation_policies)
-    elastic_connection.close()
+                    limiter.run, allocate_indices, client_config, index, index_allocation_policies, snapshot)
+
+def apply_allocation_to_client(client_config):
+    """Apply allocation policies to one client
+
+    Args:
+        client_config (dict): Client configuration
+    """
+    print("Processing allocation for " + client_config['client_name'])
+    # Grab the client's allocation policies
+    index_allocation_policies = get_allocation_policy(client_config)
+    # Next, get information on all current indices in cluster
+    snapshot = get_cluster_snapshot(client_config, 'allocation')
+    # Get the list of indices that are older than the retention policy
+    apply_allocation_to_indices(
+        snapshot.indices, index_allocation_policies, client_config, snapshot)
+
+async def apply_allocation_to_client_async(client_config, snapshot, connection, limit):
+    """Apply allocation policies to one client on the asyncio engine
 
-def apply_allocation_policies(client_config=""):
+    Args:
+        client_config (dict): Client configuration
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
+        connection (AsyncElasticsearch): Async client
+        limit (asyncio.Semaphore): In-flight request limit
+    """
+    print("Processing allocation for " + client_config['client_name'])
+    index_allocation_policies = get_allocation_policy(client_config)
+    # Load newest document dates before deciding so no request blocks the loop
+    await run_sync(snapshot.get_newest_document_dates)
+    changes = []
+    special_indices = snapshot.get_special_indices()
+    for index in snapshot.indices:
+        index = str(index['index'])
+        if index in special_indices:
+            continue
+        body = get_allocation_settings(
+            client_config, index, index_allocation_policies, snapshot)
+        if body is not None:
+            print_allocation_change(index, body)
+            changes.append(connection.indices.put_settings(index=index, body=body))
+    await gather_bounded(limit, changes)
+
+def apply_allocation_policies(manual_client=""):
     """Apply allocation policies
 
     Args:
-        manual_client (str, optional): Client configuration. Defaults to "".
+        manual_client (str, optional): Name of client. Defaults to "".
     """
 
     client_settings = load_settings()
-    if 'allocation' not in client_settings:
-        client_settings['allocation'] = {
-            'enabled': False
-        }
+    if 'allocation' in client_settings:
+        allocation_enabled = client_settings['allocation']['enabled']
+    else:
+        allocation_enabled = False
         print("Allocation not enabled in settings.toml")
     limit_to_client = client_settings['settings']['limit_to_client']
-    if client_settings['allocation']['enabled']:
+    if allocation_enabled:
         # Load all client configurations from /opt/maintenance/*.json
-        clients = load_configs()
-        # Loop through each client to perform accounting per client
-        for key, client_config in clients.items():
-            client_name = key
-            print("Processing allocation for " + client_name)
-            # If client set at command line only run it otherwise
-            # execute for all clients
-            if limit_to_client == client_name or limit_to_client == "":
-                # Grab the client's allocation policies
-                index_allocation_policies = get_allocation_policy(
-                    client_config)
-                # Next, get information on all current indices in cluster
-                indices = es.es_get_indices(client_config)
-                # Get the list of indices that are older than the retention policy
-                apply_allocation_to_indices(
-                    indices, index_allocation_policies, client_config)
+        clients = load_configs(manual_client)
+        # If client set at command line only run it otherwise
+        # execute for all clients
+        clients = {
+            client_name: client_config
+            for client_name, client_config in clients.items()
+            if limit_to_client == client_name or limit_to_client == ""
+        }
+        if get_engine('allocation') == "asyncio":
+            run_job_async('allocation', clients, apply_allocation_to_client_async)
+        else:
+            run_for_clients('allocation', clients, apply_allocation_to_client)
 
 if __name__ == "__main__":
     import argparse
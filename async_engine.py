@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""Optional asyncio engine that runs lifecycle jobs on one event loop"""
+import asyncio
+import atexit
+import threading
+import traceback
+from functools import partial
+import es
+from cluster import get_cluster_snapshot, get_worker_count
+from config import load_settings
+from fanout import get_client_timeout, get_max_concurrent_clients, \
+    running_clients, running_clients_lock
+
+# One event loop, running in its own thread, shared by every job and client
+event_loop = None
+event_loop_lock = threading.Lock()
+
+# Only used from the event loop thread
+async_connections = {}
+client_semaphore = None
+
+
+def get_engine(job):
+    """Returns threads or asyncio for a job
+
+    Uses settings.<job>.engine, then settings.engine, and defaults to
+    threads.
+
+    Args:
+        job (str): Job name such as retention or rollover
+
+    Returns:
+        str: Engine name
+    """
+    settings = load_settings()
+    if job in settings and 'engine' in settings[job]:
+        return settings[job]['engine']
+    if 'engine' in settings['settings']:
+        return settings['settings']['engine']
+    return "threads"
+
+
+def get_event_loop():
+    """Returns the shared event loop, starting its thread if needed"""
+    global event_loop
+    with event_loop_lock:
+        if event_loop is None:
+            event_loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=event_loop.run_forever, name="ilm-asyncio", daemon=True
+            ).start()
+        return event_loop
+
+
+async def run_sync(function, *args):
+    """Runs a blocking function in the default thread pool
+
+    Used for cluster snapshots and notifications so they never block the
+    event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(function, *args))
+
+
+async def get_async_connection(client_config):
+    """Returns a client's async connection, rebuilding it if its config changed
+
+    Args:
+        client_config (dict): Client configuration
+
+    Returns:
+        AsyncElasticsearch: Async client
+    """
+    _, fingerprint = es.get_connection_key(client_config, 10)
+    client_name = client_config['client_name']
+    if client_name in async_connections:
+        connection_fingerprint, connection = async_connections[client_name]
+        if connection_fingerprint == fingerprint:
+            return connection
+        await connection.close()
+    connection = es.build_async_es_connection(client_config)
+    async_connections[client_name] = (fingerprint, connection)
+    return connection
+
+
+async def close_async_connections_async():
+    """Closes every async connection"""
+    for _, connection in async_connections.values():
+        try:
+            await connection.close()
+        except Exception:
+            pass
+    async_connections.clear()
+
+
+def close_async_connections():
+    """Closes every async connection from outside the event loop"""
+    if event_loop is not None and event_loop.is_running():
+        asyncio.run_coroutine_threadsafe(
+            close_async_connections_async(), event_loop).result(timeout=10)
+
+
+atexit.register(close_async_connections)
+
+
+async def gather_bounded(limit, coroutines):
+    """Awaits coroutines with at most the semaphore's limit in flight
+
+    Failures are printed and returned instead of cancelling the rest.
+
+    Args:
+        limit (asyncio.Semaphore): In-flight request limit
+        coroutines (list): Coroutines making cluster requests
+
+    Returns:
+        list: Results or exceptions in the same order as coroutines
+    """
+    async def bounded(coroutine):
+        async with limit:
+            return await coroutine
+
+    results = await asyncio.gather(
+        *[bounded(coroutine) for coroutine in coroutines],
+        return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            traceback.print_exception(type(result), result, result.__traceback__)
+    return results
+
+
+async def run_client(job, client_config, client_coroutine):
+    """Runs a job's coroutine for one client within its timeout
+
+    Args:
+        job (str): Job name
+        client_config (dict): Client configuration
+        client_coroutine (function): Async function taking the client
+            configuration, cluster snapshot, async connection and a
+            semaphore sized to the job's worker count
+    """
+    global client_semaphore
+    if client_semaphore is None:
+        client_semaphore = asyncio.Semaphore(get_max_concurrent_clients())
+    async with client_semaphore:
+        snapshot = await run_sync(get_cluster_snapshot, client_config, job)
+        limit = asyncio.Semaphore(
+            await run_sync(get_worker_count, client_config, job))
+        connection = await get_async_connection(client_config)
+        await asyncio.wait_for(
+            client_coroutine(client_config, snapshot, connection, limit),
+            get_client_timeout(job)
+        )
+
+
+async def run_clients(job, clients, client_coroutine):
+    """Runs a job for every client on the event loop
+
+    Returns:
+        dict: Client name mapped to success, failed or timeout
+    """
+    names = list(clients)
+    outcomes = await asyncio.gather(
+        *[run_client(job, clients[name], client_coroutine) for name in names],
+        return_exceptions=True
+    )
+    results = {}
+    for client_name, outcome in zip(names, outcomes):
+        if isinstance(outcome, asyncio.TimeoutError):
+            print(f"{job} for {client_name} exceeded its timeout and was cancelled")
+            results[client_name] = 'timeout'
+        elif isinstance(outcome, BaseException):
+            print(f"{job} failed for {client_name}: {outcome}")
+            traceback.print_exception(type(outcome), outcome, outcome.__traceback__)
+            results[client_name] = 'failed'
+        else:
+            results[client_name] = 'success'
+    return results
+
+
+def run_job_async(job, clients, client_coroutine):
+    """Runs a job for every client on the shared event loop and waits
+
+    The asyncio counterpart of fanout.run_for_clients. Clients are bounded
+    by settings.max_concurrent_clients across all jobs on the loop and each
+    client's requests by the job's worker count. Unlike threads, a client
+    that exceeds its timeout is cancelled.
+
+    Args:
+        job (str): Job name such as retention or rollover
+        clients (dict): Client name mapped to client configuration
+        client_coroutine (function): Async function taking the client
+            configuration, cluster snapshot, async connection and semaphore
+
+    Returns:
+        dict: Client name mapped to success, failed, timeout or skipped
+    """
+    results = {}
+    pending = {}
+    for client_name, client_config in clients.items():
+        with running_clients_lock:
+            if (job, client_name) in running_clients:
+                print(f"Skipping {job} for {client_name} as a previous run " +
+                      "is still in progress")
+                results[client_name] = 'skipped'
+                continue
+            running_clients.add((job, client_name))
+        pending[client_name] = client_config
+    try:
+        if len(pending) != 0:
+            results.update(asyncio.run_coroutine_threadsafe(
+                run_clients(job, pending, client_coroutine), get_event_loop()
+            ).result())
+    finally:
+        with running_clients_lock:
+            for client_name in pending:
+                running_clients.discard((job, client_name))
+    return results
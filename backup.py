@@ -3,7 +3,9 @@ from dateutil import parser as dateparser
 import json
 from datetime import datetime
 import es
+from cluster import get_cluster_snapshot
 from config import load_configs, load_settings, retry
+from fanout import run_for_clients
 from error import send_notification
 import os
 import re
@@ -34,16 +36,14 @@ def validate_backup_repo_exists(client_config, repository):
         [bool]: [Does backup repository exist]
     """
     try:
-        elastic_connection = es.build_es_connection(client_config)
+        elastic_connection = es.get_es_connection(client_config)
         repositories = elastic_connection.cat.repositories(format='json')
-        elastic_connection.close()
         for record in repositories:
             if repository == record['id']:
                 print(
                     f"Backup repository {repository} exists and is registered")
                 return True
     except Exception as e:
-        elastic_connection.close()
         print("Operation failed - Validate backup repo exists")
         raise Exception(e)
     # If it makes it this far the repo does not exist, fail
@@ -107,16 +107,13 @@ def get_snapshots_in_repository(client_config, repository):
     Returns:
         [dict]: [Dictionary of all snapshot information]
     """
-    elastic_connection = es.build_es_connection(client_config)
+    elastic_connection = es.get_es_connection(client_config)
     snapshots = {'snapshots': []}
     try:
         snapshots = elastic_connection.snapshot.get(repository, '_all')
-        elastic_connection.close()
     except Exception as e:
-        elastic_connection.close()
         print("Operation failed - Get snapshots from " + repository)
         raise Exception(e)
-    elastic_connection.close()
     return snapshots
 
 
@@ -136,11 +133,10 @@ def delete_snapshot_in_repository(client_config, repository, snapshot):
     Return:
         ([bool]): [Did snapshot get removed]
     """
-    elastic_connection = es.build_es_connection(client_config)
+    elastic_connection = es.get_es_connection(client_config)
     try:
         delete_status = elastic_connection.snapshot.delete(
             repository, snapshot=snapshot)
-        elastic_connection.close()
         if 'acknowledged' in delete_status:
             if delete_status['acknowledged'] == True:
                 print("Snapshot " + snapshot + " deleted successfully")
@@ -149,7 +145,6 @@ def delete_snapshot_in_repository(client_config, repository, snapshot):
                 print("Snapshot " + snapshot + " failed to delete successfully")
                 return False
     except Exception as e:
-        elastic_connection.close()
         print("Operation failed - Delete snapshot " +
               snapshot + " from " + repository)
         raise Exception(e)
@@ -256,10 +251,9 @@ def take_snapshot(client_config, repository, snapshot, body):
             print("Repository is " + repository +
                   "| snapshot is " + snapshot_name + " | body is:")
             print(json.dumps(body))
-        elastic_connection = es.build_es_connection(client_config)
+        elastic_connection = es.get_es_connection(client_config)
         backup_job = elastic_connection.snapshot.create(
             repository, snapshot_name, body, wait_for_completion=False, request_timeout=30)
-        elastic_connection.close()
         if 'accepted' in backup_job:
             if backup_job['accepted']:
                 return True
@@ -268,7 +262,6 @@ def take_snapshot(client_config, repository, snapshot, body):
                 return False
 
     except Exception as e:
-        elastic_connection.close()
         print("Operation failed - Create snapshot " +
               snapshot + " for repo " + repository)
         raise Exception(e)
@@ -296,14 +289,13 @@ def get_indices_within_limit_age(client_config, indices, limit_age):
     indices_within_limit_age = []
     body = '{"aggs": {"indices": {"terms": {"field": "_index","order": {"1": "desc"},"size": 50000},"aggs": {"1": {"max": {"field": "@timestamp"}}}}},"size": 0,"_source": {"excludes": []}}'
 
+    elastic_connection = es.get_es_connection(client_config)
     for index in indices:
-        elastic_connection = es.build_es_connection(client_config)
         try:
             if DEBUG_ENABLED == "1":
                 print("Index is " + index)
                 print(f"Limit age is {limit_age}\nBody is\n{body}")
             result = elastic_connection.search(index=index + "*", body=body)
-            elastic_connection.close()
             if DEBUG_ENABLED == "1":
                 print(result)
             for index in result['aggregations']['indices']['buckets']:
@@ -317,7 +309,6 @@ def get_indices_within_limit_age(client_config, indices, limit_age):
                 if seconds_ago <= limit_age:
                     indices_within_limit_age.append(index_name)
         except Exception as e:
-            elastic_connection.close()
             raise Exception(e)
     return indices_within_limit_age
 
@@ -349,7 +340,8 @@ def modify_indices_to_string(indices, wildcard=False):
 def take_snapshot_per_policies(client_config, job, backup_policy, repository, include_special=False):
     # Global backup grabs all indices
     if job == 'global':
-        indices = es.get_write_alias_names(client_config)
+        indices = get_cluster_snapshot(
+            client_config, 'backup').get_write_alias_names()
         if 'limit_age' in backup_policy:
             indices = get_indices_within_limit_age(
                 client_config, indices, backup_policy['limit_age'])
@@ -397,6 +389,40 @@ def take_snapshot_per_policies(client_config, job, backup_policy, repository, in
                               teams=settings['backup']['ms-teams'], jira=settings['backup']['jira'])
 
 
+def run_client_backup(client_config):
+    """Runs backup job for one client
+
+    Args:
+        client_config (dict): Client configuration
+    """
+    if validate_backup_enabled(client_config):
+        # Get repositories listed in backup policy section
+        repositories = get_repositories(client_config)
+        # Loop through each repository to process backups
+        for repository in repositories:
+            if validate_backup_repo_exists(client_config, repository):
+                # Get Backup policy for each repository
+                backup_policy = get_backup_policy(
+                    client_config, repository)
+                # Loop through each backup job found in policy
+                for job in backup_policy:
+                    if backup_policy[job] != 0:
+                        print(
+                            f"Processing backups for repository {repository} with job of {job}")
+                        apply_backup_retention_policies(
+                            client_config, job, backup_policy[job], repository)
+                        if 'include_special' in backup_policy:
+                            take_snapshot_per_policies(
+                                client_config, job, backup_policy[job], repository, include_special=backup_policy[job]['include_special'])
+                        else:
+                            take_snapshot_per_policies(
+                                client_config, job, backup_policy, repository)
+            else:
+                print(f"Backup repo not found - {repository}")
+    else:
+        print("Backups not enabled")
+
+
 def run_backup(manual_client=""):
     """[summary]
     Runs backup job for specific client configuration
@@ -405,36 +431,12 @@ def run_backup(manual_client=""):
         manual_client ([dict]): [Client configuration for one client]
     """
     clients = load_configs(manual_client)
-    for client in clients:
-        if settings['settings']['limit_to_client'] == client or settings['settings']['limit_to_client'] == "":
-            client_config = clients[client]
-
-            if validate_backup_enabled(client_config):
-                # Get repositories listed in backup policy section
-                repositories = get_repositories(client_config)
-                # Loop through each repository to process backups
-                for repository in repositories:
-                    if validate_backup_repo_exists(client_config, repository):
-                        # Get Backup policy for each repository
-                        backup_policy = get_backup_policy(
-                            client_config, repository)
-                        # Loop through each backup job found in policy
-                        for job in backup_policy:
-                            if backup_policy[job] != 0:
-                                print(
-                                    f"Processing backups for repository {repository} with job of {job}")
-                                apply_backup_retention_policies(
-                                    client_config, job, backup_policy[job], repository)
-                                if 'include_special' in backup_policy:
-                                    take_snapshot_per_policies(
-                                        client_config, job, backup_policy[job], repository, include_special=backup_policy[job]['include_special'])
-                                else:
-                                    take_snapshot_per_policies(
-                                        client_config, job, backup_policy, repository)
-                    else:
-                        print(f"Backup repo not found - {repository}")
-            else:
-                print("Backups not enabled")
+    clients = {
+        client: client_config
+        for client, client_config in clients.items()
+        if settings['settings']['limit_to_client'] == client or settings['settings']['limit_to_client'] == ""
+    }
+    run_for_clients('backup', clients, run_client_backup)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,581 @@
+#!/usr/bin/env python3
+"""Shared cluster metadata snapshot used by all lifecycle jobs"""
+import os
+import json
+import threading
+import time
+from datetime import datetime
+import es
+from config import base_dir, load_settings
+
+# Fields pulled from _cat/indices. Matches es.es_get_indices
+INDEX_FIELDS = (
+    "health", "status", "index", "uuid", "shardsPrimary", "shardsReplica",
+    "docsCount", "docsDeleted", "storeSize", "creation.date.string",
+    "creation.date", "memory.total", "pri.store.size"
+)
+
+EPOCH = datetime(1970, 1, 1)
+
+# Cluster thread pool that limits each job's concurrent requests
+JOB_THREAD_POOLS = {
+    'retention': 'management',
+    'allocation': 'management',
+    'rollover': 'management',
+    'forcemerge': 'force_merge',
+    'backup': 'snapshot',
+    'search': 'search'
+}
+MAX_WORKERS = 100
+
+snapshot_registry = {}
+topology_registry = {}
+snapshot_registry_lock = threading.Lock()
+snapshot_build_locks = {}
+
+
+class ClusterTopology:
+    """Node roles, tiers, attributes and thread pool sizes of a cluster
+
+    Topology changes rarely so it is cached separately from the cluster
+    snapshot and refreshed after settings.topology_ttl_seconds.
+    """
+
+    def __init__(self, client_config):
+        elastic_connection = es.get_es_connection(client_config)
+        self.nodes = elastic_connection.nodes.info(
+            metric="settings,thread_pool")['nodes']
+        self.created = time.monotonic()
+
+    def age(self):
+        """Returns the age of the topology in seconds"""
+        return time.monotonic() - self.created
+
+    def get_data_nodes(self):
+        """Returns node ids of nodes holding data"""
+        return [node_id for node_id, node in self.nodes.items()
+                if any(role.startswith('data') for role in node['roles'])]
+
+    def get_master_nodes(self):
+        """Returns node ids of master eligible nodes"""
+        return [node_id for node_id, node in self.nodes.items()
+                if 'master' in node['roles']]
+
+    def get_node_tier(self, node_id):
+        """Returns hot, warm, cold, frozen or content for a node
+
+        Uses data tier roles and falls back to the box_type attribute
+        used by older allocation policies.
+        """
+        node = self.nodes[node_id]
+        for tier in ('hot', 'warm', 'cold', 'frozen', 'content'):
+            if f"data_{tier}" in node['roles']:
+                return tier
+        if 'attributes' in node and 'box_type' in node['attributes']:
+            return node['attributes']['box_type']
+        return 'hot'
+
+    def get_minimum_version(self):
+        """Returns the oldest node version as a tuple such as (7, 10, 2)"""
+        versions = []
+        for node in self.nodes.values():
+            if 'version' in node:
+                versions.append(tuple(
+                    int(part) for part in node['version'].split('-')[0].split('.')
+                    if part.isdigit()))
+        return min(versions) if len(versions) != 0 else None
+
+    def get_thread_pool_size(self, node_id, pool):
+        """Returns the maximum thread count of a node's thread pool"""
+        thread_pool = self.nodes[node_id].get('thread_pool', {}).get(pool, {})
+        # Scaling pools report max, fixed pools report size
+        if 'max' in thread_pool:
+            return thread_pool['max']
+        if 'size' in thread_pool:
+            return thread_pool['size']
+        return 1
+
+    def get_worker_count(self, job):
+        """Returns how many concurrent requests a job should make
+
+        Master level operations (deletes, settings updates and rollovers)
+        are limited by the smallest management pool of the master eligible
+        nodes. Forcemerge, snapshot and search work runs on data nodes so
+        those jobs use settings.cluster_thread_pool_share of the combined
+        pool size across data nodes. settings.<job>.max_workers caps it.
+
+        Args:
+            job (str): Job name such as retention or forcemerge
+
+        Returns:
+            int: Number of workers
+        """
+        settings = load_settings()
+        pool = JOB_THREAD_POOLS.get(job, 'management')
+        if pool == 'management':
+            node_ids = self.get_master_nodes() or list(self.nodes)
+            workers = min(
+                self.get_thread_pool_size(node_id, pool) for node_id in node_ids)
+        else:
+            if 'cluster_thread_pool_share' in settings['settings']:
+                share = settings['settings']['cluster_thread_pool_share']
+            else:
+                share = 0.5
+            node_ids = self.get_data_nodes() or list(self.nodes)
+            workers = round(share * sum(
+                self.get_thread_pool_size(node_id, pool) for node_id in node_ids))
+        max_workers = MAX_WORKERS
+        if job in settings and 'max_workers' in settings[job]:
+            max_workers = settings[job]['max_workers']
+        return int(max(1, min(max_workers, workers)))
+
+
+class ClusterSnapshot:
+    """Point in time view of a client cluster's metadata
+
+    Built with a fixed number of requests regardless of how many jobs
+    consume it: _cat/indices, _cat/aliases, _data_stream and index settings.
+    Node information comes from the longer lived ClusterTopology cache.
+    """
+
+    def __init__(self, client_config):
+        self.client_name = client_config['client_name']
+        elastic_connection = es.get_es_connection(client_config)
+        indices = elastic_connection.cat.indices(
+            format="json", h=INDEX_FIELDS, s="creation.date", bytes="b")
+        self.aliases = elastic_connection.cat.aliases(format="json")
+        try:
+            self.data_streams = elastic_connection.indices.get_data_stream(
+                name="*")['data_streams']
+        except Exception:
+            # Clusters without data stream support
+            self.data_streams = []
+        self.index_settings = elastic_connection.indices.get_settings(
+            index="*", name="index.routing.allocation.*", expand_wildcards="all")
+        self.topology = get_cluster_topology(client_config)
+        self.nodes = self.topology.nodes
+        self.created = time.monotonic()
+        # Wall clock time the metadata was read, for comparing across snapshots
+        self.captured = time.time()
+        self.client_config = client_config
+        self.newest_records = None
+        self.newest_records_lock = threading.Lock()
+        self.index_groups = None
+        self.index_group_by_name = None
+        self.segment_counts = None
+        self.segment_counts_lock = threading.Lock()
+        self.data_stream_stats = None
+        self.data_stream_stats_lock = threading.Lock()
+        self.special_indices = None
+        self.special_indices_lock = threading.Lock()
+        # Retention threads discard indices concurrently. The list form is
+        # rebuilt from indices_by_name on the next read after a change
+        self.indices_lock = threading.Lock()
+        self.indices_by_name = {index['index']: index for index in indices}
+        self.indices_list = indices
+        self.data_streams_by_name = {
+            data_stream['name']: data_stream for data_stream in self.data_streams}
+
+    def age(self):
+        """Returns the age of the snapshot in seconds"""
+        return time.monotonic() - self.created
+
+    @property
+    def indices(self):
+        """_cat/indices records of every index, oldest first"""
+        with self.indices_lock:
+            if self.indices_list is None:
+                self.indices_list = list(self.indices_by_name.values())
+            return self.indices_list
+
+    def get_index(self, index):
+        """Returns _cat/indices information for an index or None"""
+        return self.indices_by_name.get(index)
+
+    def get_index_settings(self, index):
+        """Returns the index section of an index's settings"""
+        if index in self.index_settings:
+            return self.index_settings[index]['settings'].get('index', {})
+        return {}
+
+    def get_data_stream(self, name):
+        """Returns data stream information or None"""
+        return self.data_streams_by_name.get(name)
+
+    def get_index_groups(self):
+        """Returns index groups mapped to their member indices
+
+        Returns:
+            dict: Index group mapped to a list of member index names
+        """
+        with self.indices_lock:
+            self.build_index_groups()
+            # Copied because discard_index edits the member lists in place
+            return {
+                group: list(members)
+                for group, members in self.index_groups.items()
+            }
+
+    def get_index_group(self, index):
+        """Returns the index group of an index from the grouped map
+
+        Names not in the snapshot, such as indices created after it was
+        read, are grouped directly.
+        """
+        with self.indices_lock:
+            self.build_index_groups()
+            group = self.index_group_by_name.get(index)
+        if group is None:
+            group = es.get_index_group(index)
+        return group
+
+    def build_index_groups(self):
+        """Groups the snapshot's indices once. Caller holds indices_lock"""
+        if self.index_groups is None:
+            self.index_groups = es.group_indices(self.indices_by_name)
+            self.index_group_by_name = {
+                index: group
+                for group, members in self.index_groups.items()
+                for index in members
+            }
+
+    def get_special_indices(self):
+        """Returns the index, alias and data stream names jobs should skip
+
+        Classified once per snapshot so every job in a cycle shares it.
+
+        Returns:
+            set: Special index, alias and data stream names
+        """
+        with self.special_indices_lock:
+            if self.special_indices is None:
+                names = set(self.indices_by_name)
+                names.update(alias['alias'] for alias in self.aliases)
+                names.update(self.data_streams_by_name)
+                self.special_indices = es.get_special_indices(
+                    names, self.client_config)
+            return self.special_indices
+
+    def get_write_alias_names(self):
+        """Returns names of all aliases that have a write index"""
+        alias_return = []
+        for alias in self.aliases:
+            if alias['is_write_index'] == 'true':
+                alias_return.append(alias['alias'])
+        return alias_return
+
+    def get_newest_document_dates(self):
+        """Returns the newest document date for every index in the snapshot
+
+        Fetched once per snapshot with a paginated composite aggregation.
+        Indices without an @timestamp field fall back to their creation date.
+
+        Returns:
+            dict: Index name mapped to newest document datetime (UTC)
+        """
+        with self.newest_records_lock:
+            if self.newest_records is None:
+                self.newest_records = self.load_newest_document_dates()
+        return self.newest_records
+
+    def load_newest_document_dates(self):
+        """Looks up newest document dates, reusing cached sealed indices
+
+        Sealed indices (not a write index of an alias or data stream) keep
+        their newest document date in an on-disk cache keyed by index UUID.
+        A cache entry is reused only while the index is still sealed and its
+        document count is unchanged. Everything else is searched.
+
+        Returns:
+            dict: Index name mapped to newest document datetime (UTC)
+        """
+        cache = load_timestamp_cache(self.client_name)
+        write_indices = self.get_write_indices()
+        newest_records = {}
+        indices_to_search = []
+        for index in self.indices:
+            entry = cache.get(index['uuid'])
+            if entry is not None and index['index'] not in write_indices and \
+                    entry['docs_count'] == index['docsCount']:
+                newest_records[index['index']] = datetime.utcfromtimestamp(
+                    entry['newest'])
+            else:
+                indices_to_search.append(index['index'])
+        if len(indices_to_search) != 0:
+            newest_records.update(es.get_newest_document_dates(
+                self.client_config, indices=indices_to_search))
+        for index in indices_to_search:
+            if index not in newest_records:
+                # No @timestamp in index, fallback to index creation date
+                newest_records[index] = datetime.utcfromtimestamp(
+                    int(self.indices_by_name[index]['creation.date']) / 1000)
+        # Rebuild the cache from current indices so deleted UUIDs drop out
+        new_cache = {}
+        for index in self.indices:
+            if index['index'] not in write_indices:
+                new_cache[index['uuid']] = {
+                    'index': index['index'],
+                    'docs_count': index['docsCount'],
+                    'newest': (newest_records[index['index']] - EPOCH).total_seconds()
+                }
+        if new_cache != cache:
+            save_timestamp_cache(self.client_name, new_cache)
+        return newest_records
+
+    def get_write_indices(self):
+        """Returns names of write indices behind aliases and data streams"""
+        write_indices = set()
+        for alias in self.aliases:
+            if alias['is_write_index'] == 'true':
+                write_indices.add(alias['index'])
+        for data_stream in self.data_streams:
+            if len(data_stream['indices']) != 0:
+                write_indices.add(data_stream['indices'][-1]['index_name'])
+        return write_indices
+
+    def get_segment_counts(self):
+        """Returns the number of primary segments of every open index
+
+        Fetched once per snapshot from index segment stats.
+
+        Returns:
+            dict: Index name mapped to primary segment count
+        """
+        with self.segment_counts_lock:
+            if self.segment_counts is None:
+                elastic_connection = es.get_es_connection(self.client_config)
+                stats = elastic_connection.indices.stats(
+                    index="*",
+                    metric="segments",
+                    expand_wildcards="all",
+                    filter_path="indices.*.primaries.segments.count"
+                )
+                self.segment_counts = {
+                    index: index_stats['primaries']['segments']['count']
+                    for index, index_stats in stats.get('indices', {}).items()
+                }
+        return self.segment_counts
+
+    def get_data_stream_stats(self):
+        """Returns _data_stream/_stats for every data stream
+
+        Fetched once per snapshot. Each entry has backing_indices,
+        store_size_bytes and maximum_timestamp (epoch milliseconds).
+
+        Returns:
+            dict: Data stream name mapped to its stats
+        """
+        with self.data_stream_stats_lock:
+            if self.data_stream_stats is None:
+                if len(self.data_streams) == 0:
+                    self.data_stream_stats = {}
+                else:
+                    elastic_connection = es.get_es_connection(self.client_config)
+                    try:
+                        stats = elastic_connection.indices.data_streams_stats(name="*")
+                    except Exception:
+                        # Clusters without data stream stats support
+                        stats = {}
+                    self.data_stream_stats = {
+                        data_stream['data_stream']: data_stream
+                        for data_stream in stats.get('data_streams', [])
+                    }
+        return self.data_stream_stats
+
+    def get_segments_per_shard(self, index):
+        """Returns the average primary segments per shard or None if closed"""
+        segment_count = self.get_segment_counts().get(index)
+        index_info = self.get_index(index)
+        if segment_count is None or index_info is None:
+            return None
+        return segment_count / max(1, int(index_info['shardsPrimary']))
+
+    def get_newest_document_date(self, index):
+        """Returns the newest document date of an index or empty string"""
+        return self.get_newest_document_dates().get(index, "")
+
+    def discard_index(self, index):
+        """Removes a deleted index so later jobs in the cycle skip it"""
+        with self.indices_lock:
+            if self.indices_by_name.pop(index, None) is not None:
+                self.indices_list = None
+                # Drop the index from its group rather than regrouping
+                # every index on the next lookup
+                if self.index_groups is not None:
+                    group = self.index_group_by_name.pop(index)
+                    members = self.index_groups[group]
+                    members.remove(index)
+                    if len(members) == 0:
+                        del self.index_groups[group]
+
+
+def get_timestamp_cache_file(client_name):
+    """Returns the path of a client's newest timestamp cache file
+
+    Args:
+        client_name (str): Client name
+
+    Returns:
+        str: Path to cache file
+    """
+    return get_cache_folder() + '/' + client_name + "_newest_timestamps.cache"
+
+
+def get_cache_folder():
+    """Returns the folder of per client cache files"""
+    settings = load_settings()
+    folder = base_dir
+    if 'timestamp_cache_folder' in settings['settings']:
+        if settings['settings']['timestamp_cache_folder'] != "":
+            folder = settings['settings']['timestamp_cache_folder']
+    return folder
+
+
+def load_index_count(client_name):
+    """Returns the index count saved by a client's last run, 0 if unknown"""
+    count_file = get_cache_folder() + '/' + client_name + "_index_count.cache"
+    try:
+        with open(count_file, encoding='utf_8') as file:
+            return int(file.read())
+    except (OSError, ValueError):
+        return 0
+
+
+def save_index_count(client_name, count):
+    """Saves a client's index count for ordering clients after a restart"""
+    count_file = get_cache_folder() + '/' + client_name + "_index_count.cache"
+    try:
+        with open(count_file + ".tmp", 'w', encoding='utf_8') as file:
+            file.write(str(count))
+        os.replace(count_file + ".tmp", count_file)
+    except OSError:
+        print(f"Unable to write index count {count_file}")
+
+
+def load_timestamp_cache(client_name):
+    """Loads a client's newest timestamp cache
+
+    Args:
+        client_name (str): Client name
+
+    Returns:
+        dict: Index UUID mapped to index, docs_count and newest
+    """
+    cache_file = get_timestamp_cache_file(client_name)
+    if not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file, encoding='utf_8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        print(f"Unable to read timestamp cache {cache_file}. Rebuilding")
+        return {}
+
+
+def save_timestamp_cache(client_name, cache):
+    """Writes a client's newest timestamp cache
+
+    Args:
+        client_name (str): Client name
+        cache (dict): Index UUID mapped to index, docs_count and newest
+    """
+    cache_file = get_timestamp_cache_file(client_name)
+    try:
+        # Write to a temporary file first so a crash never leaves a
+        # partially written cache behind
+        with open(cache_file + ".tmp", 'w', encoding='utf_8') as file:
+            json.dump(cache, file)
+        os.replace(cache_file + ".tmp", cache_file)
+    except OSError:
+        print(f"Unable to write timestamp cache {cache_file}")
+
+
+def get_snapshot_max_age(job=""):
+    """Returns how stale a snapshot may be before it is rebuilt
+
+    Args:
+        job (str, optional): settings.toml section of the job. Defaults to "".
+
+    Returns:
+        int: Maximum snapshot age in seconds
+    """
+    settings = load_settings()
+    if job in settings and 'snapshot_max_age_seconds' in settings[job]:
+        return settings[job]['snapshot_max_age_seconds']
+    if 'cluster_snapshot_ttl_seconds' in settings['settings']:
+        return settings['settings']['cluster_snapshot_ttl_seconds']
+    return 300
+
+
+def get_cluster_topology(client_config):
+    """Returns a client's cluster topology, refreshing it after its TTL
+
+    Args:
+        client_config (dict): Client configuration
+
+    Returns:
+        ClusterTopology: Cluster topology
+    """
+    settings = load_settings()
+    if 'topology_ttl_seconds' in settings['settings']:
+        max_age = settings['settings']['topology_ttl_seconds']
+    else:
+        max_age = 3600
+    client_name = client_config['client_name']
+    with snapshot_registry_lock:
+        topology = topology_registry.get(client_name)
+    if topology is None or topology.age() > max_age:
+        topology = ClusterTopology(client_config)
+        with snapshot_registry_lock:
+            topology_registry[client_name] = topology
+    return topology
+
+
+def get_worker_count(client_config, job):
+    """Returns the number of workers a job should use for a client
+
+    Args:
+        client_config (dict): Client configuration
+        job (str): Job name such as retention or forcemerge
+
+    Returns:
+        int: Number of workers
+    """
+    return get_cluster_topology(client_config).get_worker_count(job)
+
+
+def get_cluster_snapshot(client_config, job=""):
+    """Returns a cluster snapshot for a client, building one if needed
+
+    Args:
+        client_config (dict): Client configuration
+        job (str, optional): Job requesting the snapshot. Defaults to "".
+
+    Returns:
+        ClusterSnapshot: Cluster metadata snapshot
+    """
+    client_name = client_config['client_name']
+    max_age = get_snapshot_max_age(job)
+    with snapshot_registry_lock:
+        if client_name not in snapshot_build_locks:
+            snapshot_build_locks[client_name] = threading.Lock()
+        build_lock = snapshot_build_locks[client_name]
+    # Only one thread builds a client's snapshot, other jobs wait for it
+    with build_lock:
+        with snapshot_registry_lock:
+            snapshot = snapshot_registry.get(client_name)
+        if snapshot is None or snapshot.age() > max_age:
+            snapshot = ClusterSnapshot(client_config)
+            with snapshot_registry_lock:
+                snapshot_registry[client_name] = snapshot
+    return snapshot
+
+
+def invalidate_cluster_snapshot(client_config):
+    """Drops a client's snapshot so the next job rebuilds it
+
+    Args:
+        client_config (dict): Client configuration
+    """
+    with snapshot_registry_lock:
+        snapshot_registry.pop(client_config['client_name'], None)
@@ -2,9 +2,13 @@
 import os
 import json
 import sys
+import hashlib
 import toml
 from functools import wraps
+from types import MappingProxyType
+import threading
 import time
+from policy import compile_client_policies
 
 base_dir = os.path.abspath(os.path.dirname(__file__))
 if "base_dir" not in locals():
@@ -19,6 +23,14 @@ if not os.path.exists(settings_file):
     print("settings.toml not found - exiting")
     exit()
 
+settings_cache = {'key': None, 'settings': None, 'checked': 0}
+settings_cache_lock = threading.Lock()
+
+# Parsed client JSON files keyed by path and the clients indexed by name
+client_file_cache = {}
+client_store = {'clients': {}, 'checked': 0}
+client_store_lock = threading.Lock()
+
 def retry(ExceptionToCheck, tries=5, delay=1, backoff=1, logger=None):
     """Retry calling the decorated function using an exponential backoff.
 
@@ -61,48 +73,155 @@ def retry(ExceptionToCheck, tries=5, delay=1, backoff=1, logger=None):
 
     return deco_retry
 
+def freeze_settings(value):
+    """Converts parsed settings into read-only mappings and tuples
+
+    Args:
+        value (object): Parsed TOML value
+
+    Returns:
+        object: Read-only copy of value
+    """
+    if isinstance(value, dict):
+        return MappingProxyType(
+            {key: freeze_settings(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze_settings(item) for item in value)
+    return value
+
 def load_settings(format='toml'):
+    """Loads settings.toml
+
+    TOML settings are cached in-process and only re-parsed when the file's
+    inode, mtime or size changes. The file is stat'ed at most once per
+    second. Callers receive a read-only snapshot so every thread working
+    from the same snapshot sees a consistent view even if the file changes.
+
+    Args:
+        format (str, optional): toml or bytes. Defaults to 'toml'.
+
+    Returns:
+        MappingProxyType: Read-only settings, or bytes of the settings file
+    """
     if format == 'toml':
-        settings = toml.load(settings_file)
-        if settings['settings']['client_json_folder'] == "":
-            settings['settings']['client_json_folder'] = base_dir
-        return settings
+        with settings_cache_lock:
+            now = time.monotonic()
+            if settings_cache['settings'] is not None and \
+                    now - settings_cache['checked'] < 1:
+                return settings_cache['settings']
+            stat = os.stat(settings_file)
+            key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if settings_cache['key'] != key:
+                settings = toml.load(settings_file)
+                if settings['settings']['client_json_folder'] == "":
+                    settings['settings']['client_json_folder'] = base_dir
+                settings_cache['settings'] = freeze_settings(settings)
+                settings_cache['key'] = key
+            settings_cache['checked'] = now
+            return settings_cache['settings']
     if format == 'bytes':
         with open(settings_file, "rb") as file:
             read_bytes = file.read()  # read entire file as bytes
         return read_bytes
 
+def load_client_file(path, key):
+    """Parses a client JSON file if its contents changed
+
+    Args:
+        path (str): Path to client JSON file
+        key (tuple): inode, mtime and size of the file
+
+    Returns:
+        dict: Client configuration
+    """
+    entry = client_file_cache.get(path)
+    if entry is not None and entry['key'] == key:
+        return entry['client']
+    with open(path, "rb") as f:
+        contents = f.read()
+    file_hash = hashlib.sha256(contents).hexdigest()
+    if entry is not None and entry['hash'] == file_hash:
+        # File was touched but not changed
+        entry['key'] = key
+        return entry['client']
+    client = json.loads(contents)
+    if 'client_name' not in client:
+        print("File name " + os.path.basename(path) + " does not contain valid client information")
+        sys.exit(1)
+    compile_client_policies(client)
+    client_file_cache[path] = {'key': key, 'hash': file_hash, 'client': client}
+    return client
+
+def refresh_client_configs():
+    """Brings the client config store up to date with the client JSON folder
+
+    Only files whose inode, mtime or size changed are read, and only files
+    whose SHA-256 changed are parsed. The folder is scanned at most once
+    per second.
+
+    Returns:
+        dict: Client name mapped to client configuration
+    """
+    with client_store_lock:
+        now = time.monotonic()
+        if client_store['checked'] != 0 and now - client_store['checked'] < 1:
+            return client_store['clients']
+        settings = load_settings()
+        folder = settings['settings']['client_json_folder']
+        seen = set()
+        clients = {}
+        with os.scandir(folder) as entries:
+            for entry in sorted(entries, key=lambda entry: entry.name):
+                if not entry.name.endswith(".json") or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+                seen.add(entry.path)
+                client = load_client_file(entry.path, key)
+                clients[client['client_name']] = client
+        # Forget files that were removed from the folder
+        for path in list(client_file_cache):
+            if path not in seen:
+                del client_file_cache[path]
+        client_store['clients'] = clients
+        client_store['checked'] = now
+        return clients
+
+def get_client_config(client_name):
+    """Returns one client's configuration by client name
+
+    Args:
+        client_name (str): Client name
+
+    Returns:
+        dict: Client configuration or None if client does not exist
+    """
+    return refresh_client_configs().get(client_name)
+
 def load_configs(client_value=""):
-    settings = load_settings()
-    clients = {}
-    for file in os.listdir(settings['settings']['client_json_folder']):
-        if client_value != "":
-            if file.endswith(".json") and file.startswith(str(client_value)):
-                with open(settings['settings']['client_json_folder'] + '/' + file) as f:
-                    client = json.load(f)
-                if 'client_name' in client:
-                    client_name = client['client_name']
-                else:
-                    print("File name " + file + " does not contain valid client information")
-                    sys.exit(1)
-                clients[client_name] = client
-        else:
-            if file.endswith(".json"):
-                with open(settings['settings']['client_json_folder'] + '/' + file) as f:
-                    client = json.load(f)
-                if 'client_name' in client:
-                    client_name = client['client_name']
-                else:
-                    print("File name " + file + " does not contain valid client information")
-                    sys.exit(1)
-                clients[client_name] = client
-    return clients
+    """Loads client configurations
+
+    Args:
+        client_value (str, optional): Limit to one client name. Defaults to "".
+
+    Returns:
+        dict: Client name mapped to client configuration
+    """
+    if client_value != "":
+        client = get_client_config(client_value)
+        if client is None:
+            return {}
+        return {client_value: client}
+    return dict(refresh_client_configs())
 
 def load_config(client_value=""):
-    settings = load_settings()
-    for file in os.listdir(settings['settings']['client_json_folder']):
-        if client_value != "":
-            if file.endswith(".json") and file.startswith(str(client_value)):
-                with open(settings['settings']['client_json_folder'] + '/' + file) as f:
-                    client = json.load(f)
-                return client
\ No newline at end of file
+    """Loads a single client configuration by client name
+
+    Args:
+        client_value (str, optional): Client name. Defaults to "".
+
+    Returns:
+        dict: Client configuration or None
+    """
+    if client_value != "":
+        return get_client_config(client_value)
@@ -5,6 +5,7 @@ from datetime import datetime, timedelta
 from os.path import exists
 import es
 from config import load_configs, load_settings
+from fanout import run_for_clients
 
 known_index_patterns = [
     {"index": "logstash-f5", "dataset": "loadbalancer", "asset_type": "ip", "fields": ['source.ip']},
@@ -81,7 +82,7 @@ def verify_index_has_data(client_config, known_index, timeframe=1):
             }
         }
     }
-    connection = es.build_es_connection(client_config)
+    connection = es.get_es_connection(client_config)
     result = es.run_search_dsl(
         connection,
         known_index['index'] + "*",
@@ -90,7 +91,6 @@ def verify_index_has_data(client_config, known_index, timeframe=1):
         limit_to_fields=[],
         size=1
     )
-    connection.close()
     if result['hits']['total']['value'] > 0:
         for field in known_index['fields']:
             field_name = validate_field_in_results(field, result['hits']['hits'][0]['_source'])
@@ -111,7 +111,7 @@ def get_historical_day_to_index(client_config, index_pattern, field, date_start,
         date_start (str): Start date
         date_end (str): End date
     """
-    connection = es.build_es_connection(client_config, timeout=120)
+    connection = es.get_es_connection(client_config, timeout=120)
     response = es.aggregate_search(
         connection,
         index_pattern,
@@ -124,7 +124,6 @@ def get_historical_day_to_index(client_config, index_pattern, field, date_start,
         date_end=date_end,
         result_size=5000
     )
-    connection.close()
     return response
 
 def get_unique_field_count_index(client_config, index_pattern, field, date_start, date_end):
@@ -137,7 +136,7 @@ def get_unique_field_count_index(client_config, index_pattern, field, date_start
         date_start (str): Start date
         date_end (str): End date
     """
-    connection = es.build_es_connection(client_config, timeout=120)
+    connection = es.get_es_connection(client_config, timeout=120)
     return es.get_unique_count(connection, index_pattern, field, date_start, date_end)
 
 def process_dataset_accounting(client_config):
@@ -147,6 +146,7 @@ def process_dataset_accounting(client_config):
         client_config (dict): Client configuration
     """
     settings = load_settings()
+    print("Processing dataset accounting for " + client_config['client_name'])
     # Validate if any known index patterns exist and have data
     for known_index in known_index_patterns:
         print(f"Verify if index {known_index['index']} has data for {client_config['client_name']}")
@@ -242,18 +242,16 @@ def run_dataset_accounting(manual_client=""):
     if settings['dataset_accounting']['enabled']:
         # Load all client configurations
         clients = load_configs()
-        # Add all clients initially to retry_list for first run
-        for key, client_config in clients.items():
-            # Set nice variable names
-            client_name = key
-            # If client set at command line only run it otherwise
-            # execute for all clients
-            if manual_client == "" or client_name == manual_client:
-                if settings['settings']['limit_to_client'] == client_name or \
-                        settings['settings']['limit_to_client'] == "":
-                    print("Processing dataset accounting for " + client_name)
-                    # Trigger rollover process
-                    process_dataset_accounting(client_config)
+        # If client set at command line only run it otherwise
+        # execute for all clients
+        clients = {
+            client_name: client_config
+            for client_name, client_config in clients.items()
+            if (manual_client == "" or client_name == manual_client) and
+            (settings['settings']['limit_to_client'] == client_name or
+             settings['settings']['limit_to_client'] == "")
+        }
+        run_for_clients('dataset_accounting', clients, process_dataset_accounting)
 
 if __name__ == "__main__":
     import argparse
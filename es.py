@@ -8,26 +8,39 @@ import re
 import sys
 from itertools import islice
 import ssl
+import threading
+import time
+import atexit
+from functools import lru_cache
 from error import send_jira_event, send_ms_teams_message, send_notification
 import os
-import requests
-from requests.auth import HTTPBasicAuth
 from config import load_settings, retry
+from policy import compile_policy_matcher
 settings = load_settings()
 if os.getenv('ILM_PLATFORM') == 'opensearch':
     from opensearchpy import OpenSearch as Elasticsearch
     from opensearchpy import helpers
     from opensearch_dsl import Search
     from opensearchpy.connection import create_ssl_context
+    from opensearchpy.exceptions import NotFoundError
 else:
     from elasticsearch import Elasticsearch
     from elasticsearch import helpers
     from elasticsearch_dsl import Search
     from elasticsearch.connection import create_ssl_context
+    from elasticsearch.exceptions import NotFoundError
 
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Process-wide connection registry keyed by (client_name, timeout)
+connection_registry = {}
+connection_registry_lock = threading.Lock()
+
+# Requests and bytes exchanged with each client's cluster
+request_stats = {}
+request_stats_lock = threading.Lock()
+
 
 def build_search(es_connection, index, query, sort='@timestamp', limit_to_fields=[]):
     """[summary]
@@ -136,99 +149,37 @@ def multiple_aggregate_search(es_connection, index_pattern, search_query, aggreg
     return list(zip([x['key'] for x in response.aggregations[aggregation_field_one].buckets], [x['key'] for x in response.aggregations[aggregation_field_two].buckets]))
 
 
-def check_index_allocation_policy(index, policies):
-    match_found = 0
-    # This sorts the index allocation policies in descending order,
-    # by length of characters
-    policies = sorted(policies, key=lambda policy: len(policy), reverse=True)
-    for policy in policies:
-        # Ignore global as that's the fallback if no policy is found
-        if policy != "global":
-            if index.startswith(policy):
-                match_found = 1
-                return policy
-    # No policy match found, set fallback of global
-    if match_found == 0:
-        return "global"
-
-
-def check_index_retention_policy(index, policies):
-    match_found = 0
-    # This sorts the index retention policies in descending order,
-    # by length of characters
-    policies = sorted(policies, key=lambda policy: len(policy), reverse=True)
-    for policy in policies:
-        # Ignore global as that's the fallback if no policy is found
-        if policy != "global":
-            if index.startswith(policy):
-                match_found = 1
-                return policy
-    # No policy match found, set fallback of global
-    if match_found == 0:
-        return "global"
-
-
-def check_index_allocation_policy(index, policies):
-    match_found = 0
-    # This sorts the index allocation policies in descending order,
-    # by length of characters
-    policies = sorted(policies, key=lambda policy: len(policy), reverse=True)
-    for policy in policies:
-        # Ignore global as that's the fallback if no policy is found
-        if policy != "global":
-            if index.startswith(policy):
-                match_found = 1
-                return policy
-    # No policy match found, set fallback of global
-    if match_found == 0:
-        return "global"
-
-
-def check_index_forcemerge_policy(index, policies):
-    match_found = 0
-    # This sorts the index forcemerge policies in descending order,
-    # by length of characters
-    policies = sorted(policies, key=lambda policy: len(policy), reverse=True)
-    for policy in policies:
-        # Ignore global as that's the fallback if no policy is found
-        if policy != "global":
-            if index.startswith(policy):
-                match_found = 1
-                return policy
-    # No policy match found, set fallback of global
-    if match_found == 0:
-        return "global"
-
-
-def check_index_rollover_policy(index, policies):
-    match_found = 0
-    # This sorts the index rollover policies in descending order,
-    # by length of characters
-    policies = sorted(policies, key=lambda policy: len(policy), reverse=True)
-    for policy in policies:
-        # Ignore global as that's the fallback if no policy is found
-        if policy != "global":
-            if index.startswith(policy):
-                match_found = 1
-                return policy
-    # No policy match found, set fallback of global
-    if match_found == 0:
-        return "global"
+def check_index_policy(index, policies):
+    """Returns the longest policy name the index starts with or global
+
+    Args:
+        index (str): Index name
+        policies (dict): Policies keyed by index prefix
+
+    Returns:
+        str: Matching policy name
+    """
+    return compile_policy_matcher(tuple(policies)).match(index)
+
+
+check_index_allocation_policy = check_index_policy
+check_index_retention_policy = check_index_policy
+check_index_forcemerge_policy = check_index_policy
+check_index_rollover_policy = check_index_policy
 
 
 def get_index_alias_members(client, alias):
-    es = build_es_connection(client)
+    es = get_es_connection(client)
     indices = list()
     members = es.cat.aliases(alias, format="json", h=("index"))
     for member in members:
         indices.append(member['index'])
-    es.close()
     return indices
 
 
 def get_all_index_aliases(client):
     try:
-        es = build_es_connection(client)
+        es = get_es_connection(client)
         members = es.cat.aliases(format="json")
     except Exception as e:
         raise e
@@ -245,19 +196,19 @@ def get_write_alias_names(client_config):
 
 
 def get_cluster_stats(client):
-    es = build_es_connection(client)
+    es = get_es_connection(client)
     cluster_stats = es.cluster.stats(format="json")
     return cluster_stats
 
 
 def get_aliases(client):
-    es = build_es_connection(client)
+    es = get_es_connection(client)
     members = es.cat.aliases(format="json")
     return members
 
 
 def set_index_alias(client, alias, index, write_alias=False):
-    es = build_es_connection(client)
+    es = get_es_connection(client)
     #es.indices.put_alias(index=index, name=alias)
     es.indices.update_aliases({
         # "actions": [
@@ -270,23 +221,31 @@ def set_index_alias(client, alias, index, write_alias=False):
             {"add":    {"index": index, "alias": alias}}
         ]
     })
-    es.close()
 
+# Patterns used to strip dates and rollover sequence numbers from index names
+INDEX_GROUP_TRAILING_DATE = re.compile(
+    r'-20[0-9][0-9](\.|-|_|:)[0-9]{2}(\.|-|_|:)[0-9]{2}$')
+INDEX_GROUP_EMBEDDED_DATE = re.compile(
+    r'20[0-9][0-9](\.|-|_|:)[0-9]{2}(\.|-|_|:)[0-9]{2}-')
+INDEX_GROUP_SEQUENCE = re.compile(r'-[0-9]{1,6}$')
+
+
+@lru_cache(maxsize=131072)
 def get_index_group(index):
     if str(index).startswith('.ds-'):
         index = index[4:]
     # First, find and remove possible dates
-    m = re.search('-20[0-9][0-9](\.|-|_|:)[0-9]{2}(\.|-|_|:)[0-9]{2}$', index)
+    m = INDEX_GROUP_TRAILING_DATE.search(index)
     if m:
         #print(f"Found date of {m.group(0)} in index {index}")
         index = index.replace(str(m.group(0)), '')
-    m = re.search('20[0-9][0-9](\.|-|_|:)[0-9]{2}(\.|-|_|:)[0-9]{2}-', index)
+    m = INDEX_GROUP_EMBEDDED_DATE.search(index)
     if m:
         #print(f"Found date of {m.group(0)} in index {index}")
         index = index.replace(str(m.group(0)), '')
 
     # Next, remove number sequence if found at end (ex: -000001)
-    m = re.search('-[0-9]{1,6}$', index)
+    m = INDEX_GROUP_SEQUENCE.search(index)
     if m:
         #print(f"Found ending number sequence for index {index}")
         index = index.replace(str(m.group(0)), '')
@@ -321,8 +280,23 @@ def get_index_group(index):
 #     print(f"Index group set to {group}")
 
 
+def group_indices(indices):
+    """Groups index names by their index group in one pass
+
+    Args:
+        indices (list): Index names
+
+    Returns:
+        dict: Index group mapped to a list of member index names
+    """
+    groups = {}
+    for index in indices:
+        groups.setdefault(get_index_group(index), []).append(index)
+    return groups
+
+
 def es_get_indices(client):
-    es = build_es_connection(client)
+    es = get_es_connection(client)
     indices = []
     # h is used to select fields to return (to see full list open Dev Tools and run the below command)
     # GET /_cat/indices?help
@@ -331,11 +305,10 @@ def es_get_indices(client):
     # More information at https://www.elastic.co/guide/en/elasticsearch/reference/current/cat.html
     for index in es.cat.indices(format="json", h=("health", "status", "index", "uuid", "shardsPrimary", "shardsReplica", "docsCount", "docsDeleted", "storeSize", "creation.date.string", "creation.date", "memory.total", "pri.store.size"), s="creation.date", bytes="b"):
         indices.append(index)
-    es.close()
     return indices
 
 def es_get_index_stats(client, index_name):
-    es = build_es_connection(client)
+    es = get_es_connection(client)
     indices = []
     # h is used to select fields to return (to see full list open Dev Tools and run the below command)
     # GET /_cat/indices?help
@@ -343,11 +316,10 @@ def es_get_index_stats(client, index_name):
     # bytes = b makes it return numeric bytes instead of human readable bytes
     # More information at https://www.elastic.co/guide/en/elasticsearch/reference/current/cat.html
     stats = es.indices.stats(index=index_name)
-    es.close()
     return stats
 
 def es_get_highest_index_from_indices(client, indices):
-    es = build_es_connection(client)
+    es = get_es_connection(client)
     indices = []
     # h is used to select fields to return (to see full list open Dev Tools and run the below command)
     # GET /_cat/indices?help
@@ -356,7 +328,6 @@ def es_get_highest_index_from_indices(client, indices):
     # More information at https://www.elastic.co/guide/en/elasticsearch/reference/current/cat.html
     for index in es.cat.indices(indices + "*", format="json", h=("health", "status", "index", "uuid", "shardsPrimary", "shardsReplica", "docsCount", "docsDeleted", "storeSize", "creation.date.string", "creation.date", "memory.total", "pri.store.size"), s="creation.date", bytes="b"):
         indices.append(index)
-    es.close()
     for index in indices:
         number = re.match
         index_number = re.match('.*?([0-9]+)$', index['index']).group(1)
@@ -365,14 +336,13 @@ def es_get_highest_index_from_indices(client, indices):
 
 
 def get_data_streams(client):
-    es = build_es_connection(client)
+    es = get_es_connection(client)
     response = es.indices.get_data_stream(name="*")
-    es.close()
     return response
 
 
 def es_get_data_stream_indices(client):
-    es = build_es_connection(client)
+    es = get_es_connection(client)
     indices = []
     # h is used to select fields to return (to see full list open Dev Tools and run the below command)
     # GET /_cat/indices?help
@@ -381,31 +351,9 @@ def es_get_data_stream_indices(client):
     # More information at https://www.elastic.co/guide/en/elasticsearch/reference/current/cat.html
     for index in es.cat.indices(".ds-*", format="json", h=("health", "status", "index", "uuid", "shardsPrimary", "shardsReplica", "docsCount", "docsDeleted", "storeSize", "creation.date.string", "creation.date", "memory.total", "pri.store.size"), s="creation.date", bytes="b"):
         indices.append(index)
-    es.close()
     return indices
 
 
-def get_lowest_data_node_thread_count(client_config):
-    es = build_es_connection(client_config)
-    # Grabs the jvm section of GET /_nodes/stats
-    result = es.nodes.stats(metric="jvm")
-    # Set an arbitrary starter value
-    safe_thread_use = 99999
-    # Loop through each node's thread count
-    for node in result['nodes']:
-        # If the current nodes thread count is less than safe_thread_use
-        # lower safe_thread use to that number
-        if result['nodes'][node]['jvm']['threads']['count'] < safe_thread_use:
-            safe_thread_use = result['nodes'][node]['jvm']['threads']['count']
-    # Limit the number of usable threads to 100 or one third of safe_thread_use, whichever is lower
-    if safe_thread_use / 2 >= 100:
-        safe_thread_use = 100
-    else:
-        safe_thread_use = round(safe_thread_use / 3, 0)
-    es.close()
-    return safe_thread_use
-
-
 def get_newest_document_date_in_index(client_config, index, elastic_connection):
     body = '{"sort" : [{ "@timestamp" : {"order" : "desc", "mode": "max"}}], "size": 1}'
     try:
@@ -432,51 +380,167 @@ def get_newest_document_date_in_index(client_config, index, elastic_connection):
         else:
             raise e
 
-def check_special_index(index):
-    special = False
-    if str(index).startswith("accounting"):
-        special = True
-    if str(index).startswith("elastic-ilm"):
-        special = True
-    if str(index).startswith(".kibana"):
-        special = True
-    if str(index).startswith(".async"):
-        special = True
-    if str(index).startswith(".fleet"):
-        special = True
-    if str(index).startswith(".reporting"):
-        special = True
-    if str(index).startswith(".opensearch"):
-        special = True
-    if str(index).startswith(".opendistro"):
-        special = True
-    if str(index).startswith(".security"):
-        special = True
-    if str(index).startswith(".tasks"):
-        special = True
-    if str(index).startswith(".apm"):
-        special = True
-    if str(index).startswith("ilm"):
-        special = True
-    if str(index).startswith("readonlyrest"):
-        special = True
-    if str(index).startswith("reflex-"):
-        special = True
-    if str(index).startswith(".readonlyrest"):
-        special = True
-    if str(index).startswith(".signal"):
-        special = True
-    if str(index).startswith("elastalert"):
-        special = True
-    if str(index).startswith(".siem-signals"):
-        special = True
-    if str(index).startswith(".transform"):
-        special = True
-    if str(index).startswith(".transform-internal"):
-        special = True
-    if str(index).startswith(".") and not str(index).startswith(".monitoring") and not str(index).startswith(".ds-"):
-        special = True
-    return special
+def get_newest_document_dates(client_config, index_pattern="*", page_size=1000, indices=None):
+    """Returns the newest @timestamp for every index matching a pattern
+
+    Uses a composite aggregation on _index with a max sub-aggregation and
+    pages through the results with after_key. Indices without an @timestamp
+    field are not included in the response.
+
+    Args:
+        client_config (dict): Client configuration
+        index_pattern (str, optional): Index pattern to search. Defaults to "*".
+        page_size (int, optional): Buckets per request. Defaults to 1000.
+        indices (list, optional): Limit the lookup to these index names.
+            Defaults to None which looks up every index.
+
+    Returns:
+        dict: Index name mapped to newest document datetime (UTC)
+    """
+    if indices is not None:
+        newest_records = {}
+        # Index names are sent in the body as a terms query on _index
+        # so large lists do not hit URL length limits
+        for chunk in get_list_by_chunk_size(list(indices), 10000):
+            newest_records.update(get_newest_document_dates_for_query(
+                client_config, index_pattern, page_size,
+                {"terms": {"_index": chunk}}))
+        return newest_records
+    return get_newest_document_dates_for_query(
+        client_config, index_pattern, page_size, {"match_all": {}})
+
+
+def get_newest_document_dates_for_query(client_config, index_pattern, page_size, query):
+    """Pages through the newest @timestamp composite aggregation for a query
+
+    Args:
+        client_config (dict): Client configuration
+        index_pattern (str): Index pattern to search
+        page_size (int): Buckets per request
+        query (dict): Query limiting which documents are aggregated
+
+    Returns:
+        dict: Index name mapped to newest document datetime (UTC)
+    """
+    elastic_connection = get_es_connection(client_config, timeout=120)
+    newest_records = {}
+    body = {
+        "size": 0,
+        "query": query,
+        "aggs": {
+            "indices": {
+                "composite": {
+                    "size": page_size,
+                    "sources": [{"index": {"terms": {"field": "_index"}}}]
+                },
+                "aggs": {"newest": {"max": {"field": "@timestamp"}}}
+            }
+        }
+    }
+    while True:
+        result = elastic_connection.search(
+            index=index_pattern, body=body, expand_wildcards="open,hidden",
+            ignore_unavailable=True, allow_no_indices=True)
+        if 'aggregations' not in result:
+            break
+        aggregation = result['aggregations']['indices']
+        for bucket in aggregation['buckets']:
+            value = bucket['newest']['value']
+            if value is not None:
+                newest_records[bucket['key']['index']] = datetime.utcfromtimestamp(
+                    value / 1000)
+        if 'after_key' not in aggregation or len(aggregation['buckets']) < page_size:
+            break
+        body['aggs']['indices']['composite']['after'] = aggregation['after_key']
+    return newest_records
+
+
+# Index prefixes that lifecycle jobs never touch. Extend globally with
+# special_indices in settings.toml or per client in the client JSON
+SPECIAL_INDEX_PREFIXES = (
+    "accounting", "elastic-ilm", ".kibana", ".async", ".fleet", ".reporting",
+    ".opensearch", ".opendistro", ".security", ".tasks", ".apm", "ilm",
+    "readonlyrest", "reflex-", ".readonlyrest", ".signal", "elastalert",
+    ".siem-signals", ".transform", ".transform-internal"
+)
+# Dot prefixed indices are special unless they start with one of these
+SPECIAL_INDEX_DOT_EXCEPTIONS = (".monitoring", ".ds-")
+
+
+@lru_cache(maxsize=64)
+def compile_special_index_classifier(extra_prefixes=()):
+    """Compiles the special index prefixes into one memoized regex check
+
+    Args:
+        extra_prefixes (tuple, optional): Additional special prefixes. Defaults to ().
+
+    Returns:
+        function: Takes an index name and returns True if it is special
+    """
+    prefixes = sorted(set(SPECIAL_INDEX_PREFIXES + extra_prefixes),
+                      key=len, reverse=True)
+    exceptions = [re.escape(prefix[1:]) for prefix in SPECIAL_INDEX_DOT_EXCEPTIONS]
+    match = re.compile(
+        "(?:" + "|".join(re.escape(prefix) for prefix in prefixes) + ")" +
+        "|\\.(?!" + "|".join(exceptions) + ")"
+    ).match
+    memo = {}
+
+    def classify(index):
+        special = memo.get(index)
+        if special is None:
+            if len(memo) >= 500000:
+                memo.clear()
+            special = memo[index] = match(index) is not None
+        return special
+    return classify
+
+
+def get_special_index_classifier(client_config=None):
+    """Returns the special index classifier for a client
+
+    Args:
+        client_config (dict, optional): Client configuration with optional
+            special_indices list. Defaults to None.
+
+    Returns:
+        function: Takes an index name and returns True if it is special
+    """
+    settings = load_settings()
+    extra_prefixes = ()
+    if 'special_indices' in settings['settings']:
+        extra_prefixes += tuple(settings['settings']['special_indices'])
+    if client_config is not None and 'special_indices' in client_config:
+        extra_prefixes += tuple(client_config['special_indices'])
+    return compile_special_index_classifier(extra_prefixes)
+
+
+def check_special_index(index, client_config=None):
+    """Checks if an index is a special index lifecycle jobs should skip
+
+    Args:
+        index (str): Index name
+        client_config (dict, optional): Client configuration with optional
+            special_indices list. Defaults to None.
+
+    Returns:
+        bool: True if index is special
+    """
+    return get_special_index_classifier(client_config)(str(index))
+
+
+def get_special_indices(indices, client_config=None):
+    """Classifies many index names at once
+
+    Args:
+        indices (list): Index names
+        client_config (dict, optional): Client configuration. Defaults to None.
+
+    Returns:
+        set: Index names that are special
+    """
+    classify = get_special_index_classifier(client_config)
+    return {index for index in indices if classify(index)}
 
 
 def return_fields_from_query(response, fields={}):
@@ -506,7 +570,7 @@ def get_es_field_from_first_result(result, field):
 
 def get_index_information(client, index):
     try:
-        es = build_es_connection(client)
+        es = get_es_connection(client)
         indices = []
         # h is used to select fields to return (to see full list open Dev Tools and run the below command)
         # GET /_cat/indices?help
@@ -515,7 +579,6 @@ def get_index_information(client, index):
         # More information at https://www.elastic.co/guide/en/elasticsearch/reference/current/cat.html
         for index in es.cat.indices(index=index, format="json", h=("health", "status", "index", "uuid", "shardsPrimary", "shardsReplica", "docsCount", "docsDeleted", "storeSize", "creation.date.string", "creation.date", "memory.total", "pri.store.size"), s="creation.date", bytes="b"):
             indices.append(index)
-        es.close()
         return indices[0]
     except:
         e = sys.exc_info()[0]
@@ -556,6 +619,82 @@ def get_rollover_index_name(current_index):
     return new_index
 
 
+def rollover_alias(client_config, alias, conditions=None, index_settings=None):
+    """Rolls over an alias or data stream with the _rollover API
+
+    The cluster checks the conditions against the current write index and
+    creates the next index in the same request, so a rollover is never
+    repeated because of stale index stats.
+
+    Args:
+        client_config (dict): Client configuration
+        alias (str): Alias or data stream name
+        conditions (dict, optional): Rollover conditions such as max_age,
+            max_docs or max_primary_shard_size. Defaults to rolling over
+            unconditionally.
+        index_settings (dict, optional): Settings of the new index, applied
+            over matching index templates. Defaults to none.
+
+    Returns:
+        dict: Rollover response with rolled_over, new_index and conditions
+    """
+    es = get_es_connection(client_config)
+    body = {}
+    if conditions:
+        body['conditions'] = conditions
+    if index_settings:
+        body['settings'] = index_settings
+    return es.indices.rollover(alias=alias, body=body)
+
+
+def create_rollover_successor(client_config, index, index_settings):
+    """Creates the index an alias will write to after its next rollover
+
+    Args:
+        client_config (dict): Client configuration
+        index (str): Current write index
+        index_settings (dict): Settings of the new index
+
+    Returns:
+        str: Name of the created index
+    """
+    es = get_es_connection(client_config)
+    new_index = get_rollover_index_name(index)
+    es.indices.create(index=new_index, body={'settings': index_settings})
+    return new_index
+
+
+def swap_write_index(client_config, alias, index, new_index):
+    """Moves an alias's writes to an existing index in one alias update
+
+    Used instead of _rollover when the next index was created ahead of
+    time, so rolling over is a metadata only change.
+
+    Args:
+        client_config (dict): Client configuration
+        alias (str): Alias name
+        index (str): Current write index
+        new_index (str): Index to write to next
+
+    Returns:
+        dict: rolled_over, old_index and new_index like a _rollover response
+    """
+    es = get_es_connection(client_config)
+    # Leave the alias alone if something else already moved it
+    aliases = es.indices.get_alias(name=alias)
+    if not aliases.get(index, {}).get('aliases', {}).get(alias, {}).get('is_write_index'):
+        return {'rolled_over': False, 'old_index': index, 'new_index': new_index,
+                'conditions': {}}
+    status = es.indices.update_aliases(body={
+        "actions": [
+            {"add": {"index": index, "alias": alias, "is_write_index": False}},
+            {"add": {"index": new_index, "alias": alias, "is_write_index": True}}
+        ]
+    })
+    return {'rolled_over': check_acknowledged_true(status), 'old_index': index,
+            'new_index': new_index, 'conditions': {}}
+
+
 def rollover_index(client_config, index, alias):
     try:
         indices = []
@@ -565,32 +704,13 @@ def rollover_index(client_config, index, alias):
         if isinstance(index, list):
             indices = index
         for index in indices:
-            if 'ca_file' in client_config:
-                if client_config['ca_file'] != "":
-                    verify_check = client_config['ca_file']
-                else:
-                    verify_check = False
-            else:
-                verify_check = False
-            url = f"https://client:9200/{alias}/_rollover"
-            if client_config['platform'] == 'opensearch':
-                auth_user = 'admin'
-            else:
-                auth_user = 'elastic'
-            response = requests.post(
-                url,
-                verify=verify_check,
-                auth=HTTPBasicAuth(
-                    auth_user, client_config['password']['admin_password']),
-                json={}
-            )
-            if response.status_code == 200:
-                get_index_operation_message_http_request(
-                    index, "rollover", response.status_code, client_config)
+            status = rollover_alias(client_config, alias)
+            if status.get('rolled_over'):
+                print("Rollover successful for " + index)
                 return True
             else:
                 print(
-                    f"Failed to rollover index {index} for rollover index with alias/ds of {alias} and url of {url}")
+                    f"Failed to rollover index {index} for rollover index with alias/ds of {alias}")
                 return False
     except:
         e = sys.exc_info()
@@ -608,26 +728,11 @@ def rollover_index_with_connection(client_config, index, alias, elastic_connecti
         if isinstance(index, list):
             indices = index
         for index in indices:
-            new_index = get_rollover_index_name(index)
-            status = elastic_connection.indices.create(
-                index=new_index, ignore=400)
-            if 'acknowledged' in status:
-                if status['acknowledged']:
-                    # Update writeable index
-                    status = elastic_connection.indices.update_aliases({
-                        "actions": [
-                            {"remove":    {"index": index, "alias": alias}},
-                            {"add": {"index": index, "alias": alias,
-                                     "is_write_index": "false"}},
-                            {"add":    {"index": new_index,
-                                        "alias": alias, "is_write_index": "true"}}
-                        ]
-                    })
-                    return status
-            else:
-                print("Failed to create new index" +
-                      str(new_index) + " for rollover index")
+            status = elastic_connection.indices.rollover(alias=alias)
+            if not status.get('rolled_over'):
+                print("Failed to rollover index " + str(index))
                 return False
+            return status
     except:
         e = sys.exc_info()
         print("Rollover job failed")
@@ -730,7 +835,7 @@ def bulk_insert_data_to_es(elasticsearch_connection, data, index, bulk_size=100)
 def delete_index(client_config, index):
     try:
         # Start connection to Elasticsearch
-        es = build_es_connection(client_config)
+        es = get_es_connection(client_config)
         # Check if index is a single string or a list of indices
         if isinstance(index, str):
             # Delete the index
@@ -747,7 +852,6 @@ def delete_index(client_config, index):
                     status = es.indices.delete(index=indices)
                     return get_index_operation_message(indices, "delete", status, client_config)
         # Close Elasticsearch connection
-        es.close()
     except:
         e = sys.exc_info()
         print(e)
@@ -758,27 +862,185 @@ def delete_index(client_config, index):
         print(e)
 
 
-def forcemerge_index(client_config, index):
+def start_forcemerge_task(client_config, index, only_expunge_deletes=False):
+    """Starts a forcemerge in the background and returns its task id
+
+    Args:
+        client_config (dict): Client configuration
+        index (str): Index name
+        only_expunge_deletes (bool, optional): Only merge away deleted
+            documents instead of merging to one segment. Defaults to False.
+
+    Returns:
+        str: Task id to track with get_task_status
+    """
+    es = get_es_connection(client_config)
+    status = es.indices.forcemerge(
+        index=index,
+        expand_wildcards="all",
+        params={'wait_for_completion': 'false'},
+        **get_forcemerge_options(only_expunge_deletes)
+    )
+    return status['task']
+
+
+def get_forcemerge_options(only_expunge_deletes=False):
+    """Returns the forcemerge parameters of a merge mode"""
+    if only_expunge_deletes:
+        return {'only_expunge_deletes': True}
+    return {'max_num_segments': 1}
+
+
+def run_forcemerge_request(client_config, index, only_expunge_deletes=False,
+                           request_timeout=7200):
+    """Forcemerges an index with a request that waits for the merge
+
+    Used for clusters that cannot run forcemerge as a task.
+
+    Args:
+        client_config (dict): Client configuration
+        index (str): Index name
+        only_expunge_deletes (bool, optional): Only merge away deleted
+            documents instead of merging to one segment. Defaults to False.
+        request_timeout (int, optional): Seconds to wait for the merge.
+            Defaults to 7200.
+
+    Returns:
+        tuple: succeeded (bool) and the response
+    """
+    es = get_es_connection(client_config)
+    status = es.indices.forcemerge(
+        index=index,
+        expand_wildcards="all",
+        request_timeout=request_timeout,
+        **get_forcemerge_options(only_expunge_deletes)
+    )
+    return status.get('_shards', {}).get('failed', 0) == 0, status
+
+
+def get_task_status(client_config, task_id):
+    """Returns whether a background task finished and if it succeeded
+
+    Args:
+        client_config (dict): Client configuration
+        task_id (str): Task id
+
+    Returns:
+        tuple: completed (bool), succeeded (bool) and the task result or error
+
+    Raises:
+        Exception: The task could not be checked, such as a timeout or node
+            error. The task may still be running so callers should poll again
+    """
+    es = get_es_connection(client_config)
     try:
-        es = build_es_connection(client_config)
-        status = es.indices.forcemerge(index=index, max_num_segments=1)
-        return es.get_index_operation_message(index, "forcemerge", status, client_config)
-    except:
-        e = sys.exc_info()[1]
-        print(e)
-        if str(e).startswith("ConnectionTimeout caused by - ReadTimeoutError(HTTPSConnectionPool"):
-            status = {}
-            status['acknowledged'] = "true"
-            return True
-        else:
-            raise Exception(e)
+        task = es.tasks.get(task_id=task_id)
+    except NotFoundError as e:
+        # The task and its stored result are gone so the outcome is unknown
+        return True, False, str(e)
+    return get_task_result(task)
+
+
+def get_task_result(task):
+    """Returns whether a _tasks response finished and if it succeeded
+
+    Args:
+        task (dict): Response of a _tasks/<task_id> request
+
+    Returns:
+        tuple: completed (bool), succeeded (bool) and the task result or error
+    """
+    if not task['completed']:
+        return False, False, None
+    if 'error' in task:
+        return True, False, task['error']
+    response = task.get('response', {})
+    shards = response.get('_shards', {})
+    succeeded = shards.get('failed', 0) == 0
+    return True, succeeded, response
+
+
+def get_shard_nodes(client_config, indices):
+    """Returns the nodes holding each index's started shards
+
+    Args:
+        client_config (dict): Client configuration
+        indices (list): Index names
+
+    Returns:
+        dict: Index name mapped to a set of node names
+    """
+    es = get_es_connection(client_config)
+    shard_nodes = {index: set() for index in indices}
+    # Keep request URLs short on clusters with many candidate indices
+    for chunk in get_list_by_chunk_size(list(indices), 100):
+        shards = es.cat.shards(
+            index=",".join(chunk), format="json", h="index,state,node")
+        for shard in shards:
+            if shard['state'] == 'STARTED' and shard['index'] in shard_nodes:
+                shard_nodes[shard['index']].add(shard['node'])
+    return shard_nodes
+
+
+def forcemerge_index(client_config, index, poll_seconds=30, only_expunge_deletes=False,
+                     poll_retries=10, use_tasks=True, request_timeout=7200):
+    """Forcemerges an index and waits for the merge to finish
+
+    The merge runs as a task so a long merge is never mistaken for a
+    timeout, or a timeout for success. Clusters without forcemerge tasks
+    get one request that waits for the merge instead.
+
+    Args:
+        client_config (dict): Client configuration
+        index (str): Index name
+        poll_seconds (int, optional): Seconds between task checks. Defaults to 30.
+        only_expunge_deletes (bool, optional): Only merge away deleted
+            documents instead of merging to one segment. Defaults to False.
+        poll_retries (int, optional): Task checks in a row that may fail
+            before giving up on the merge. Defaults to 10.
+        use_tasks (bool, optional): Run the merge as a task. Defaults to True.
+        request_timeout (int, optional): Seconds a merge run without a task
+            may take. Defaults to 7200.
+
+    Returns:
+        bool: True if every shard merged
+    """
+    if use_tasks:
+        task_id = start_forcemerge_task(client_config, index, only_expunge_deletes)
+    else:
+        try:
+            succeeded, result = run_forcemerge_request(
+                client_config, index, only_expunge_deletes, request_timeout)
+        except Exception as e:
+            succeeded, result = False, e
+        task_id = None
+    poll_errors = 0
+    while task_id is not None:
+        try:
+            completed, succeeded, result = get_task_status(client_config, task_id)
+            poll_errors = 0
+        except Exception as e:
+            poll_errors += 1
+            if poll_errors >= poll_retries:
+                completed, succeeded, result = True, False, e
+            else:
+                print(f"Unable to check forcemerge task {task_id} for {index}: {e}")
+                completed = False
+        if completed:
+            break
+        time.sleep(poll_seconds)
+    if succeeded:
+        print("Forcemerge successful for " + index)
+    else:
+        print("Forcemerge failed for " + index + " with a status of\n\n:" + str(result))
+    return succeeded
 
 # Not currently working
 
 
 def put_index_template(client_config, name, template):
     try:
-        es = build_es_connection(client_config)
+        es = get_es_connection(client_config)
         status = es.indices.put_index_template(name, template)
         if check_acknowledged_true(status):
             return True
@@ -808,113 +1070,379 @@ def check_acknowledged_true(status):
         print(status)
         return False
 
-# Connection built similar to https://elasticsearch-py.readthedocs.io/en/7.10.0/api.html#elasticsearch
-# Had trouble with check_hostname set to True for some reason
+@lru_cache(maxsize=32)
+def get_ssl_context(ca_file, ca_file_mtime, check_hostname, ssl_certificate):
+    """Builds an SSL context once per unique set of trust settings
 
+    Args:
+        ca_file (str): Path to CA file or empty string for system defaults
+        ca_file_mtime (float): CA file modification time, used as cache key
+        check_hostname (bool): Enforce hostname checks
+        ssl_certificate (str): required, optional or disabled
 
-def build_es_connection(client_config, timeout=10):
+    Returns:
+        ssl.SSLContext: SSL context for Elasticsearch connections
+    """
+    if ca_file != "":
+        context = ssl.create_default_context(
+            cafile=ca_file)
+    else:
+        context = ssl.create_default_context()
+
+    if check_hostname:
+        context.check_hostname = True
+    else:
+        context.check_hostname = False
+
+    if ssl_certificate == "required":
+        context.verify_mode = ssl.CERT_REQUIRED
+    elif ssl_certificate == "optional":
+        context.verify_mode = ssl.CERT_OPTIONAL
+    else:
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def get_connection_pool_size(settings):
+    """Returns the urllib3 connection pool size per client
+
+    Args:
+        settings (dict): Settings from settings.toml
+
+    Returns:
+        int: Maximum number of pooled connections per node
+    """
+    if 'connection_pool_size' in settings['settings']:
+        return int(settings['settings']['connection_pool_size'])
+    # Matches the upper bound of cluster.get_worker_count
+    return 100
+
+
+def get_connection_key(client_config, timeout):
+    """Builds the registry key for a client connection
+
+    Args:
+        client_config (dict): Client configuration
+        timeout (int): Connection timeout
+
+    Returns:
+        tuple: Client name, timeout and a fingerprint of the client config
+            and the global settings connections are built from
+    """
+    fingerprint = json.dumps(
+        [client_config, get_global_connection_settings()], sort_keys=True, default=str)
+    return (client_config['client_name'], timeout), fingerprint
+
+
+# settings.toml [settings] keys get_es_connection_settings falls back to
+CONNECTION_SETTINGS = ('ssl_enabled', 'check_hostname', 'ssl_certificate')
+
+
+def get_global_connection_settings():
+    """Returns the [settings] values client connections are built from"""
     settings = load_settings()
-    es_config = {}
-    try:
-        # Check to see if SSL is enabled
-        ssl_enabled = False
-        if "ssl_enabled" in client_config:
-            if client_config['ssl_enabled']:
-                ssl_enabled = True
-        else:
-            ssl_enabled = settings['settings']['ssl_enabled']
-
-        # Get the SSL settings for the connection if SSL is enabled
-        if ssl_enabled:
-            # Support older variable implementations of grabbing the ca.crt file
-            ca_file = ""
-            if "ca_file" in client_config:
-                if os.path.exists(client_config['ca_file']):
-                    ca_file = client_config['ca_file']
-                else:
-                    exit("CA file referenced does not exist")
-            elif "client_file_location" in client_config:
-                if os.path.exists(client_config['client_file_location'] + "/ca/ca.crt"):
-                    ca_file = client_config['client_file_location'] + \
-                        "/ca/ca.crt"
-
-            if ca_file != "":
-                context = ssl.create_default_context(
-                    cafile=ca_file)
-            else:
-                context = ssl.create_default_context()
+    return {
+        key: settings['settings'][key]
+        for key in CONNECTION_SETTINGS if key in settings['settings']
+    }
 
-            if "check_hostname" in client_config:
-                check_hostname = client_config['check_hostname']
-            else:
-                check_hostname = settings['settings']['check_hostname']
-            if check_hostname:
-                context.check_hostname = True
-            else:
-                context.check_hostname = False
 
-            if "ssl_certificate" in client_config:
-                ssl_certificate = client_config['ssl_certificate']
-            else:
-                ssl_certificate = settings['settings']['ssl_certificate']
-            if ssl_certificate == "required":
-                context.verify_mode = ssl.CERT_REQUIRED
-            elif ssl_certificate == "optional":
-                context.verify_mode = ssl.CERT_OPTIONAL
-            else:
-                context.verify_mode = ssl.CERT_NONE
+def get_es_connection(client_config, timeout=10):
+    """Returns a pooled Elasticsearch connection for a client
 
-            es_config = {
-                "scheme": "https",
-                "ssl_context": context,
+    Connections are built once per client and timeout and shared by every
+    helper and worker thread. A connection that has not been verified within
+    settings.connection_health_check_seconds is pinged before being handed
+    out and rebuilt if the ping fails. Connections must not be closed by
+    callers. Use evict_es_connection or close_es_connections instead.
+
+    Args:
+        client_config (dict): Client configuration
+        timeout (int, optional): Connection timeout. Defaults to 10.
+
+    Returns:
+        Elasticsearch: Shared Elasticsearch connection
+    """
+    key, fingerprint = get_connection_key(client_config, timeout)
+    settings = load_settings()
+    if 'connection_health_check_seconds' in settings['settings']:
+        health_check_seconds = settings['settings']['connection_health_check_seconds']
+    else:
+        health_check_seconds = 300
+    with connection_registry_lock:
+        entry = connection_registry.get(key)
+        if entry is not None and entry['fingerprint'] != fingerprint:
+            # Client configuration changed, drop the old connection
+            connection_registry.pop(key)
+            entry['connection'].close()
+            entry = None
+        if entry is None:
+            entry = {
+                'connection': build_es_connection(client_config, timeout=timeout),
+                'fingerprint': fingerprint,
+                'verified': time.monotonic()
             }
+            connection_registry[key] = entry
+            return entry['connection']
+        if time.monotonic() - entry['verified'] < health_check_seconds:
+            return entry['connection']
+    # Ping outside the lock so one unreachable cluster does not block
+    # connection lookups for every other client
+    try:
+        healthy = entry['connection'].ping()
+    except Exception:
+        healthy = False
+    if healthy:
+        entry['verified'] = time.monotonic()
+        return entry['connection']
+    print(f"Pooled connection for {client_config['client_name']} failed " +
+          "health check. Rebuilding")
+    evict_es_connection(client_config, timeout=timeout)
+    return get_es_connection(client_config, timeout=timeout)
 
-        # Enable authentication if there is a passwod section in the client JSON
-        password_authentication = False
-        if 'password_authentication' in client_config:
-            if client_config['password_authentication']:
-                password_authentication = True
-        elif 'admin_password' in client_config['password']:
-            password_authentication = True
-        if password_authentication:
-            user = ''
-            password = ''
-            if 'es_password' in client_config:
-                password = client_config['es_password']
-            elif 'admin_password' in client_config['password']:
-                password = client_config['password']['admin_password']
-            if 'es_user' in client_config:
-                user = client_config['es_user']
-            elif client_config['platform'] == "elastic":
-                user = 'elastic'
+
+def evict_es_connection(client_config, timeout=None):
+    """Closes and removes pooled connections for a client
+
+    Args:
+        client_config (dict): Client configuration
+        timeout (int, optional): Only evict this timeout. Defaults to all.
+    """
+    with connection_registry_lock:
+        for key in list(connection_registry):
+            if key[0] != client_config['client_name']:
+                continue
+            if timeout is not None and key[1] != timeout:
+                continue
+            entry = connection_registry.pop(key)
+            try:
+                entry['connection'].close()
+            except Exception:
+                pass
+
+
+def close_es_connections():
+    """Closes every pooled connection. Registered to run at exit"""
+    with connection_registry_lock:
+        for entry in connection_registry.values():
+            try:
+                entry['connection'].close()
+            except Exception:
+                pass
+        connection_registry.clear()
+
+
+atexit.register(close_es_connections)
+
+# Connection built similar to https://elasticsearch-py.readthedocs.io/en/7.10.0/api.html#elasticsearch
+# Had trouble with check_hostname set to True for some reason
+
+
+def get_es_connection_settings(client_config, timeout=10):
+    """Returns the hosts and keyword arguments used to build a client
+
+    Shared by the synchronous and asyncio clients so both connect the same
+    way.
+
+    Args:
+        client_config (dict): Client configuration
+        timeout (int, optional): Request timeout in seconds. Defaults to 10.
+
+    Returns:
+        tuple: List of hosts and dictionary of client keyword arguments
+    """
+    settings = load_settings()
+    es_config = {}
+    # Check to see if SSL is enabled
+    ssl_enabled = False
+    if "ssl_enabled" in client_config:
+        if client_config['ssl_enabled']:
+            ssl_enabled = True
+    else:
+        ssl_enabled = settings['settings']['ssl_enabled']
+
+    # Get the SSL settings for the connection if SSL is enabled
+    if ssl_enabled:
+        # Support older variable implementations of grabbing the ca.crt file
+        ca_file = ""
+        if "ca_file" in client_config:
+            if os.path.exists(client_config['ca_file']):
+                ca_file = client_config['ca_file']
             else:
-                user = 'admin'
-            es_config['http_auth'] = (
-                user, password)
-
-        # Get the Elasticsearch port to connect to
-        if 'es_port' in client_config:
-            es_port = client_config['es_port']
-        elif client_config['client_number'] == 0:
-            es_port = "9200"
+                exit("CA file referenced does not exist")
+        elif "client_file_location" in client_config:
+            if os.path.exists(client_config['client_file_location'] + "/ca/ca.crt"):
+                ca_file = client_config['client_file_location'] + \
+                    "/ca/ca.crt"
+
+        if "check_hostname" in client_config:
+            check_hostname = client_config['check_hostname']
         else:
-            es_port = str(client_config['client_number']) + "03"
+            check_hostname = settings['settings']['check_hostname']
 
-        # Get the Elasticsearch host to connect to
-        if 'es_host' in client_config:
-            es_host = client_config['es_host']
+        if "ssl_certificate" in client_config:
+            ssl_certificate = client_config['ssl_certificate']
         else:
-            es_host = client_config['client_name'] + "_client"
-
-        es_config['retry_on_timeout'] = True
-        es_config['max_retries'] = 10
-        es_config['timeout'] = timeout
-        if os.getenv('DEBUGON') == "1":
-            print(es_config)
-            print(es_host)
-            print(es_port)
-        return Elasticsearch(
-            [{'host': es_host, 'port': es_port}], **es_config)
+            ssl_certificate = settings['settings']['ssl_certificate']
+
+        # SSL contexts are shared between connections with the same
+        # trust settings. The CA file mtime is part of the key so a
+        # rotated certificate builds a fresh context
+        ca_file_mtime = 0
+        if ca_file != "":
+            ca_file_mtime = os.path.getmtime(ca_file)
+        context = get_ssl_context(
+            ca_file, ca_file_mtime, bool(check_hostname), ssl_certificate)
+
+        es_config = {
+            "scheme": "https",
+            "ssl_context": context,
+        }
+
+    # Enable authentication if there is a passwod section in the client JSON
+    password_authentication = False
+    if 'password_authentication' in client_config:
+        if client_config['password_authentication']:
+            password_authentication = True
+    elif 'admin_password' in client_config['password']:
+        password_authentication = True
+    if password_authentication:
+        user = ''
+        password = ''
+        if 'es_password' in client_config:
+            password = client_config['es_password']
+        elif 'admin_password' in client_config['password']:
+            password = client_config['password']['admin_password']
+        if 'es_user' in client_config:
+            user = client_config['es_user']
+        elif client_config['platform'] == "elastic":
+            user = 'elastic'
+        else:
+            user = 'admin'
+        es_config['http_auth'] = (
+            user, password)
+
+    # Get the Elasticsearch port to connect to
+    if 'es_port' in client_config:
+        es_port = client_config['es_port']
+    elif client_config['client_number'] == 0:
+        es_port = "9200"
+    else:
+        es_port = str(client_config['client_number']) + "03"
+
+    # Get the Elasticsearch host to connect to
+    if 'es_host' in client_config:
+        es_host = client_config['es_host']
+    else:
+        es_host = client_config['client_name'] + "_client"
+
+    es_config['retry_on_timeout'] = True
+    es_config['max_retries'] = 10
+    es_config['timeout'] = timeout
+    # Size the urllib3 pool to the number of worker threads that share
+    # this connection so threads do not queue for a socket
+    es_config['maxsize'] = get_connection_pool_size(settings)
+    if os.getenv('DEBUGON') == "1":
+        print(es_config)
+        print(es_host)
+        print(es_port)
+    return [{'host': es_host, 'port': es_port}], es_config
+
+
+def get_request_stats(client_name):
+    """Returns the requests and bytes exchanged with a client's cluster
+
+    Args:
+        client_name (str): Client name
+
+    Returns:
+        dict: requests, bytes_sent and bytes_received since startup
+    """
+    with request_stats_lock:
+        if client_name in request_stats:
+            return dict(request_stats[client_name])
+    return {'requests': 0, 'bytes_sent': 0, 'bytes_received': 0}
+
+
+def record_request(client_name, bytes_sent, bytes_received):
+    """Adds one request to a client's request stats"""
+    with request_stats_lock:
+        if client_name not in request_stats:
+            request_stats[client_name] = {
+                'requests': 0, 'bytes_sent': 0, 'bytes_received': 0}
+        stats = request_stats[client_name]
+        stats['requests'] += 1
+        stats['bytes_sent'] += bytes_sent
+        stats['bytes_received'] += bytes_received
+
+
+def get_payload_size(payload):
+    """Returns the size in bytes of a request or response body"""
+    if payload is None:
+        return 0
+    if isinstance(payload, str):
+        return len(payload.encode())
+    return len(payload)
+
+
+def count_requests(client_name, perform_request):
+    """Wraps a node connection's perform_request to record request stats"""
+    def counted_perform_request(method, url, params=None, body=None, *args, **kwargs):
+        try:
+            status, headers, data = perform_request(
+                method, url, params, body, *args, **kwargs)
+        except Exception:
+            record_request(client_name, get_payload_size(body), 0)
+            raise
+        record_request(client_name, get_payload_size(body), get_payload_size(data))
+        return status, headers, data
+    return counted_perform_request
+
+
+def instrument_es_connection(elastic_connection, client_name):
+    """Records requests and bytes for every node connection of a client
+
+    Args:
+        elastic_connection (Elasticsearch): Synchronous client
+        client_name (str): Client name to record stats under
+    """
+    for node_connection in elastic_connection.transport.connection_pool.connections:
+        node_connection.perform_request = count_requests(
+            client_name, node_connection.perform_request)
+
+
+def build_es_connection(client_config, timeout=10):
+    try:
+        hosts, es_config = get_es_connection_settings(client_config, timeout)
+        elastic_connection = Elasticsearch(hosts, **es_config)
+        instrument_es_connection(elastic_connection, client_config['client_name'])
+        return elastic_connection
+    except:
+        e = sys.exc_info()
+        print(e)
+        print("Connection attempt to Elasticsearch Failed")
+        raise e
+
+
+def build_async_es_connection(client_config, timeout=10):
+    """Builds an AsyncElasticsearch or AsyncOpenSearch client
+
+    Requires the async extras of the client library (aiohttp).
+
+    Args:
+        client_config (dict): Client configuration
+        timeout (int, optional): Request timeout in seconds. Defaults to 10.
+
+    Returns:
+        AsyncElasticsearch: Async client. Must be closed by the caller
+    """
+    if os.getenv('ILM_PLATFORM') == 'opensearch':
+        from opensearchpy import AsyncOpenSearch as AsyncElasticsearch
+    else:
+        from elasticsearch import AsyncElasticsearch
+    try:
+        hosts, es_config = get_es_connection_settings(client_config, timeout)
+        return AsyncElasticsearch(hosts, **es_config)
     except:
         e = sys.exc_info()
         print(e)
@@ -924,14 +1452,14 @@ def build_es_connection(client_config, timeout=10):
 
 def check_cluster_health(client_config):
     try:
-        es = build_es_connection(client_config)
+        es = get_es_connection(client_config)
         health = es.cluster.health(request_timeout=30)
-        es.close()
         return health
     except:
         e = sys.exc_info()
         print(e)
-        es.close()
+        # Drop the pooled connection so the next attempt reconnects
+        evict_es_connection(client_config)
         raise Exception(e)
 
 
@@ -958,7 +1486,7 @@ def restore_index(client_config, backup_repository, snapshot_name, index_name):
     except Exception as e:
         raise Exception(e)
     try:
-        elastic_connection = build_es_connection(client_config)
+        elastic_connection = get_es_connection(client_config)
         body = {
             "indices": index_name,
             "ignore_unavailable": True,
@@ -968,7 +1496,6 @@ def restore_index(client_config, backup_repository, snapshot_name, index_name):
         }
         restore_job = elastic_connection.snapshot.restore(
             backup_repository, snapshot_name, body, wait_for_completion=False, request_timeout=30)
-        elastic_connection.close()
         if 'accepted' in restore_job:
             if restore_job['accepted']:
                 print("Restore of index " + index_name + ": successful")
@@ -977,7 +1504,6 @@ def restore_index(client_config, backup_repository, snapshot_name, index_name):
                 print("Restore of index " + index_name + ": failed")
                 return False
     except Exception as e:
-        elastic_connection.close()
         print(e)
         print("Operation failed - Restore snapshot " + snapshot_name +
               " for repo " + backup_repository + " for index name of : " + index_name)
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""Runs a job against many clients concurrently"""
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, \
+    FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from cluster import load_index_count, save_index_count, snapshot_registry, \
+    snapshot_registry_lock
+from config import load_settings
+
+# (job, client name) pairs still running, including runs that timed out
+running_clients = set()
+running_clients_lock = threading.Lock()
+
+# Index count of each client's last run, used to start large clients first
+client_index_counts = {}
+
+process_pool = None
+process_pool_lock = threading.Lock()
+
+
+def get_client_timeout(job):
+    """Returns how long one client may run a job before it is abandoned
+
+    Uses settings.<job>.client_timeout_seconds, then
+    settings.client_timeout_seconds, and defaults to 2 hours.
+
+    Args:
+        job (str): Job name such as retention or rollover
+
+    Returns:
+        float: Timeout in seconds
+    """
+    settings = load_settings()
+    if job in settings and 'client_timeout_seconds' in settings[job]:
+        return settings[job]['client_timeout_seconds']
+    if 'client_timeout_seconds' in settings['settings']:
+        return settings['settings']['client_timeout_seconds']
+    return 7200
+
+
+def get_max_concurrent_clients():
+    """Returns how many clients a job processes at the same time"""
+    settings = load_settings()
+    if 'max_concurrent_clients' in settings['settings']:
+        return settings['settings']['max_concurrent_clients']
+    return 8
+
+
+def get_process_pool_jobs():
+    """Returns the jobs that run their per-client work in worker processes"""
+    settings = load_settings()
+    if 'process_pool_jobs' in settings['settings']:
+        return settings['settings']['process_pool_jobs']
+    return ()
+
+
+def get_process_pool(reset=False):
+    """Returns the process pool shared by every job using worker processes
+
+    Workers are spawned rather than forked so they never inherit locks or
+    pooled connections held by scheduler threads.
+
+    Args:
+        reset (bool, optional): Replace a broken pool. Defaults to False.
+
+    Returns:
+        ProcessPoolExecutor: Process pool
+    """
+    global process_pool
+    settings = load_settings()
+    with process_pool_lock:
+        if reset and process_pool is not None:
+            process_pool.shutdown(wait=False)
+            process_pool = None
+        if process_pool is None:
+            workers = os.cpu_count()
+            if 'process_pool_workers' in settings['settings']:
+                if settings['settings']['process_pool_workers'] > 0:
+                    workers = settings['settings']['process_pool_workers']
+            process_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return process_pool
+
+
+def get_last_index_count(client_name):
+    """Returns how many indices a client had when it was last processed
+
+    Falls back to the count saved by the last run of any process when the
+    client has not been processed by this process yet.
+
+    Args:
+        client_name (str): Client name
+
+    Returns:
+        int: Index count, 0 if unknown
+    """
+    with running_clients_lock:
+        if client_name in client_index_counts:
+            return client_index_counts[client_name]
+    count = load_index_count(client_name)
+    with running_clients_lock:
+        client_index_counts.setdefault(client_name, count)
+    return count
+
+
+def run_client(function, client_config):
+    """Runs a job for one client in a worker thread or process
+
+    Args:
+        function (function): Function taking the client configuration
+        client_config (dict): Client configuration
+
+    Returns:
+        int: Client's index count if a cluster snapshot was built, else None
+    """
+    function(client_config)
+    with snapshot_registry_lock:
+        snapshot = snapshot_registry.get(client_config['client_name'])
+    if snapshot is None:
+        return None
+    return len(snapshot.indices)
+
+
+def finish_client(job, client_name, future):
+    """Releases a client once its run ends and records its index count"""
+    count = None
+    with running_clients_lock:
+        running_clients.discard((job, client_name))
+        if not future.cancelled() and future.exception() is None:
+            count = future.result()
+            if count is not None and client_index_counts.get(client_name) != count:
+                client_index_counts[client_name] = count
+            else:
+                count = None
+    if count is not None:
+        save_index_count(client_name, count)
+
+
+def run_single_client(job, client_config, function):
+    """Runs a job's per-client function for one client and waits
+
+    Used by the scheduler, which runs every (job, client) pair on its own
+    schedule and limits each job's clients itself. Jobs in
+    settings.process_pool_jobs still run in a worker process.
+
+    Args:
+        job (str): Job name such as retention or rollover
+        client_config (dict): Client configuration
+        function (function): Function taking the client configuration
+
+    Returns:
+        str: success or failed
+    """
+    client_name = client_config['client_name']
+    try:
+        if job in get_process_pool_jobs():
+            try:
+                future = get_process_pool().submit(run_client, function, client_config)
+            except BrokenProcessPool:
+                future = get_process_pool(reset=True).submit(
+                    run_client, function, client_config)
+            future.result()
+        else:
+            run_client(function, client_config)
+    except Exception as error:
+        print(f"{job} failed for {client_name}: {error}")
+        traceback.print_exception(type(error), error, error.__traceback__)
+        return 'failed'
+    return 'success'
+
+
+def run_for_clients(job, clients, function):
+    """Runs a job's per-client function for every client concurrently
+
+    At most settings.max_concurrent_clients clients run at once. Jobs listed
+    in settings.process_pool_jobs run in a shared pool of worker processes
+    instead so CPU heavy work is not limited by one GIL. Clients are started
+    largest first by their last index count so the longest runs do not end
+    up last. A client that raises is reported without affecting the others.
+    A client still running after its timeout is reported and no longer
+    waited on, and it is skipped by later runs of the same job until it
+    finishes, so one unhealthy cluster never holds up the rest of the fleet.
+
+    Args:
+        job (str): Job name such as retention or rollover
+        clients (dict): Client name mapped to client configuration
+        function (function): Module level function taking the client
+            configuration. Must be picklable for process pool jobs
+
+    Returns:
+        dict: Client name mapped to success, failed, timeout or skipped
+    """
+    results = {}
+    pending = {}
+    for client_name, client_config in clients.items():
+        with running_clients_lock:
+            if (job, client_name) in running_clients:
+                print(f"Skipping {job} for {client_name} as a previous run " +
+                      "is still in progress")
+                results[client_name] = 'skipped'
+                continue
+            running_clients.add((job, client_name))
+        pending[client_name] = client_config
+    if len(pending) == 0:
+        return results
+    timeout = get_client_timeout(job)
+    order = sorted(pending, key=get_last_index_count, reverse=True)
+    use_processes = job in get_process_pool_jobs()
+    if use_processes:
+        executor = get_process_pool()
+    else:
+        executor = ThreadPoolExecutor(
+            max_workers=max(1, min(get_max_concurrent_clients(), len(pending))),
+            thread_name_prefix=job
+        )
+    futures = {}
+    for client_name in order:
+        try:
+            future = executor.submit(run_client, function, pending[client_name])
+        except BrokenProcessPool:
+            executor = get_process_pool(reset=True)
+            future = executor.submit(run_client, function, pending[client_name])
+        future.add_done_callback(partial(finish_client, job, client_name))
+        futures[future] = client_name
+    started = {}
+    try:
+        while len(futures) != 0:
+            done, _ = wait(futures, timeout=1, return_when=FIRST_COMPLETED)
+            for future in done:
+                client_name = futures.pop(future)
+                if future.exception() is None:
+                    results[client_name] = 'success'
+                else:
+                    error = future.exception()
+                    print(f"{job} failed for {client_name}: {error}")
+                    traceback.print_exception(
+                        type(error), error, error.__traceback__)
+                    results[client_name] = 'failed'
+            now = time.monotonic()
+            for future, client_name in list(futures.items()):
+                # Queued clients start their timeout once they are running
+                if client_name not in started:
+                    if future.running():
+                        started[client_name] = now
+                elif now - started[client_name] > timeout:
+                    print(f"{job} for {client_name} exceeded {timeout} " +
+                          "seconds. No longer waiting on it")
+                    futures.pop(future)
+                    results[client_name] = 'timeout'
+    finally:
+        # Timed out clients keep running until they finish. The process
+        # pool is shared and kept for later runs
+        if not use_processes:
+            executor.shutdown(wait=False)
+    return results
@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 from email.base64mime import header_length
 from config import load_configs, load_settings
-from error import send_notification
 import es
+from policy import get_policy_matcher
+from cluster import get_cluster_snapshot, get_cluster_topology
+from fanout import get_client_timeout, run_for_clients
+from async_engine import get_engine, run_job_async, run_sync
+import asyncio
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import os
 import time
 notification = False
 def get_forcemerge_policy(client_config):
@@ -17,50 +22,511 @@ def get_forcemerge_policy(client_config):
         index_forcemerge_policies = { "global": 32 }
     return index_forcemerge_policies
 
-def forcemerge_indices(client_config, index, index_forcemerge_policies):
-    elastic_connection = es.build_es_connection(client_config)
-    newest_record = ""
-    newest_record = es.get_newest_document_date_in_index(client_config, index, elastic_connection)
+def get_forcemerge_policy_settings(policy_value):
+    """Returns the merge age and expunge deletes threshold of a policy
+
+    A policy is either the number of days before an index is merged to one
+    segment per shard, or a dictionary with days and/or
+    expunge_deletes_ratio, the share of deleted documents at which an
+    only_expunge_deletes merge runs regardless of age.
+
+    Args:
+        policy_value (int or dict): Forcemerge policy value
+
+    Returns:
+        tuple: Days (None if not set), deleted ratio threshold (None if not set)
+    """
+    if isinstance(policy_value, dict):
+        return policy_value.get('days'), policy_value.get('expunge_deletes_ratio')
+    return policy_value, None
+
+def check_forcemerge_due(client_config, index, index_forcemerge_policies, snapshot):
+    # Get the index specific forcemerge policy
+    policy = get_policy_matcher(client_config, 'forcemerge', index_forcemerge_policies).match(index)
+    # Get policy forcemerge days from specific policy
+    policy_days, _ = get_forcemerge_policy_settings(index_forcemerge_policies[policy])
+    if policy_days is None:
+        return False
+    newest_record = snapshot.get_newest_document_date(index)
     # make sure newest record is not empty
-    if newest_record != "":
-        # Get the index specific forcemerge policy
-        policy = es.check_index_forcemerge_policy(index, index_forcemerge_policies)
-        # Get policy forcemerge days from specific policy
-        policy_days = index_forcemerge_policies[policy]
-        # Get current datetime
-        current_date = datetime.utcnow()
-        # Figure out how many days since current_date vs. newest_record
-        days_ago = (current_date - newest_record).days
-        # Check if days_ago is greater than or equal to policy date
-        # If greater than or equal to policy date, delete index
-        if days_ago >= policy_days:
-            # Delete old index
-            status = elastic_connection.indices.forcemerge(index, max_num_segments=1, expand_wildcards="all")
-            if '_shards' in status:
-                if 'total' in status['_shards'] and 'successful' in status['_shards']:
-                    if status['_shards']['total'] == status['_shards']['successful']:
-                        print("Forcemerge for " + index + " successful")
+    if newest_record == "":
+        return False
+    # Figure out how many days since current_date vs. newest_record
+    days_ago = (datetime.utcnow() - newest_record).days
+    # Check if days_ago is greater than or equal to policy date
+    if days_ago < policy_days:
+        return False
+    # Skip closed indices and indices already merged to one segment per shard
+    segments_per_shard = snapshot.get_segments_per_shard(index)
+    return segments_per_shard is not None and segments_per_shard > 1
+
+def get_deleted_ratio(index, snapshot):
+    """Returns the share of an index's documents that are deleted
+
+    Args:
+        index (str): Index name
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
+
+    Returns:
+        float: Deleted documents over all documents, None if closed or unknown
+    """
+    index_info = snapshot.get_index(index)
+    if index_info is None or index_info['docsCount'] is None or \
+            index_info['docsDeleted'] is None:
+        return None
+    docs_deleted = int(index_info['docsDeleted'])
+    total = int(index_info['docsCount']) + docs_deleted
+    if total == 0:
+        return 0.0
+    return docs_deleted / total
+
+def check_expunge_deletes_due(client_config, index, index_forcemerge_policies, snapshot):
+    policy = get_policy_matcher(client_config, 'forcemerge', index_forcemerge_policies).match(index)
+    _, deleted_ratio_threshold = get_forcemerge_policy_settings(index_forcemerge_policies[policy])
+    if deleted_ratio_threshold is None:
+        return False
+    deleted_ratio = get_deleted_ratio(index, snapshot)
+    return deleted_ratio is not None and deleted_ratio > 0 and \
+        deleted_ratio >= deleted_ratio_threshold
+
+def get_reclaimable_bytes(index, snapshot):
+    """Estimates the disk an only_expunge_deletes merge frees
+
+    Args:
+        index (str): Index name
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
+
+    Returns:
+        float: Store size, replicas included, times the deleted ratio
+    """
+    index_info = snapshot.get_index(index)
+    deleted_ratio = get_deleted_ratio(index, snapshot)
+    if deleted_ratio is None or index_info['storeSize'] is None:
+        return 0
+    return int(index_info['storeSize']) * deleted_ratio
+
+def get_task_poll_seconds():
+    settings = load_settings()
+    if 'forcemerge' in settings and 'task_poll_seconds' in settings['forcemerge']:
+        return settings['forcemerge']['task_poll_seconds']
+    return 30
+
+def get_task_poll_retries():
+    settings = load_settings()
+    if 'forcemerge' in settings and 'task_poll_retries' in settings['forcemerge']:
+        return settings['forcemerge']['task_poll_retries']
+    return 10
+
+def print_forcemerge_result(index, succeeded, result, only_expunge_deletes=False):
+    if only_expunge_deletes:
+        index = index + " (expunge deletes)"
+    if succeeded:
+        print("Forcemerge for " + index + " successful")
+    else:
+        print("Forcemerge for " + index + " unsuccessful: " + str(result))
+
+def get_max_merges_per_node():
+    settings = load_settings()
+    if 'forcemerge' in settings and 'max_merges_per_node' in settings['forcemerge']:
+        # Below one no merge could ever start
+        return max(1, settings['forcemerge']['max_merges_per_node'])
+    return 1
+
+def check_forcemerge_tasks_supported(topology):
+    """Checks if a cluster can run forcemerge as a background task
+
+    wait_for_completion=false on forcemerge needs Elasticsearch 8.1 or
+    OpenSearch 2.7. Older clusters reject it, so their merges use a request
+    that waits for the merge. settings.forcemerge.use_tasks overrides the
+    choice.
+
+    Args:
+        topology (ClusterTopology): Cluster node information
+
+    Returns:
+        bool: True if merges can run as tasks
+    """
+    settings = load_settings()
+    if 'forcemerge' in settings and 'use_tasks' in settings['forcemerge']:
+        return settings['forcemerge']['use_tasks']
+    version = topology.get_minimum_version()
+    if version is None:
+        return False
+    if os.getenv('ILM_PLATFORM') == 'opensearch':
+        return version >= (2, 7)
+    return version >= (8, 1)
+
+def get_merge_priority(index, snapshot):
+    """Returns how much a merge reclaims so the biggest wins go first
+
+    Args:
+        index (str): Index name
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
+
+    Returns:
+        tuple: Segments beyond one per primary shard, then primary size
+    """
+    index_info = snapshot.get_index(index)
+    if index_info is None:
+        return (0, 0)
+    segments = snapshot.get_segment_counts().get(index, 0)
+    reclaimable_segments = segments - int(index_info['shardsPrimary'])
+    return (reclaimable_segments, int(index_info['pri.store.size']))
+
+def get_forcemerge_queue(indices, snapshot=None, expunge_indices=()):
+    """Orders merges so the most reclaimable start first
+
+    Args:
+        indices (list): Index names to merge to one segment per shard
+        snapshot (ClusterSnapshot, optional): Used to prioritize merges.
+            Defaults to the order given.
+        expunge_indices (list, optional): Index names to merge with
+            only_expunge_deletes, queued after the regular merges
+
+    Returns:
+        tuple: Queue of index names and the set of expunge deletes merges
+    """
+    expunge_indices = [index for index in expunge_indices if index not in indices]
+    if snapshot is not None:
+        indices = sorted(
+            indices, key=lambda index: get_merge_priority(index, snapshot), reverse=True)
+        expunge_indices = sorted(
+            expunge_indices, key=lambda index: get_reclaimable_bytes(index, snapshot),
+            reverse=True)
+    return list(indices) + expunge_indices, set(expunge_indices)
+
+def get_startable_merges(queue, shard_nodes, node_merges, max_merges_per_node,
+                         running_count, max_in_flight=None):
+    """Takes the queued merges whose nodes all have a free merge slot
+
+    Started merges are removed from the queue and hold a slot on each of
+    their nodes until release_merge_nodes.
+
+    Args:
+        queue (list): Index names in priority order
+        shard_nodes (dict): Index name mapped to the nodes of its shards
+        node_merges (dict): Node name mapped to its running merges
+        max_merges_per_node (int): Merges allowed at once on each node
+        running_count (int): Merges already running
+        max_in_flight (int, optional): Cluster wide merge limit
+
+    Returns:
+        list: Index names to start
+    """
+    startable = []
+    for index in list(queue):
+        if max_in_flight is not None and running_count + len(startable) >= max_in_flight:
+            break
+        nodes = shard_nodes.get(index, set())
+        if any(node_merges.get(node, 0) >= max_merges_per_node for node in nodes):
+            continue
+        queue.remove(index)
+        startable.append(index)
+        for node in nodes:
+            node_merges[node] = node_merges.get(node, 0) + 1
+    return startable
+
+def release_merge_nodes(index, shard_nodes, node_merges):
+    """Frees the node slots a finished merge held"""
+    for node in shard_nodes.get(index, set()):
+        node_merges[node] -= 1
+
+def print_forcemerge_started(index, nodes, only_expunge_deletes=False, task_id=None):
+    mode = "expunge deletes forcemerge" if only_expunge_deletes else "forcemerge"
+    if task_id is not None:
+        print(f"Started {mode} for {index} as task {task_id} " +
+              f"on {', '.join(sorted(nodes))}")
+    else:
+        print(f"Started {mode} for {index} on {', '.join(sorted(nodes))}")
+
+def run_forcemerge_tasks(client_config, indices, snapshot=None, max_in_flight=None,
+                         expunge_indices=()):
+    """Runs forcemerges as background tasks without overloading any node
+
+    Each index's shards are mapped to nodes with _cat/shards. A merge only
+    starts when every node holding the index runs fewer than
+    forcemerge.max_merges_per_node merges, and the most reclaimable index
+    that fits starts first whenever a node frees up. Merges are started
+    with wait_for_completion=false and polled through the tasks API every
+    forcemerge.task_poll_seconds, so no thread is held for a merge. On
+    clusters without forcemerge tasks each running merge holds a thread
+    waiting on its request instead, with the same limits. Expunge deletes
+    merges share the same limits and queue behind the
+    regular merges, largest reclaimable size first.
+
+    Args:
+        client_config (dict): Client configuration
+        indices (list): Index names to merge to one segment per shard
+        snapshot (ClusterSnapshot, optional): Used to prioritize merges.
+            Defaults to merging in the order given.
+        max_in_flight (int, optional): Cluster wide merge limit. Defaults
+            to no limit beyond the per node limit.
+        expunge_indices (list, optional): Index names to merge with
+            only_expunge_deletes. Defaults to none.
+
+    Returns:
+        dict: Index name mapped to True if every shard merged
+    """
+    indices, expunge = get_forcemerge_queue(indices, snapshot, expunge_indices)
+    poll_seconds = get_task_poll_seconds()
+    poll_retries = get_task_poll_retries()
+    poll_errors = {}
+    max_merges_per_node = get_max_merges_per_node()
+    if max_in_flight is not None:
+        max_in_flight = max(1, max_in_flight)
+    shard_nodes = es.get_shard_nodes(client_config, indices) if len(indices) != 0 else {}
+    if snapshot is not None:
+        topology = snapshot.topology
+    elif len(indices) != 0:
+        topology = get_cluster_topology(client_config)
+    request_executor = None
+    if len(indices) != 0 and not check_forcemerge_tasks_supported(topology):
+        all_nodes = set().union(*shard_nodes.values())
+        request_executor = ThreadPoolExecutor(
+            max_workers=max(1, len(all_nodes) * max_merges_per_node),
+            thread_name_prefix="forcemerge")
+    node_merges = {}
+    queue = list(indices)
+    running = {}
+    results = {}
+    while len(queue) != 0 or len(running) != 0:
+        for index in get_startable_merges(queue, shard_nodes, node_merges,
+                                          max_merges_per_node, len(running), max_in_flight):
+            nodes = shard_nodes.get(index, set())
+            try:
+                if request_executor is None:
+                    running[index] = es.start_forcemerge_task(
+                        client_config, index, only_expunge_deletes=index in expunge)
+                else:
+                    running[index] = request_executor.submit(
+                        es.run_forcemerge_request, client_config, index,
+                        index in expunge, get_client_timeout('forcemerge'))
+            except Exception as e:
+                print_forcemerge_result(index, False, e, index in expunge)
+                results[index] = False
+                release_merge_nodes(index, shard_nodes, node_merges)
+                continue
+            print_forcemerge_started(
+                index, nodes, index in expunge,
+                running[index] if request_executor is None else None)
+        if len(running) == 0:
+            # Every queued merge failed to start
+            break
+        time.sleep(poll_seconds)
+        for index, task_id in list(running.items()):
+            try:
+                if request_executor is None:
+                    completed, succeeded, result = es.get_task_status(client_config, task_id)
                 else:
-                    print("Forcemerge for " + index + " unsuccessful")
-            else:
-                print("Forcemerge for " + index + " unsuccessful")
-    elastic_connection.close()
-
-def apply_forcemerge_to_indices(indices, index_forcemerge_policies, client_config):
-    elastic_connection = es.build_es_connection(client_config)
-    with ThreadPoolExecutor(max_workers=es.get_lowest_data_node_thread_count(client_config)) as executor:
-        for index in indices:
-            index = str(index['index'])
-            # Only proceed if index is not a special index
-            if not es.check_special_index(index):
-                future = executor.submit(forcemerge_indices, client_config, index, index_forcemerge_policies)
-    elastic_connection.close()
+                    completed, succeeded, result = get_request_status(task_id)
+                poll_errors.pop(index, None)
+            except Exception as e:
+                # The merge may still be running so its nodes stay busy until
+                # the task can be checked or the retries run out
+                poll_errors[index] = poll_errors.get(index, 0) + 1
+                if poll_errors[index] < poll_retries:
+                    print(f"Unable to check forcemerge task {task_id} for {index}: {e}")
+                    continue
+                completed, succeeded, result = True, False, e
+            if completed:
+                running.pop(index)
+                release_merge_nodes(index, shard_nodes, node_merges)
+                results[index] = succeeded
+                print_forcemerge_result(index, succeeded, result, index in expunge)
+    if request_executor is not None:
+        request_executor.shutdown()
+    return results
+
+def get_request_status(future):
+    """Returns a waiting forcemerge request's state like es.get_task_status
+
+    Args:
+        future (Future): Result of es.run_forcemerge_request in a thread
+
+    Returns:
+        tuple: completed (bool), succeeded (bool) and the response or error
+    """
+    if not future.done():
+        return False, False, None
+    if future.exception() is not None:
+        return True, False, future.exception()
+    succeeded, result = future.result()
+    return True, succeeded, result
+
+def apply_forcemerge(client_config, index, only_expunge_deletes=False):
+    return es.forcemerge_index(
+        client_config, index, get_task_poll_seconds(), only_expunge_deletes,
+        get_task_poll_retries(),
+        check_forcemerge_tasks_supported(get_cluster_topology(client_config)),
+        get_client_timeout('forcemerge'))
+
+def forcemerge_indices(client_config, index, index_forcemerge_policies, snapshot):
+    if check_forcemerge_due(client_config, index, index_forcemerge_policies, snapshot):
+        apply_forcemerge(client_config, index)
+    elif check_expunge_deletes_due(client_config, index, index_forcemerge_policies, snapshot):
+        apply_forcemerge(client_config, index, only_expunge_deletes=True)
+
+def get_due_merges(indices, index_forcemerge_policies, client_config, snapshot):
+    """Returns the indices due a forcemerge and an expunge deletes merge"""
+    due = []
+    expunge = []
+    special_indices = snapshot.get_special_indices()
+    for index in indices:
+        index = str(index['index'])
+        # Only proceed if index is not a special index
+        if index not in special_indices:
+            if check_forcemerge_due(client_config, index, index_forcemerge_policies, snapshot):
+                due.append(index)
+            elif check_expunge_deletes_due(client_config, index, index_forcemerge_policies, snapshot):
+                expunge.append(index)
+    return due, expunge
+
+def apply_forcemerge_to_indices(indices, index_forcemerge_policies, client_config, snapshot):
+    due, expunge = get_due_merges(indices, index_forcemerge_policies, client_config, snapshot)
+    run_forcemerge_tasks(client_config, due, snapshot, expunge_indices=expunge)
+
+def apply_forcemerge_to_client(client_config):
+    """Apply forcemerge policies to one client
+
+    Args:
+        client_config (dict): Client configuration
+    """
+    print("Processing forcemerge for " + client_config['client_name'])
+    # Grab the client's forcemerge policies
+    index_forcemerge_policies = get_forcemerge_policy(client_config)
+    # Next, get information on all current indices in cluster
+    snapshot = get_cluster_snapshot(client_config, 'forcemerge')
+    # Get the list of indices that are older than the forcemerge policy
+    apply_forcemerge_to_indices(snapshot.indices, index_forcemerge_policies, client_config, snapshot)
+
+async def get_shard_nodes_async(connection, limit, indices):
+    """Asyncio counterpart of es.get_shard_nodes"""
+    shard_nodes = {index: set() for index in indices}
+    for chunk in es.get_list_by_chunk_size(list(indices), 100):
+        async with limit:
+            shards = await connection.cat.shards(
+                index=",".join(chunk), format="json", h="index,state,node")
+        for shard in shards:
+            if shard['state'] == 'STARTED' and shard['index'] in shard_nodes:
+                shard_nodes[shard['index']].add(shard['node'])
+    return shard_nodes
+
+async def get_task_status_async(connection, limit, task_id):
+    """Asyncio counterpart of es.get_task_status"""
+    try:
+        async with limit:
+            task = await connection.tasks.get(task_id=task_id)
+    except es.NotFoundError as e:
+        return True, False, str(e)
+    return es.get_task_result(task)
+
+async def run_forcemerge_request_async(connection, index, only_expunge_deletes, request_timeout):
+    """Asyncio counterpart of es.run_forcemerge_request"""
+    status = await connection.indices.forcemerge(
+        index=index,
+        expand_wildcards="all",
+        request_timeout=request_timeout,
+        **es.get_forcemerge_options(only_expunge_deletes)
+    )
+    return status.get('_shards', {}).get('failed', 0) == 0, status
+
+async def run_forcemerge_tasks_async(client_config, connection, limit, indices, snapshot,
+                                     expunge_indices=()):
+    """Asyncio counterpart of run_forcemerge_tasks
+
+    Uses the same queue and per node limits. Task starts and checks go
+    through the engine's in-flight request limit and waits between checks
+    never hold a thread. Clusters without forcemerge tasks await a request
+    that waits for the merge, which holds its nodes but no request slot.
+
+    Args:
+        client_config (dict): Client configuration
+        connection (AsyncElasticsearch): Async client
+        limit (asyncio.Semaphore): In-flight request limit
+        indices (list): Index names to merge to one segment per shard
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
+        expunge_indices (list, optional): Index names to merge with
+            only_expunge_deletes. Defaults to none.
+
+    Returns:
+        dict: Index name mapped to True if every shard merged
+    """
+    queue, expunge = get_forcemerge_queue(indices, snapshot, expunge_indices)
+    if len(queue) == 0:
+        return {}
+    use_tasks = check_forcemerge_tasks_supported(snapshot.topology)
+    request_timeout = get_client_timeout('forcemerge')
+    poll_seconds = get_task_poll_seconds()
+    poll_retries = get_task_poll_retries()
+    poll_errors = {}
+    max_merges_per_node = get_max_merges_per_node()
+    shard_nodes = await get_shard_nodes_async(connection, limit, queue)
+    node_merges = {}
+    running = {}
+    results = {}
+    while len(queue) != 0 or len(running) != 0:
+        for index in get_startable_merges(queue, shard_nodes, node_merges,
+                                          max_merges_per_node, len(running)):
+            only_expunge_deletes = index in expunge
+            try:
+                if use_tasks:
+                    async with limit:
+                        status = await connection.indices.forcemerge(
+                            index=index,
+                            expand_wildcards="all",
+                            params={'wait_for_completion': 'false'},
+                            **es.get_forcemerge_options(only_expunge_deletes)
+                        )
+                    running[index] = status['task']
+                else:
+                    running[index] = asyncio.ensure_future(run_forcemerge_request_async(
+                        connection, index, only_expunge_deletes, request_timeout))
+            except Exception as e:
+                print_forcemerge_result(index, False, e, only_expunge_deletes)
+                results[index] = False
+                release_merge_nodes(index, shard_nodes, node_merges)
+                continue
+            print_forcemerge_started(
+                index, shard_nodes.get(index, set()), only_expunge_deletes,
+                running[index] if use_tasks else None)
+        if len(running) == 0:
+            break
+        await asyncio.sleep(poll_seconds)
+        for index, task_id in list(running.items()):
+            try:
+                if use_tasks:
+                    completed, succeeded, result = await get_task_status_async(
+                        connection, limit, task_id)
+                else:
+                    completed, succeeded, result = get_request_status(task_id)
+                poll_errors.pop(index, None)
+            except Exception as e:
+                poll_errors[index] = poll_errors.get(index, 0) + 1
+                if poll_errors[index] < poll_retries:
+                    print(f"Unable to check forcemerge task {task_id} for {index}: {e}")
+                    continue
+                completed, succeeded, result = True, False, e
+            if completed:
+                running.pop(index)
+                release_merge_nodes(index, shard_nodes, node_merges)
+                results[index] = succeeded
+                print_forcemerge_result(index, succeeded, result, index in expunge)
+    return results
+
+async def apply_forcemerge_to_client_async(client_config, snapshot, connection, limit):
+    print("Processing forcemerge for " + client_config['client_name'])
+    index_forcemerge_policies = get_forcemerge_policy(client_config)
+    # Load segment counts and newest document dates before deciding so no
+    # request blocks the loop
+    await run_sync(snapshot.get_segment_counts)
+    await run_sync(snapshot.get_newest_document_dates)
+    due, expunge = get_due_merges(
+        snapshot.indices, index_forcemerge_policies, client_config, snapshot)
+    await run_forcemerge_tasks_async(
+        client_config, connection, limit, due, snapshot, expunge_indices=expunge)
 
 def apply_forcemerge_policies(manual_client=""):
     settings = load_settings()
-    retry_count = 60
-    sleep_time = 60
-    success = 0
     if "forcemerge" in settings:
         if "enabled" in settings:
             forcemerge_enabled = settings['forcemerge']['enabled']
@@ -71,34 +537,19 @@ def apply_forcemerge_policies(manual_client=""):
     if forcemerge_enabled:
         # Load all client configurations from /opt/maintenance/*.json
         clients = load_configs()
-        # Loop through each client to perform accounting per client
-        for client in clients:
-            # Set nice variable names
-            client_name = clients[client]['client_name']
-            print("Processing forcemerge for " + client_name)
-            client_config = clients[client]
-            # If client set at command line only run it otherwise
-            # execute for all clients
-            if manual_client == "" or client_name == manual_client:
-                if settings['settings']['limit_to_client'] == client or settings['settings']['limit_to_client'] == "":
-                    while retry_count >= 0 and success == 0:
-                        # Grab the client's forcemerge policies
-                        index_forcemerge_policies = get_forcemerge_policy(client_config)
-                        # Next, get information on all current indices in cluster
-                        indices = es.es_get_indices(client_config)
-                        # Get the list of indices that are older than the forcemerge policy
-                        apply_forcemerge_to_indices(indices, index_forcemerge_policies, client_config)
-                        success = 1
-                    else:
-                        if retry_count == 0:
-                            message = "forcemerge operation failed.\n\nIt is also possible that connections are unable to be made to the client/nginx node. Please fix.\n\nRemember that in order for client's to be properly build you will need to get their cluster status to **Green** or **Yellow** and then re-run the following command:\n\n**python3 /opt/elastic-ilm/forcemerge.py --client " + client_name + "**"
-                            send_notification(client_config, "forcemerge", "Failed", message, teams=settings['forcemerge']['ms-teams'], jira=settings['forcemerge']['jira'])
-                    if success == 0:
-                        # Decrese retry count by one before trying while statement again
-                        retry_count = retry_count - 1
-                        print("Retry attempts left for forcemerge operation set to " + str(retry_count) + " sleeping for " + str(sleep_time) + " seconds")
-                        time.sleep(sleep_time)
-                    
+        # If client set at command line only run it otherwise
+        # execute for all clients
+        clients = {
+            client: client_config
+            for client, client_config in clients.items()
+            if (manual_client == "" or client_config['client_name'] == manual_client) and
+            (settings['settings']['limit_to_client'] == client or settings['settings']['limit_to_client'] == "")
+        }
+        if get_engine('forcemerge') == "asyncio":
+            run_job_async('forcemerge', clients, apply_forcemerge_to_client_async)
+        else:
+            run_for_clients('forcemerge', clients, apply_forcemerge_to_client)
+
 if __name__ == "__main__":
     import argparse
     from argparse import RawTextHelpFormatter
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""Predicts when rollover aliases reach their thresholds from ingest rates"""
+import heapq
+import threading
+import time
+from config import load_settings
+
+forecast_registry = {}
+forecast_registry_lock = threading.Lock()
+
+
+class RolloverForecast:
+    """Growth rates and next check times of one client's rollover aliases
+
+    Each alias keeps its last write index size sample and an exponentially
+    weighted growth rate in bytes per hour. Aliases are ordered by their
+    next check time in a heap so a run can tell without any cluster request
+    whether anything is due.
+    """
+
+    def __init__(self, client_name):
+        self.client_name = client_name
+        self.samples = {}
+        self.rates = {}
+        self.next_checks = {}
+        self.predictions = {}
+        self.queue = []
+        self.refreshed = None
+        self.lock = threading.Lock()
+
+    def record(self, alias, index, size, created, now=None):
+        """Records a write index size sample and returns the growth rate
+
+        The first sample of a write index estimates the rate from its size
+        and age. Later samples are blended into the previous rate. A sample
+        no newer than the last one, such as a reused cluster snapshot, leaves
+        the rate unchanged.
+
+        Args:
+            alias (str): Alias or data stream name
+            index (str): Write index name
+            size (int): Primary store size in bytes
+            created (float): Write index creation time in epoch seconds
+            now (float, optional): Time the size was measured in epoch
+                seconds. Defaults to the current time.
+
+        Returns:
+            float: Growth rate in bytes per hour
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            previous = self.samples.get(alias)
+            if previous is not None and previous[0] == index and now <= previous[1]:
+                return self.rates[alias]
+            if previous is None or previous[0] != index:
+                rate = size / max(1, now - created) * 3600
+            else:
+                measured = max(0, size - previous[2]) / (now - previous[1]) * 3600
+                rate = 0.5 * self.rates[alias] + 0.5 * measured
+            self.samples[alias] = (index, now, size)
+            self.rates[alias] = rate
+            return rate
+
+    def get_rate(self, alias, index):
+        """Returns an alias's growth rate if it was sampled on this write index"""
+        with self.lock:
+            sample = self.samples.get(alias)
+            if sample is None or sample[0] != index:
+                return None
+            return self.rates[alias]
+
+    def schedule(self, alias, check_time, predicted=None):
+        """Sets when an alias next needs checking
+
+        Args:
+            alias (str): Alias or data stream name
+            check_time (float): Epoch seconds of the next check
+            predicted (float, optional): Epoch seconds the alias is
+                predicted to roll over. Defaults to unknown.
+        """
+        with self.lock:
+            self.next_checks[alias] = check_time
+            if predicted is None:
+                self.predictions.pop(alias, None)
+            else:
+                self.predictions[alias] = predicted
+            heapq.heappush(self.queue, (check_time, alias))
+
+    def next_check(self):
+        """Returns the earliest next check time or None"""
+        with self.lock:
+            # Entries replaced by a later schedule call are dropped lazily
+            while len(self.queue) != 0:
+                check_time, alias = self.queue[0]
+                if self.next_checks.get(alias) == check_time:
+                    return check_time
+                heapq.heappop(self.queue)
+            return None
+
+    def get_predicted_aliases(self, before):
+        """Returns aliases predicted to roll over before a time"""
+        with self.lock:
+            return sorted(
+                alias for alias, predicted in self.predictions.items()
+                if predicted <= before)
+
+    def forget(self, aliases):
+        """Drops aliases that no longer exist"""
+        with self.lock:
+            for alias in aliases:
+                self.samples.pop(alias, None)
+                self.rates.pop(alias, None)
+                self.next_checks.pop(alias, None)
+                self.predictions.pop(alias, None)
+
+
+def get_rollover_forecast(client_name):
+    """Returns the rollover forecast of a client, creating it if needed"""
+    with forecast_registry_lock:
+        if client_name not in forecast_registry:
+            forecast_registry[client_name] = RolloverForecast(client_name)
+        return forecast_registry[client_name]
+
+
+def get_forecast_settings():
+    """Returns predictive rollover settings from settings.rollover
+
+    Returns:
+        dict: enabled, min_check_minutes, max_check_minutes and margin
+    """
+    settings = load_settings()
+    rollover_settings = settings.get('rollover', {})
+    forecast_settings = {
+        'enabled': False,
+        'min_check_minutes': 1,
+        'max_check_minutes': 60,
+        'margin': 0.5
+    }
+    if 'predictive' in rollover_settings:
+        forecast_settings['enabled'] = rollover_settings['predictive']
+    if 'predictive_min_check_minutes' in rollover_settings:
+        forecast_settings['min_check_minutes'] = \
+            rollover_settings['predictive_min_check_minutes']
+    if 'predictive_max_check_minutes' in rollover_settings:
+        forecast_settings['max_check_minutes'] = \
+            rollover_settings['predictive_max_check_minutes']
+    if 'predictive_margin' in rollover_settings:
+        forecast_settings['margin'] = rollover_settings['predictive_margin']
+    return forecast_settings
+
+
+def predict_seconds_to_rollover(rate, size, created, thresholds, now=None):
+    """Predicts how long until an alias meets its size or days policy
+
+    Args:
+        rate (float): Growth rate in bytes per hour
+        size (int): Current primary store size in bytes
+        created (float): Write index creation time in epoch seconds
+        thresholds (dict): size and minimum_size in bytes, and days
+        now (float, optional): Current epoch seconds. Defaults to now.
+
+    Returns:
+        float: Seconds until the first threshold is met, 0 if already met
+    """
+    if now is None:
+        now = time.time()
+
+    def seconds_to_size(target):
+        if size >= target:
+            return 0
+        if rate <= 0:
+            return float('inf')
+        return (target - size) / rate * 3600
+
+    # The days policy also needs the minimum shard size to be reached
+    days_seconds = max(
+        created + thresholds['days'] * 86400 - now,
+        seconds_to_size(thresholds['minimum_size'])
+    )
+    return max(0, min(seconds_to_size(thresholds['size']), days_seconds))
+
+
+def get_next_check_time(seconds_to_rollover, forecast_settings, now=None):
+    """Returns when to check an alias again
+
+    Checks move closer together as the predicted rollover approaches, so a
+    fast growing alias is caught near its target size while a slow one is
+    only checked every predictive_max_check_minutes.
+
+    Args:
+        seconds_to_rollover (float): Result of predict_seconds_to_rollover
+        forecast_settings (dict): Result of get_forecast_settings
+        now (float, optional): Current epoch seconds. Defaults to now.
+
+    Returns:
+        float: Epoch seconds of the next check
+    """
+    if now is None:
+        now = time.time()
+    delay = min(
+        max(seconds_to_rollover * forecast_settings['margin'],
+            forecast_settings['min_check_minutes'] * 60),
+        forecast_settings['max_check_minutes'] * 60
+    )
+    return now + delay
@@ -1,18 +1,26 @@
 #!/usr/bin/env python3
 """Launches Elastic ILM"""
-import hashlib
 import argparse
-import time
+import hashlib
+import json
+import os
+from datetime import datetime
 from argparse import RawTextHelpFormatter
+from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.schedulers.background import BackgroundScheduler
-from config import load_settings
-from accounting import run_accounting
+from config import get_client_config, load_configs, load_settings, settings_file
+from es import close_es_connections, evict_es_connection, get_connection_key
+from watcher import ConfigWatcher
+from fanout import get_max_concurrent_clients, run_single_client
+from async_engine import get_engine, run_job_async
+from accounting import run_client_accounting
 #from custom_checks import run_custom_checks
-from retention import apply_retention_policies
-from allocation import apply_allocation_policies
-from rollover import apply_rollover_policies
-from forcemerge import apply_forcemerge_policies
-from backup import run_backup
+from retention import apply_retention_to_client, apply_retention_to_client_async
+from allocation import apply_allocation_to_client, apply_allocation_to_client_async
+from rollover import rollover_client_indicies, rollover_client_indicies_async
+from forcemerge import apply_forcemerge_to_client, apply_forcemerge_to_client_async
+from backup import run_client_backup
+from lifecycle import apply_lifecycle_to_client, plan_lifecycle_policies
 parser = argparse.ArgumentParser(
     description='Used to manually run script (Example: ilm.py --manual 1)',
     formatter_class=RawTextHelpFormatter
@@ -29,6 +37,11 @@ parser.add_argument(
     type=str,
     help="Set to a specific client name to limit calls to one client"
 )
+parser.add_argument(
+    "--plan",
+    action="store_true",
+    help="Print each client's lifecycle plan, timings and request counts and exit"
+)
 parser.add_argument(
     "--notification",
     default="True",
@@ -45,99 +58,202 @@ if args.notification == "True":
 else:
     NOTIFICATION = False
 
+# Job name, per-client function, its asyncio engine counterpart if any, and
+# whether it runs as soon as it is scheduled
+JOBS = (
+    ('rollover', rollover_client_indicies, rollover_client_indicies_async, True),
+    ('accounting', run_client_accounting, None, True),
+    ('backup', run_client_backup, None, True),
+    ('retention', apply_retention_to_client, apply_retention_to_client_async, True),
+    ('allocation', apply_allocation_to_client, apply_allocation_to_client_async, True),
+    ('forcemerge', apply_forcemerge_to_client, apply_forcemerge_to_client_async, False),
+    ('lifecycle', apply_lifecycle_to_client, None, True),
+)
+
+# Jobs replaced by the lifecycle job when it is enabled
+LIFECYCLE_JOBS = ('rollover', 'retention', 'allocation', 'forcemerge')
+
+# Jobs are scheduled once per client. Each job gets its own thread pool of
+# max_concurrent_clients threads, so that is how many clients a job runs at
+# the same time and other clients' runs of the job queue behind them
+executors = {
+    name: ThreadPoolExecutor(get_max_concurrent_clients())
+    for name, _, _, _ in JOBS
+}
 if manual == 0:
-    sched = BackgroundScheduler(daemon=True)
+    sched = BackgroundScheduler(daemon=True, executors=executors)
 else:
-    sched = BackgroundScheduler(daemon=False)
+    sched = BackgroundScheduler(daemon=False, executors=executors)
+
+
+def run_job(name, function, async_function, client_name):
+    """Runs a job for one client with the engine the job is set to use
+
+    Args:
+        name (str): Job name
+        function (function): Per-client function of the threads engine
+        async_function (function): Per-client coroutine of the asyncio
+            engine, or None if the job only runs on threads
+        client_name (str): Client name
+    """
+    client_config = get_client_config(client_name)
+    if client_config is None:
+        # Removed since the job was scheduled. The next reload unschedules it
+        return
+    if async_function is not None and get_engine(name) == "asyncio":
+        run_job_async(name, {client_name: client_config}, async_function)
+    else:
+        run_single_client(name, client_config, function)
+
+
+def get_fingerprint(*values):
+    """Returns a stable hash of settings or client configuration values"""
+    return hashlib.sha256(
+        json.dumps(values, sort_keys=True, default=dict).encode()).hexdigest()
+
+
+def build_job_plan():
+    """Builds the set of scheduled jobs from settings and client configs
+
+    Each enabled job is scheduled once per client so a change to one client
+    or one job section only touches the affected schedules.
+
+    Returns:
+        dict: Job id mapped to function, interval, client and fingerprint
+    """
+    settings = load_settings()
+    clients = load_configs(manual_client)
+    limit_to_client = settings['settings']['limit_to_client']
+    plan = {}
+    lifecycle_enabled = 'lifecycle' in settings and settings['lifecycle']['enabled']
+    for name, function, async_function, run_now in JOBS:
+        if lifecycle_enabled and name in LIFECYCLE_JOBS:
+            continue
+        if name in settings:
+            enabled = settings[name]['enabled']
+            minutes = settings[name]['minutes_between_run']
+            job_settings = settings[name]
+        else:
+            enabled = False
+            minutes = 1440
+            job_settings = {}
+        if not enabled:
+            # Forcemerge has always run daily even when disabled
+            if name != 'forcemerge':
+                continue
+            minutes = 1440
+        for client_name, client_config in clients.items():
+            if limit_to_client != "" and limit_to_client != client_name:
+                continue
+            plan[f"{name}-{client_name}"] = {
+                'name': name,
+                'function': function,
+                'async_function': async_function,
+                'minutes': minutes,
+                'client': client_name,
+                'run_now': run_now,
+                # Global settings are read on every run so only the job's
+                # own section and the client decide if the job changed
+                'fingerprint': get_fingerprint(job_settings, client_config),
+                'connection': get_connection_key(client_config, 0)[1]
+            }
+    return plan
+
+
+def add_job(job_id, job):
+    """Schedules one job for one client"""
+    options = {}
+    if job['run_now']:
+        options['next_run_time'] = datetime.now()
+    sched.add_job(
+        run_job,
+        'interval',
+        minutes=job['minutes'],
+        args=[job['name'], job['function'], job['async_function'], job['client']],
+        executor=job['name'],
+        id=job_id,
+        name=job_id,
+        max_instances=1,
+        coalesce=True,
+        **options
+    )
+
 
 def start_jobs():
     """Starts background jobs
+
+    Returns:
+        dict: Scheduled job plan
     """
-    settings = load_settings()
+    plan = build_job_plan()
+    for job_id, job in plan.items():
+        add_job(job_id, job)
+    sched.start()
+    return plan
+
+
+def reload_jobs(current_plan):
+    """Applies configuration changes to the running scheduler
+
+    Jobs that were removed are unscheduled, new jobs are scheduled, and jobs
+    whose interval changed are rescheduled. Jobs already running finish their
+    current run. Jobs whose other settings changed pick up the new
+    configuration on their next run without being re-run now. Pooled
+    connections are only closed for clients that were removed or whose
+    connection settings changed.
 
-    if 'rollover' in settings:
-        if settings['rollover']['enabled']:
-            sched.add_job(
-                apply_rollover_policies,
-                'interval',
-                minutes=settings['rollover']['minutes_between_run'],
-                args=[manual_client]
-            )
-            apply_rollover_policies(manual_client)
-
-    if "accounting" in settings:
-        if settings['accounting']['enabled']:
-            sched.add_job(
-                run_accounting,
-                'interval',
-                minutes=settings['accounting']['minutes_between_run'],
-                args=[manual_client]
-            )
-            run_accounting(manual_client)
-
-    if 'backup' in settings:
-        if settings['backup']['enabled']:
-            sched.add_job(run_backup, 'interval', minutes=settings['backup']['minutes_between_run'])
-            run_backup()
-
-    if 'retention' in settings:
-        if settings['retention']['enabled']:
-            sched.add_job(
-                apply_retention_policies,
-                'interval',
-                minutes=settings['retention']['minutes_between_run']
-                #,
-                #args=[settings['retention']['health_check_level']]
-            )
-            apply_retention_policies()
-
-    if 'allocation' in settings:
-        if settings['allocation']['enabled']:
-            sched.add_job(
-                apply_allocation_policies,
-                'interval',
-                minutes=settings['allocation']['minutes_between_run']
-            )
-            apply_allocation_policies()
-
-    if 'forcemerge' in settings:
-        if settings['forcemerge']['enabled']:
-            sched.add_job(
-                apply_forcemerge_policies,
-                'interval',
-                minutes=settings['forcemerge']['minutes_between_run']
-            )
+    Args:
+        current_plan (dict): Plan currently scheduled
+
+    Returns:
+        dict: New scheduled job plan
+    """
+    new_plan = build_job_plan()
+    for job_id in current_plan.keys() - new_plan.keys():
+        print(f"Configuration changed. Removing job {job_id}")
+        sched.remove_job(job_id)
+    for job_id in new_plan.keys() - current_plan.keys():
+        print(f"Configuration changed. Adding job {job_id}")
+        add_job(job_id, new_plan[job_id])
+    for job_id in new_plan.keys() & current_plan.keys():
+        old_job = current_plan[job_id]
+        new_job = new_plan[job_id]
+        if old_job['fingerprint'] == new_job['fingerprint']:
+            continue
+        if old_job['minutes'] != new_job['minutes']:
+            print(f"Configuration changed. Rescheduling job {job_id} " +
+                  f"to every {new_job['minutes']} minutes")
+            sched.reschedule_job(
+                job_id, trigger='interval', minutes=new_job['minutes'])
         else:
-            sched.add_job(
-                apply_forcemerge_policies,
-                'interval',
-                minutes=1440
-            )
-    else:
-        sched.add_job(
-            apply_forcemerge_policies,
-            'interval',
-            minutes=1440
-        )
+            print(f"Configuration changed. Job {job_id} uses new " +
+                  "settings on its next run")
+    old_connections = {job['client']: job['connection'] for job in current_plan.values()}
+    new_connections = {job['client']: job['connection'] for job in new_plan.values()}
+    for client_name, connection in old_connections.items():
+        if new_connections.get(client_name) != connection:
+            # Connections are rebuilt on next use with the new settings
+            evict_es_connection({'client_name': client_name})
+    return new_plan
 
-    sched.start()
 
 if __name__ == "__main__":
-    settings_as_bytes = load_settings(format='bytes')
-    CONFIG_HASH = hashlib.sha256(settings_as_bytes).hexdigest()
-
-    start_jobs()
-
-    while True:
-        time.sleep(5)
-        settings_as_bytes = load_settings(format='bytes')
-        CURRENT_HASH = hashlib.sha256(settings_as_bytes).hexdigest()
-        if CURRENT_HASH != CONFIG_HASH:
-            print("Configuration changed. Reloading jobs")
-            CONFIG_HASH = CURRENT_HASH
-            sched.shutdown()
-            if manual == 0:
-                sched = BackgroundScheduler(daemon=True)
-            else:
-                sched = BackgroundScheduler(daemon=False)
-            start_jobs()
+    if args.plan:
+        plan_lifecycle_policies(manual_client, verbose=True)
+        raise SystemExit(0)
+    job_plan = start_jobs()
+    watcher = ConfigWatcher(
+        settings_file, load_settings()['settings']['client_json_folder'])
+    try:
+        while True:
+            if watcher.wait(timeout=60):
+                job_plan = reload_jobs(job_plan)
+                client_json_folder = load_settings()['settings']['client_json_folder']
+                if os.path.abspath(client_json_folder) != watcher.client_json_folder:
+                    # Client folder moved, watch the new one
+                    watcher.close()
+                    watcher = ConfigWatcher(settings_file, client_json_folder)
+    finally:
+        watcher.close()
+        sched.shutdown()
+        close_es_connections()
@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""Plans and applies every lifecycle policy from one cluster snapshot"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+import es
+from config import load_configs, load_settings
+from error import send_notification
+from cluster import ClusterSnapshot, get_cluster_snapshot
+from fanout import run_for_clients
+from limiter import get_adaptive_limiter
+from retention import get_retention_policy, get_retention_decision, \
+    apply_retention_decision
+from allocation import get_allocation_policy, get_allocation_settings, \
+    apply_allocation_settings
+from forcemerge import get_forcemerge_policy, check_forcemerge_due, \
+    check_expunge_deletes_due, apply_forcemerge, run_forcemerge_tasks
+from rollover import get_rollover_policy, get_rollover_candidates, \
+    apply_rollover_decision
+
+# Actions are applied in this order. Every action of one type finishes
+# before the next type starts so dependencies are always complete
+ACTION_ORDER = ('rollover', 'allocate', 'forcemerge', 'delete')
+
+# Job whose settings and concurrency limits apply to each action type
+ACTION_JOBS = {
+    'rollover': 'rollover',
+    'allocate': 'allocation',
+    'forcemerge': 'forcemerge',
+    'delete': 'retention'
+}
+
+
+class LifecycleAction:
+    """One planned change to an index or alias
+
+    Args:
+        action_type (str): rollover, allocate, forcemerge or delete
+        index (str): Index the action applies to
+        details (dict): Decision returned by the job's policy check
+        alias (dict, optional): Alias or data stream entry for rollovers
+        depends_on (list, optional): Actions that must succeed first
+    """
+
+    def __init__(self, action_type, index, details, alias=None, depends_on=None):
+        self.action_type = action_type
+        self.index = index
+        self.details = details
+        self.alias = alias
+        self.depends_on = depends_on or []
+        self.status = 'pending'
+
+    def __repr__(self):
+        return f"{self.action_type} {self.index}"
+
+
+def get_lifecycle_jobs():
+    """Returns the jobs enabled in settings.toml that lifecycle plans for
+
+    Forcemerge is planned unless settings.forcemerge.enabled is false, the
+    same as the scheduled forcemerge job.
+    """
+    settings = load_settings()
+    jobs = []
+    for job in ('rollover', 'allocation', 'forcemerge', 'retention'):
+        enabled = job == 'forcemerge'
+        if job in settings and 'enabled' in settings[job]:
+            enabled = settings[job]['enabled']
+        if enabled:
+            jobs.append(job)
+    return jobs
+
+
+def build_lifecycle_plan(client_config, snapshot, jobs=None):
+    """Evaluates every enabled policy for every index in one pass
+
+    An index due for deletion gets no allocation or forcemerge. A forcemerge
+    depends on the index's allocation so it runs on the nodes the index is
+    moving to, and a deletion depends on its index's rollover.
+
+    Args:
+        client_config (dict): Client configuration
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
+        jobs (list, optional): Jobs to plan for. Defaults to every enabled job.
+
+    Returns:
+        list: LifecycleActions in ACTION_ORDER
+    """
+    if jobs is None:
+        jobs = get_lifecycle_jobs()
+    plan = []
+    rollovers = {}
+    if 'rollover' in jobs:
+        index_rollover_policies = get_rollover_policy(client_config)
+        for alias, decision in get_rollover_candidates(
+                client_config, index_rollover_policies, snapshot):
+            action = LifecycleAction(
+                'rollover', decision['index'], decision, alias=alias)
+            rollovers[decision['index']] = action
+            plan.append(action)
+    if 'retention' in jobs:
+        index_retention_policies = get_retention_policy(client_config)
+    if 'allocation' in jobs:
+        index_allocation_policies = get_allocation_policy(client_config)
+    if 'forcemerge' in jobs:
+        index_forcemerge_policies = get_forcemerge_policy(client_config)
+    special_indices = snapshot.get_special_indices()
+    for index in snapshot.indices:
+        index = str(index['index'])
+        if index in special_indices:
+            continue
+        if 'retention' in jobs:
+            decision = get_retention_decision(
+                client_config, index, index_retention_policies, snapshot)
+            if decision is not None:
+                depends_on = []
+                if index in rollovers:
+                    depends_on.append(rollovers[index])
+                plan.append(LifecycleAction(
+                    'delete', index, decision, depends_on=depends_on))
+                # Nothing else is worth doing to an index about to be deleted
+                continue
+        allocation = None
+        if 'allocation' in jobs:
+            body = get_allocation_settings(
+                client_config, index, index_allocation_policies, snapshot)
+            if body is not None:
+                allocation = LifecycleAction('allocate', index, body)
+                plan.append(allocation)
+        if 'forcemerge' in jobs:
+            details = None
+            if check_forcemerge_due(
+                    client_config, index, index_forcemerge_policies, snapshot):
+                details = {}
+            elif check_expunge_deletes_due(
+                    client_config, index, index_forcemerge_policies, snapshot):
+                details = {'only_expunge_deletes': True}
+            if details is not None:
+                depends_on = []
+                if allocation is not None:
+                    depends_on.append(allocation)
+                plan.append(LifecycleAction(
+                    'forcemerge', index, details, depends_on=depends_on))
+    plan.sort(key=lambda action: ACTION_ORDER.index(action.action_type))
+    return plan
+
+
+def apply_lifecycle_action(client_config, action, snapshot):
+    """Applies one planned action and records whether it succeeded"""
+    try:
+        if action.action_type == 'rollover':
+            success = apply_rollover_decision(
+                client_config, action.alias, action.details)
+        elif action.action_type == 'allocate':
+            success = apply_allocation_settings(
+                client_config, action.index, action.details)
+        elif action.action_type == 'forcemerge':
+            success = apply_forcemerge(
+                client_config, action.index,
+                action.details.get('only_expunge_deletes', False))
+        else:
+            success = apply_retention_decision(
+                client_config, action.index, action.details, snapshot)
+    except Exception as e:
+        print(f"Lifecycle action {action} failed for " +
+              f"{client_config['client_name']}: {e}")
+        success = False
+    action.status = 'done' if success else 'failed'
+
+
+def apply_lifecycle_plan(client_config, plan, snapshot):
+    """Applies a plan one action type at a time
+
+    Each action type runs with its job's adaptive concurrency limit, except
+    forcemerges which run as tracked cluster tasks limited per node. Actions whose
+    dependencies failed are skipped.
+
+    Args:
+        client_config (dict): Client configuration
+        plan (list): LifecycleActions from build_lifecycle_plan
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
+    """
+    for action_type in ACTION_ORDER:
+        actions = [action for action in plan if action.action_type == action_type]
+        if len(actions) == 0:
+            continue
+        ready = []
+        for action in actions:
+            if any(dependency.status != 'done' for dependency in action.depends_on):
+                print(f"Skipping {action} as {action.depends_on} did not succeed")
+                action.status = 'skipped'
+            else:
+                ready.append(action)
+        if action_type == 'forcemerge':
+            # Merges run as cluster tasks, tracked without holding threads
+            results = run_forcemerge_tasks(
+                client_config,
+                [action.index for action in ready
+                 if not action.details.get('only_expunge_deletes')],
+                snapshot,
+                expunge_indices=[action.index for action in ready
+                                 if action.details.get('only_expunge_deletes')])
+            for action in ready:
+                action.status = 'done' if results.get(action.index) else 'failed'
+            continue
+        limiter = get_adaptive_limiter(client_config, ACTION_JOBS[action_type])
+        with ThreadPoolExecutor(max_workers=limiter.max_limit) as executor:
+            for action in ready:
+                executor.submit(
+                    limiter.run, apply_lifecycle_action, client_config, action, snapshot)
+
+
+def notify_lifecycle_health_failure(client_config):
+    """Sends a notification when cluster health never met the lifecycle level"""
+    settings = load_settings()
+    lifecycle_settings = settings.get('lifecycle', {})
+    message = "Lifecycle operation failed.\n\n" + \
+        "It is also possible that connections are " + \
+        "unable to be made to the client/nginx node. " + \
+        "Please fix.\n\nRemember that in order for " + \
+        "client's to be properly build you will need " + \
+        "to get their cluster status to **Green** " + \
+        "or **Yellow** and then re-run the following" + \
+        " command:\n\n**python3 " + \
+        "/opt/elastic-ilm/lifecycle.py --client " + \
+        client_config['client_name'] + "**"
+    send_notification(
+        client_config,
+        "lifecycle",
+        "Failed",
+        message,
+        teams=lifecycle_settings.get('ms-teams', True),
+        jira=lifecycle_settings.get('jira', False)
+    )
+
+
+def apply_lifecycle_to_client(client_config):
+    """Plans and applies lifecycle policies for one client
+
+    Args:
+        client_config (dict): Client configuration
+    """
+    settings = load_settings()
+    if 'lifecycle' in settings and 'health_check_level' in settings['lifecycle']:
+        health_check_level = settings['lifecycle']['health_check_level']
+    else:
+        health_check_level = 'yellow'
+    retry_count = 60
+    sleep_time = 60
+    client_name = client_config['client_name']
+    print("Processing lifecycle policies for " + client_name)
+    while not es.check_cluster_health_status(client_config, health_check_level):
+        if retry_count == 0:
+            print("Lifecycle operation failed for " + client_name +
+                  ". Cluster health does not meet level:  " + health_check_level)
+            notify_lifecycle_health_failure(client_config)
+            return
+        retry_count = retry_count - 1
+        print("Retry attempts left for lifecycle operation set to " +
+              str(retry_count) + " sleeping for " + str(sleep_time) + " seconds")
+        time.sleep(sleep_time)
+    snapshot = get_cluster_snapshot(client_config, 'lifecycle')
+    plan = build_lifecycle_plan(client_config, snapshot)
+    apply_lifecycle_plan(client_config, plan, snapshot)
+
+
+def measure_phase(report, phase, client_name, function, *args):
+    """Runs one planning phase and records its wall time and requests
+
+    Args:
+        report (dict): Plan report to add the phase to
+        phase (str): Phase name
+        client_name (str): Client whose requests are counted
+        function (function): Phase to run
+
+    Returns:
+        object: Return value of function
+    """
+    before = es.get_request_stats(client_name)
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+    after = es.get_request_stats(client_name)
+    report['phases'].append({
+        'phase': phase,
+        'seconds': seconds,
+        'requests': after['requests'] - before['requests'],
+        'bytes_sent': after['bytes_sent'] - before['bytes_sent'],
+        'bytes_received': after['bytes_received'] - before['bytes_received']
+    })
+    return result
+
+
+def plan_lifecycle_for_client(client_config, jobs=None):
+    """Builds a client's full action plan without changing the cluster
+
+    A fresh cluster snapshot is taken so the request counts reflect a cold
+    run. The only writes are to the local newest timestamp cache.
+
+    Args:
+        client_config (dict): Client configuration
+        jobs (list, optional): Jobs to plan for. Defaults to every enabled job.
+
+    Returns:
+        dict: jobs, health, phases, plan and projected action counts
+    """
+    settings = load_settings()
+    if jobs is None:
+        jobs = get_lifecycle_jobs()
+    if 'lifecycle' in settings and 'health_check_level' in settings['lifecycle']:
+        health_check_level = settings['lifecycle']['health_check_level']
+    else:
+        health_check_level = 'yellow'
+    client_name = client_config['client_name']
+    report = {'jobs': jobs, 'phases': []}
+    report['health'] = measure_phase(
+        report, 'cluster health', client_name,
+        es.check_cluster_health_status, client_config, health_check_level)
+    snapshot = measure_phase(
+        report, 'cluster snapshot', client_name, ClusterSnapshot, client_config)
+    measure_phase(
+        report, 'newest documents', client_name, snapshot.get_newest_document_dates)
+    report['plan'] = measure_phase(
+        report, 'policy evaluation', client_name,
+        build_lifecycle_plan, client_config, snapshot, jobs)
+    report['counts'] = {action_type: 0 for action_type in ACTION_ORDER}
+    for action in report['plan']:
+        report['counts'][action.action_type] += 1
+    return report
+
+
+def print_lifecycle_report(client_name, report, verbose=False):
+    """Prints a plan report from plan_lifecycle_for_client
+
+    Args:
+        client_name (str): Client name
+        report (dict): Plan report
+        verbose (bool, optional): Also list every action. Defaults to False.
+    """
+    print(f"Lifecycle plan for {client_name} ({', '.join(report['jobs'])})")
+    if not report['health']:
+        print("Cluster health does not meet the lifecycle health check level. " +
+              "A real run would wait for it")
+    print(f"{'Phase':<20}{'Seconds':>10}{'Requests':>10}{'Sent':>14}{'Received':>14}")
+    total = {'seconds': 0, 'requests': 0, 'bytes_sent': 0, 'bytes_received': 0}
+    for phase in report['phases']:
+        print(f"{phase['phase']:<20}{phase['seconds']:>10.2f}{phase['requests']:>10}" +
+              f"{phase['bytes_sent']:>14,}{phase['bytes_received']:>14,}")
+        for field in total:
+            total[field] += phase[field]
+    print(f"{'total':<20}{total['seconds']:>10.2f}{total['requests']:>10}" +
+          f"{total['bytes_sent']:>14,}{total['bytes_received']:>14,}")
+    print("Projected actions: " + ", ".join(
+        f"{action_type}={count}" for action_type, count in report['counts'].items()))
+    if verbose:
+        for action in report['plan']:
+            if len(action.depends_on) != 0:
+                print(f"  {action} after {action.depends_on}")
+            else:
+                print(f"  {action}")
+
+
+def plan_lifecycle_policies(manual_client="", verbose=False):
+    """Prints the lifecycle plan of every client without applying it
+
+    Args:
+        manual_client (str, optional): Name of client. Defaults to "".
+        verbose (bool, optional): Also list every action. Defaults to False.
+    """
+    settings = load_settings()
+    limit_to_client = settings['settings']['limit_to_client']
+    for client_name, client_config in load_configs(manual_client).items():
+        if limit_to_client == client_name or limit_to_client == "":
+            report = plan_lifecycle_for_client(client_config)
+            print_lifecycle_report(client_name, report, verbose)
+
+
+def apply_lifecycle_policies(manual_client=""):
+    """Apply every lifecycle policy through one plan per client
+
+    Args:
+        manual_client (str, optional): Name of client. Defaults to "".
+    """
+    settings = load_settings()
+    if 'lifecycle' in settings and settings['lifecycle']['enabled']:
+        limit_to_client = settings['settings']['limit_to_client']
+        clients = load_configs(manual_client)
+        clients = {
+            client_name: client_config
+            for client_name, client_config in clients.items()
+            if limit_to_client == client_name or limit_to_client == ""
+        }
+        run_for_clients('lifecycle', clients, apply_lifecycle_to_client)
+
+
+if __name__ == "__main__":
+    import argparse
+    from argparse import RawTextHelpFormatter
+    parser = argparse.ArgumentParser(
+        description='Used to manually run lifecycle policies against a specific client'
+        + ' (Example - lifecycle.py --client ha)',
+        formatter_class=RawTextHelpFormatter
+    )
+    parser.add_argument(
+        "--client",
+        default="",
+        type=str,
+        help="Set to a specific client name to limit the lifecycle script to one client"
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Print the actions, timings and request counts of a run without changing anything"
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="List every planned action with --plan"
+    )
+    args = parser.parse_args()
+    if args.plan:
+        plan_lifecycle_policies(args.client, args.verbose)
+    else:
+        apply_lifecycle_policies(args.client)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""Adaptive concurrency limiting driven by cluster thread pool pressure"""
+import threading
+import time
+import es
+from cluster import JOB_THREAD_POOLS, get_worker_count
+from config import load_settings
+
+# Thread pools whose queues and rejections indicate the cluster is under
+# pressure. The job's own thread pool is added to these
+PRESSURE_THREAD_POOLS = ('write', 'search')
+
+
+class AdaptiveLimiter:
+    """Additive increase, multiplicative decrease limit on in-flight requests
+
+    The limit grows by one after every limit requests complete and halves
+    when the cluster pushes back: thread pool rejections went up, a queue
+    is deeper than the queue threshold, average request latency is above
+    the latency target (if set), or a request failed. It halves at most
+    once per round trip, so requests already in flight when it was cut
+    must complete before it can be cut again. Thread pool stats are
+    sampled from _nodes/stats/thread_pool at most once per sample interval
+    while the job runs.
+    """
+
+    def __init__(self, client_config, job, max_limit, min_limit=1,
+                 queue_threshold=50, latency_target=5, sample_interval=5,
+                 adaptive=True):
+        self.client_config = client_config
+        self.job = job
+        self.max_limit = max(min_limit, max_limit)
+        self.min_limit = min_limit
+        self.queue_threshold = queue_threshold
+        self.latency_target = latency_target
+        self.sample_interval = sample_interval
+        self.adaptive = adaptive
+        self.pools = set(PRESSURE_THREAD_POOLS)
+        self.pools.add(JOB_THREAD_POOLS.get(job, 'management'))
+        if adaptive:
+            self.limit = max(min_limit, self.max_limit // 2)
+        else:
+            self.limit = self.max_limit
+        self.in_flight = 0
+        self.completed = 0
+        # Requests finished since the last decrease and how many were in
+        # flight when it happened
+        self.since_decrease = 0
+        self.decrease_window = 0
+        self.latency = None
+        self.rejected = None
+        self.sampled = time.monotonic()
+        self.condition = threading.Condition()
+        self.sample_lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a request slot is free"""
+        with self.condition:
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency, failed=False):
+        """Frees a request slot and adjusts the limit
+
+        Args:
+            latency (float): Seconds the request took
+            failed (bool, optional): Request raised an error. Defaults to False.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            self.since_decrease += 1
+            if self.adaptive:
+                if self.latency is None:
+                    self.latency = latency
+                else:
+                    self.latency = 0.8 * self.latency + 0.2 * latency
+                slow = self.latency_target is not None and \
+                    self.latency > self.latency_target
+                if failed or slow:
+                    self.decrease()
+                else:
+                    self.completed += 1
+                    if self.completed >= self.limit and self.limit < self.max_limit:
+                        self.limit += 1
+                        self.completed = 0
+            self.condition.notify_all()
+        if self.adaptive and time.monotonic() - self.sampled >= self.sample_interval:
+            self.sample()
+
+    def decrease(self):
+        """Halves the limit once per round trip. Caller must hold the condition"""
+        if self.since_decrease <= self.decrease_window:
+            return
+        self.since_decrease = 0
+        self.decrease_window = self.in_flight
+        limit = max(self.min_limit, self.limit // 2)
+        if limit != self.limit:
+            print(f"Reducing {self.job} concurrency for " +
+                  f"{self.client_config['client_name']} from {self.limit} to {limit}")
+        self.limit = limit
+        self.completed = 0
+
+    def sample(self):
+        """Checks cluster thread pool queues and rejections"""
+        # Only one thread samples at a time. The rest keep working
+        if not self.sample_lock.acquire(blocking=False):
+            return
+        try:
+            if time.monotonic() - self.sampled < self.sample_interval:
+                return
+            self.sampled = time.monotonic()
+            try:
+                elastic_connection = es.get_es_connection(self.client_config)
+                stats = elastic_connection.nodes.stats(metric="thread_pool")
+            except Exception as e:
+                print(f"Unable to sample thread pools for {self.client_config['client_name']}: {e}")
+                return
+            queue = 0
+            rejected = 0
+            for node in stats['nodes'].values():
+                for pool, pool_stats in node['thread_pool'].items():
+                    if pool in self.pools:
+                        queue = max(queue, pool_stats['queue'])
+                        rejected += pool_stats['rejected']
+            with self.condition:
+                rejections = self.rejected is not None and rejected > self.rejected
+                self.rejected = rejected
+                if rejections or queue > self.queue_threshold:
+                    self.decrease()
+        finally:
+            self.sample_lock.release()
+
+    def run(self, function, *args, **kwargs):
+        """Calls function once a request slot is free
+
+        Args:
+            function (function): Function making cluster requests
+
+        Returns:
+            object: Return value of function
+        """
+        self.acquire()
+        start = time.monotonic()
+        failed = True
+        try:
+            result = function(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            self.release(time.monotonic() - start, failed)
+
+
+def get_adaptive_limiter(client_config, job):
+    """Returns a limiter for one run of a job against a client
+
+    The maximum concurrency comes from cluster.get_worker_count. Set
+    settings.adaptive_concurrency to false to always run at that maximum.
+    adaptive_latency_target_seconds can be overridden per job section.
+
+    Args:
+        client_config (dict): Client configuration
+        job (str): Job name such as retention or allocation
+
+    Returns:
+        AdaptiveLimiter: Concurrency limiter
+    """
+    settings = load_settings()['settings']
+    adaptive = True
+    if 'adaptive_concurrency' in settings:
+        adaptive = settings['adaptive_concurrency']
+    queue_threshold = 50
+    if 'adaptive_queue_threshold' in settings:
+        queue_threshold = settings['adaptive_queue_threshold']
+    latency_target = 5
+    if 'adaptive_latency_target_seconds' in settings:
+        latency_target = settings['adaptive_latency_target_seconds']
+    job_settings = load_settings().get(job, {})
+    if 'adaptive_latency_target_seconds' in job_settings:
+        latency_target = job_settings['adaptive_latency_target_seconds']
+    sample_interval = 5
+    if 'adaptive_sample_seconds' in settings:
+        sample_interval = settings['adaptive_sample_seconds']
+    return AdaptiveLimiter(
+        client_config,
+        job,
+        get_worker_count(client_config, job),
+        queue_threshold=queue_threshold,
+        latency_target=latency_target,
+        sample_interval=sample_interval,
+        adaptive=adaptive
+    )
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""Compiled index name to policy matching shared by all policy types"""
+import threading
+from functools import lru_cache
+
+# Marks the end of a policy name inside the prefix trie
+END = ""
+
+policy_matchers = {}
+policy_matchers_lock = threading.Lock()
+
+
+class PolicyMatcher:
+    """Matches index names to the longest policy name they start with
+
+    Policy names are compiled into a prefix trie so a lookup costs the length
+    of the index name instead of sorting and scanning every policy. Results
+    are memoized per matcher. Indices that match no policy fall back to
+    global, the same as the original check_index_*_policy functions.
+    """
+
+    def __init__(self, policies, memo_size=131072):
+        self.policies = tuple(policies)
+        self.trie = {}
+        for policy in self.policies:
+            # Ignore global as that's the fallback if no policy is found
+            if policy == "global":
+                continue
+            node = self.trie
+            for character in policy:
+                node = node.setdefault(character, {})
+            node[END] = policy
+        self.match = lru_cache(maxsize=memo_size)(self.match_uncached)
+
+    def match_uncached(self, index):
+        """Returns the policy name for an index without using the memo
+
+        Args:
+            index (str): Index name
+
+        Returns:
+            str: Longest matching policy name or global
+        """
+        node = self.trie
+        policy = node.get(END, "global")
+        for character in index:
+            node = node.get(character)
+            if node is None:
+                break
+            if END in node:
+                policy = node[END]
+        return policy
+
+
+@lru_cache(maxsize=1024)
+def compile_policy_matcher(policy_names):
+    """Returns a cached matcher for a tuple of policy names
+
+    Args:
+        policy_names (tuple): Policy names
+
+    Returns:
+        PolicyMatcher: Compiled matcher
+    """
+    return PolicyMatcher(policy_names)
+
+
+def compile_client_policies(client_config):
+    """Compiles a matcher for every policy type in a client configuration
+
+    Called when client configurations are loaded so jobs never compile
+    matchers while processing indices.
+
+    Args:
+        client_config (dict): Client configuration
+    """
+    matchers = {}
+    if "policy" in client_config:
+        for policy_type, policies in client_config['policy'].items():
+            if isinstance(policies, dict):
+                matchers[policy_type] = PolicyMatcher(policies)
+    with policy_matchers_lock:
+        policy_matchers[client_config['client_name']] = matchers
+
+
+def get_policy_matcher(client_config, policy_type, policies):
+    """Returns the compiled matcher of a client's policy type
+
+    Args:
+        client_config (dict): Client configuration
+        policy_type (str): retention, allocation, forcemerge, rollover, etc.
+        policies (dict): Policies to compile if the client has none of this
+            type, such as the job's default global policy
+
+    Returns:
+        PolicyMatcher: Compiled matcher
+    """
+    with policy_matchers_lock:
+        matchers = policy_matchers.setdefault(client_config['client_name'], {})
+        if policy_type not in matchers:
+            matchers[policy_type] = PolicyMatcher(policies)
+        return matchers[policy_type]
+
+
+def check_index_policy_legacy(index, policies):
+    """Original sort and scan policy check. Used to verify the matcher"""
+    policies = sorted(policies, key=lambda policy: len(policy), reverse=True)
+    for policy in policies:
+        if policy != "global":
+            if index.startswith(policy):
+                return policy
+    return "global"
+
+
+if __name__ == "__main__":
+    import argparse
+    import random
+    import string
+    import time
+    from argparse import RawTextHelpFormatter
+    parser = argparse.ArgumentParser(
+        description='Benchmarks policy matching (Example - policy.py ' +
+        '--indices 100000 --policies 500)',
+        formatter_class=RawTextHelpFormatter
+    )
+    parser.add_argument("--indices", default=100000, type=int,
+                        help="Number of index names to match")
+    parser.add_argument("--policies", default=500, type=int,
+                        help="Number of policies to match against")
+    args = parser.parse_args()
+
+    random.seed(1)
+    benchmark_policies = {"global": 30}
+    while len(benchmark_policies) < args.policies:
+        prefix = "logstash-" + "".join(
+            random.choices(string.ascii_lowercase, k=random.randint(2, 8)))
+        benchmark_policies[prefix] = random.randint(1, 365)
+    names = list(benchmark_policies)
+    benchmark_indices = []
+    for number in range(args.indices):
+        prefix = random.choice(names) if random.random() < 0.9 else "other"
+        benchmark_indices.append(
+            f"{prefix}-2022.08.{number % 28 + 1:02}-{number:06}")
+
+    start = time.perf_counter()
+    matcher = PolicyMatcher(benchmark_policies)
+    compile_time = time.perf_counter() - start
+    start = time.perf_counter()
+    matched = [matcher.match(index) for index in benchmark_indices]
+    match_time = time.perf_counter() - start
+    start = time.perf_counter()
+    legacy = [check_index_policy_legacy(index, benchmark_policies)
+              for index in benchmark_indices]
+    legacy_time = time.perf_counter() - start
+    if matched != legacy:
+        raise SystemExit("PolicyMatcher results differ from legacy matching")
+    print(f"{args.indices} indices x {args.policies} policies")
+    print(f"Compile: {compile_time * 1000:.2f} ms")
+    print(f"PolicyMatcher: {match_time * 1000:.2f} ms")
+    print(f"Legacy sort and scan: {legacy_time * 1000:.2f} ms")
@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 """Applies retention policies"""
+import asyncio
 import time
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor
 import es
+from policy import get_policy_matcher
+from cluster import get_cluster_snapshot
+from limiter import get_adaptive_limiter
+from fanout import run_for_clients
+from async_engine import gather_bounded, get_engine, run_job_async, run_sync
 from config import load_configs, load_settings
 from error import send_notification
 NOTIFICATION = False
@@ -28,174 +34,292 @@ def get_retention_policy(client_config):
     return index_retention_policies
 
 
-def delete_old_indices(client_config, index, index_retention_policies):
+def get_retention_decision(client_config, index, index_retention_policies, snapshot):
+    """Checks if an index is past its retention policy
+
+    Args:
+        client_config (dict): Client configuration
+        index (str): Index name
+        index_retention_policies (dict): Retention policy
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
+
+    Returns:
+        dict: days_ago, policy_days and data_stream to delete instead of the
+            index when it is the data stream's only backing index, or None
+            if the index is kept
+    """
+    newest_record = snapshot.get_newest_document_date(index)
+    # make sure newest record is not empty
+    if newest_record == "":
+        return None
+    # Get the index specific retention policy
+    policy = get_policy_matcher(
+        client_config, 'retention', index_retention_policies).match(index)
+    # Get policy retention days from specific policy
+    policy_days = index_retention_policies[policy]
+    # Figure out how many days since current_date vs. newest_record
+    days_ago = (datetime.utcnow() - newest_record).days
+    # Check if days_ago is greater than or equal to policy date
+    if days_ago < policy_days:
+        return None
+    index_group = snapshot.get_index_group(index)
+    data_stream_info = snapshot.get_data_stream(index_group)
+    data_stream = None
+    if data_stream_info is not None and len(data_stream_info['indices']) == 1:
+        data_stream = index_group
+    return {'days_ago': days_ago, 'policy_days': policy_days, 'data_stream': data_stream}
+
+
+def notify_retention_failure(client_config, index, decision):
+    """Sends a notification for an index that could not be deleted"""
+    settings = load_settings()
+    message = f"Retention operation failed for client {client_config['client_name']}."
+    message = message + \
+        f"\nTried deleting index {index} due to age of "
+    message = message + \
+        f"{decision['days_ago']} vs policy limit of {decision['policy_days']}"
+
+    send_notification(
+        client_config,
+        "retention",
+        "Failed",
+        message,
+        teams=settings['retention']['ms-teams'],
+        jira=settings['retention']['jira']
+    )
+
+
+def delete_old_indices(client_config, index, index_retention_policies, snapshot):
     """Deletes indices past retention policy
 
     Args:
         client_config (dict): Client configuration
         index (str): Index name
         index_retention_policies (dict): Retention policy
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
+    """
+    decision = get_retention_decision(
+        client_config, index, index_retention_policies, snapshot)
+    if decision is not None:
+        apply_retention_decision(client_config, index, decision, snapshot)
+
+
+def apply_retention_decision(client_config, index, decision, snapshot):
+    """Deletes an index, or its data stream, past its retention policy
+
+    Args:
+        client_config (dict): Client configuration
+        index (str): Index name
+        decision (dict): Result of get_retention_decision
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
+
+    Returns:
+        bool: True if the index was deleted or would have been in debug mode
     """
     settings = load_settings()
-    elastic_connection = es.build_es_connection(client_config)
-    newest_record = ""
-    newest_record = es.get_newest_document_date_in_index(
-        client_config, index, elastic_connection)
-    # make sure newest record is not empty
-    if newest_record != "":
-        # Get the index specific retention policy
-        policy = es.check_index_retention_policy(
-            index, index_retention_policies)
-        # Get policy retention days from specific policy
-        policy_days = index_retention_policies[policy]
-        # Get current datetime
-        current_date = datetime.utcnow()
-        # Figure out how many days since current_date vs. newest_record
-        days_ago = (current_date - newest_record).days
-        # Check if days_ago is greater than or equal to policy date
-        # If greater than or equal to policy date, delete index
-        index_group = es.get_index_group(index)
-        if days_ago >= policy_days:
-            # Delete old index
-            print(f"Deleting index {index} due to age of {days_ago}"
-                  f" vs policy limit of {policy_days}")
-
-            index_group = es.get_index_group(index)
-            try:
-                data_stream_info = elastic_connection.indices.get_data_stream(
-                    name=index_group)
-                number_of_indices_in_ds = len(
-                    data_stream_info['data_streams'][0]['indices'])
-            except:
-                number_of_indices_in_ds = 0
-            if number_of_indices_in_ds == 1:
-                if 'debug' in settings['settings']:
-                    if settings['settings']['debug']:
-                        print(f"DEBUG - Would have deleted data stream {index_group}")
-                    else:
-                        elastic_connection.indices.delete_data_stream(name=index_group)
-                else:
-                    elastic_connection.indices.delete_data_stream(name=index_group)
+    elastic_connection = es.get_es_connection(client_config)
+    # Delete old index
+    print(f"Deleting index {index} due to age of {decision['days_ago']}"
+          f" vs policy limit of {decision['policy_days']}")
+    debug = 'debug' in settings['settings'] and settings['settings']['debug']
+    if decision['data_stream'] is not None:
+        if debug:
+            print(f"DEBUG - Would have deleted data stream {decision['data_stream']}")
+        else:
+            elastic_connection.indices.delete_data_stream(name=decision['data_stream'])
+        return True
+    if debug:
+        print(f"DEBUG - Would have deleted data stream {index}")
+        return True
+    if es.delete_index(client_config, index):
+        snapshot.discard_index(index)
+        return True
+    notify_retention_failure(client_config, index, decision)
+    return False
 
-            else:
-                if 'debug' in settings['settings']:
-                    if settings['settings']['debug']:
-                        print(f"DEBUG - Would have deleted data stream {index}")
-                    else:
-                        if es.delete_index(client_config, index):
-                            success = True
-                else:
-                    if es.delete_index(client_config, index):
-                        success = True
-            if success is False:
-                message = f"Retention operation failed for client {client_config['client_name']}."
-                message = message + \
-                    f"\nTried deleting index {index} due to age of "
-                message = message + \
-                    f"{days_ago} vs policy limit of {policy_days}"
-
-                send_notification(
-                    client_config,
-                    "retention",
-                    "Failed",
-                    message,
-                    teams=settings['retention']['ms-teams'],
-                    jira=settings['retention']['jira']
-                )
-    elastic_connection.close()
-
-
-def apply_retention_to_old_indices(indices, index_retention_policies, client_config):
+
+async def delete_old_indices_async(client_config, index, decision, snapshot, connection):
+    """Asyncio counterpart of delete_old_indices for an index past retention
+
+    Args:
+        client_config (dict): Client configuration
+        index (str): Index name
+        decision (dict): Result of get_retention_decision
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
+        connection (AsyncElasticsearch): Async client
+    """
+    settings = load_settings()
+    print(f"Deleting index {index} due to age of {decision['days_ago']}"
+          f" vs policy limit of {decision['policy_days']}")
+    debug = 'debug' in settings['settings'] and settings['settings']['debug']
+    if debug:
+        print(f"DEBUG - Would have deleted data stream {decision['data_stream'] or index}")
+    elif decision['data_stream'] is not None:
+        await connection.indices.delete_data_stream(name=decision['data_stream'])
+    else:
+        try:
+            status = await connection.indices.delete(index=index)
+        except Exception as e:
+            print(f"Deletion job failed for {index}: {e}")
+            status = {}
+        if await run_sync(es.get_index_operation_message, index, "delete", status, client_config):
+            snapshot.discard_index(index)
+        else:
+            await run_sync(notify_retention_failure, client_config, index, decision)
+
+
+def apply_retention_to_old_indices(indices, index_retention_policies, client_config, snapshot):
     """Apply retention to indices older than policy
 
     Args:
         indices (array): List of indices
         index_retention_policies (dict): Retention policy
         client_config (dict): Client configuration
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
     """
-    elastic_connection = es.build_es_connection(client_config)
-    with ThreadPoolExecutor(
-        max_workers=es.get_lowest_data_node_thread_count(client_config)
-    ) as executor:
+    limiter = get_adaptive_limiter(client_config, 'retention')
+    special_indices = snapshot.get_special_indices()
+    with ThreadPoolExecutor(max_workers=limiter.max_limit) as executor:
         for index in indices:
             index = str(index['index'])
             # Only proceed if index is not a special index
-            if not es.check_special_index(index):
-                executor.submit(delete_old_indices, client_config,
-                                index, index_retention_policies)
-    elastic_connection.close()
+            if index not in special_indices:
+                executor.submit(limiter.run, delete_old_indices, client_config,
+                                index, index_retention_policies, snapshot)
 
 
-def apply_retention_policies(manual_client=""):
-    """Apply retention policies
+def notify_retention_health_failure(client_config):
+    """Sends a notification when cluster health never met the retention level"""
+    settings = load_settings()
+    message = "Retention operation failed.\n\n" + \
+        "It is also possible that connections are " + \
+        "unable to be made to the client/nginx node." + \
+        "Please fix.\n\nRemember that in order for " + \
+        "client's to be properly build you will need " + \
+        "to get their cluster status to **Green** " + \
+        "or **Yellow** and then re-run the following" + \
+        " command:\n\n**python3 " + \
+        "/opt/elastic-ilm/retention.py --client " + \
+        client_config['client_name'] + "**"
+    send_notification(
+        client_config,
+        "retention",
+        "Failed",
+        message,
+        teams=settings['retention']['ms-teams'],
+        jira=settings['retention']['jira']
+    )
+
+
+def apply_retention_to_client(client_config):
+    """Apply retention policies to one client, waiting for cluster health
 
     Args:
-        manual_client (str, optional): Name of client. Defaults to "".
+        client_config (dict): Client configuration
     """
     settings = load_settings()
     retry_count = 60
     sleep_time = 60
     success = 0
+    client_name = client_config['client_name']
+    print("Processing retention for " + client_name)
+    while retry_count >= 0 and success == 0:
+        # Check cluster health - Expect Yellow to continue
+        if es.check_cluster_health_status(
+            client_config, settings['retention']['health_check_level']
+        ):
+            # Grab the client's retention policies
+            index_retention_policies = get_retention_policy(
+                client_config)
+            # Next, get information on all current indices in cluster
+            snapshot = get_cluster_snapshot(client_config, 'retention')
+            # Get the list of indices that are older than the retention policy
+            apply_retention_to_old_indices(
+                snapshot.indices,
+                index_retention_policies,
+                client_config,
+                snapshot
+            )
+            success = 1
+        else:
+            if retry_count > 0:
+                print("Retention operation failed for " + client_name +
+                      ". Cluster health does not meet level:  " +
+                      settings['retention']['health_check_level'])
+            else:
+                notify_retention_health_failure(client_config)
+        if success == 0:
+            # Decrese retry count by one before trying while statement again
+            retry_count = retry_count - 1
+            print("Retry attempts left for retention " +
+                  "operation set to " + str(retry_count) +
+                  " sleeping for " + str(sleep_time) + " seconds")
+            time.sleep(sleep_time)
+
+
+async def apply_retention_to_client_async(client_config, snapshot, connection, limit):
+    """Apply retention policies to one client on the asyncio engine
+
+    Args:
+        client_config (dict): Client configuration
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
+        connection (AsyncElasticsearch): Async client
+        limit (asyncio.Semaphore): In-flight request limit
+    """
+    settings = load_settings()
+    retry_count = 60
+    sleep_time = 60
+    client_name = client_config['client_name']
+    print("Processing retention for " + client_name)
+    while not await run_sync(
+            es.check_cluster_health_status, client_config,
+            settings['retention']['health_check_level']):
+        if retry_count == 0:
+            print("Retention operation failed for " + client_name +
+                  ". Cluster health does not meet level:  " +
+                  settings['retention']['health_check_level'])
+            await run_sync(notify_retention_health_failure, client_config)
+            return
+        retry_count = retry_count - 1
+        print("Retry attempts left for retention " +
+              "operation set to " + str(retry_count) +
+              " sleeping for " + str(sleep_time) + " seconds")
+        await asyncio.sleep(sleep_time)
+    index_retention_policies = get_retention_policy(client_config)
+    # Load newest document dates before deciding so no request blocks the loop
+    await run_sync(snapshot.get_newest_document_dates)
+    deletions = []
+    special_indices = snapshot.get_special_indices()
+    for index in snapshot.indices:
+        index = str(index['index'])
+        if index in special_indices:
+            continue
+        decision = get_retention_decision(
+            client_config, index, index_retention_policies, snapshot)
+        if decision is not None:
+            deletions.append(delete_old_indices_async(
+                client_config, index, decision, snapshot, connection))
+    await gather_bounded(limit, deletions)
+
+
+def apply_retention_policies(manual_client=""):
+    """Apply retention policies
+
+    Args:
+        manual_client (str, optional): Name of client. Defaults to "".
+    """
+    settings = load_settings()
     if settings['retention']['enabled']:
-        # Load all client configurations from /opt/maintenance/*.json
-        clients = load_configs()
-        # Loop through each client to perform accounting per client\
-        for key, client_config in clients.items():
-            # Set nice variable names
-            client_name = key
-            limit_to_client = settings['settings']['limit_to_client']
-            print("Processing retention for " + client_name)
-            # If client set at command line only run it otherwise
-            # execute for all clients
-            if limit_to_client == manual_client or limit_to_client == "":
-                while retry_count >= 0 and success == 0:
-                    # Check cluster health - Expect Yellow to continue
-                    if es.check_cluster_health_status(
-                        client_config, settings['retention']['health_check_level']
-                    ):
-                        # Grab the client's retention policies
-                        index_retention_policies = get_retention_policy(
-                            client_config)
-                        # Next, get information on all current indices in cluster
-                        indices = es.es_get_indices(client_config)
-                        # Get the list of indices that are older than the retention policy
-                        apply_retention_to_old_indices(
-                            indices,
-                            index_retention_policies,
-                            client_config
-                        )
-                        success = 1
-                    else:
-                        if retry_count > 0:
-                            print("Retention operation failed for " + client_name +
-                                  ". Cluster health does not meet level:  " +
-                                  settings['retention']['health_check_level'])
-                        else:
-                            message = "Retention operation failed.\n\n" + \
-                                "It is also possible that connections are " + \
-                                "unable to be made to the client/nginx node." + \
-                                "Please fix.\n\nRemember that in order for " + \
-                                "client's to be properly build you will need " + \
-                                "to get their cluster status to **Green** " + \
-                                "or **Yellow** and then re-run the following" + \
-                                " command:\n\n**python3 " + \
-                                "/opt/elastic-ilm/retention.py --client " + \
-                                client_name + "**"
-                            send_notification(
-                                client_config,
-                                "retention",
-                                "Failed",
-                                message,
-                                teams=settings['retention']['ms-teams'],
-                                jira=settings['retention']['jira']
-                            )
-                    if success == 0:
-                        # Decrese retry count by one before trying while statement again
-                        retry_count = retry_count - 1
-                        print("Retry attempts left for retention " +
-                              "operation set to " + str(retry_count) +
-                              " sleeping for " + str(sleep_time) + " seconds")
-                        time.sleep(sleep_time)
+        limit_to_client = settings['settings']['limit_to_client']
+        # If client set at command line only run it otherwise
+        # execute for all clients
+        if limit_to_client == manual_client or limit_to_client == "":
+            # Load all client configurations from /opt/maintenance/*.json
+            clients = load_configs(manual_client)
+            if get_engine('retention') == "asyncio":
+                run_job_async('retention', clients, apply_retention_to_client_async)
+            else:
+                run_for_clients('retention', clients, apply_retention_to_client)
 
 
 if __name__ == "__main__":
@@ -1,11 +1,21 @@
 """This script processes rollovers for clients"""
 #!/usr/bin/env python3
+import asyncio
+import math
+import os
 import time
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor
 from config import load_configs, load_settings
 from error import send_notification
 import es
+from policy import get_policy_matcher
+from cluster import get_cluster_snapshot
+from limiter import get_adaptive_limiter
+from fanout import run_for_clients
+from async_engine import gather_bounded, get_engine, run_job_async, run_sync
+from forecast import get_rollover_forecast, get_forecast_settings, \
+    predict_seconds_to_rollover, get_next_check_time
 
 
 def get_values_from_dictionary_array(array, field):
@@ -44,106 +54,648 @@ def get_rollover_policy(client_config):
     return index_rollover_policies
 
 
-def apply_rollover_policy_to_alias(client_config, alias, index_rollover_policies):
+def get_size_check(policy_settings, primary_shards):
+    """Returns a rollover policy's size in GB for all primary shards
+
+    Args:
+        policy_settings (dict): Rollover policy
+        primary_shards (int): Primary shard count of the write index
+
+    Returns:
+        int: Size in GB
+    """
+    # If policy is auto set size check to primary shard count times 50
+    if policy_settings["size"] == "auto":
+        return primary_shards * 50
+    return int(policy_settings["size"])
+
+
+def get_shard_minimum_size():
+    """Returns the primary shard size in GB the days policy requires"""
+    settings = load_settings()
+    if 'shard_minimum_size' in settings['rollover']:
+        return settings['rollover']['shard_minimum_size']
+    return 10
+
+
+def is_rollover_alias(alias, snapshot):
+    """Checks if an alias entry is a write alias rollover applies to"""
+    # Make sure alias does not match a special index
+    if alias['alias'] in snapshot.get_special_indices():
+        return False
+    return alias['alias'] != 'tier2' and alias['is_write_index'] == 'true'
+
+
+def get_next_shard_count(client_config, alias, index, policy_settings, snapshot):
+    """Returns the primary shard count an alias's next index should have
+
+    Sized from the write index's growth rate so the data written over the
+    policy's days, or up to a fixed size policy, lands in shards of
+    settings.rollover.target_shard_size GB. Fewer shards are used when they
+    would stay under shard_minimum_size, and no more than
+    max_primary_shards, which defaults to the number of hot data nodes.
+
+    Args:
+        client_config (dict): Client configuration
+        alias (dict): Alias entry
+        index (dict): _cat/indices information of the write index
+        policy_settings (dict): Rollover policy
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
+
+    Returns:
+        int: Primary shard count, or None when settings.rollover.auto_shards
+            is off
+    """
+    settings = load_settings()
+    if not settings['rollover'].get('auto_shards', False):
+        return None
+    target_shard_size = 50
+    if 'target_shard_size' in settings['rollover']:
+        target_shard_size = settings['rollover']['target_shard_size']
+    minimum_size = get_shard_minimum_size()
+    rate = get_rollover_forecast(client_config['client_name']).get_rate(
+        alias['alias'], index['index'])
+    if rate is None:
+        age = max(3600, time.time() - int(index['creation.date']) / 1000)
+        rate = int(index['pri.store.size']) / age * 3600
+    # GB the next index is expected to hold before it rolls over
+    expected_size = rate * policy_settings['days'] * 24 / 1024 ** 3
+    if policy_settings['size'] != "auto":
+        expected_size = min(expected_size, int(policy_settings['size']))
+    shards = math.ceil(expected_size / target_shard_size)
+    if minimum_size > 0:
+        shards = min(shards, math.floor(expected_size / minimum_size))
+    max_shards = 0
+    if 'max_primary_shards' in settings['rollover']:
+        max_shards = settings['rollover']['max_primary_shards']
+    if max_shards <= 0:
+        data_nodes = snapshot.topology.get_data_nodes()
+        hot_nodes = [node_id for node_id in data_nodes
+                     if snapshot.topology.get_node_tier(node_id) == 'hot']
+        max_shards = len(hot_nodes) or len(data_nodes)
+    return int(max(1, min(shards, max_shards)))
+
+
+def get_size_condition(snapshot):
+    """Returns the _rollover condition the size policy is sent as
+
+    max_primary_shard_size needs Elasticsearch 7.13 or later, so OpenSearch
+    and older clusters get max_size. settings.rollover.size_condition
+    overrides the choice.
+
+    Args:
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
+
+    Returns:
+        str: max_primary_shard_size or max_size
+    """
+    settings = load_settings()
+    if 'size_condition' in settings['rollover']:
+        return settings['rollover']['size_condition']
+    if os.getenv('ILM_PLATFORM') == 'opensearch':
+        return "max_size"
+    version = snapshot.topology.get_minimum_version()
+    if version is None or version < (7, 13):
+        return "max_size"
+    return "max_primary_shard_size"
+
+
+def get_rollover_conditions(policy_settings, size_check, primary_shards, size_condition):
+    """Returns _rollover conditions equivalent to a rollover policy
+
+    The size policy covers all primary shards, so with
+    max_primary_shard_size it is sent as the primary shard size it allows.
+
+    Args:
+        policy_settings (dict): Rollover policy with size, days and
+            optionally docs
+        size_check (int): Policy size in GB for all primary shards
+        primary_shards (int): Primary shard count of the write index
+        size_condition (str): Result of get_size_condition
+
+    Returns:
+        dict: max_age, max_primary_shard_size or max_size, and max_docs
+    """
+    conditions = {'max_age': f"{policy_settings['days']}d"}
+    if size_condition == "max_size":
+        conditions['max_size'] = f"{size_check}gb"
+    else:
+        conditions['max_primary_shard_size'] = \
+            f"{max(1, int(size_check * 1024 / primary_shards))}mb"
+    if 'docs' in policy_settings:
+        conditions['max_docs'] = policy_settings['docs']
+    return conditions
+
+
+def get_successor_name(alias, snapshot):
+    """Returns the name _rollover gives an alias's next index
+
+    Args:
+        alias (dict): Alias entry
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
+
+    Returns:
+        str: Next index name, or None for data streams and write indices
+            not ending in a number
+    """
+    if snapshot.get_data_stream(alias['alias']) is not None:
+        return None
+    if not alias['index'][-1:].isdigit():
+        return None
+    return es.get_rollover_index_name(alias['index'])
+
+
+def get_rollover_decision(client_config, alias, index_rollover_policies, snapshot):
+    """Checks if an alias's write index meets its rollover policy
+
+    Args:
+        client_config (dict): Client configuration
+        alias (dict): Alias entry from _cat/aliases
+        index_rollover_policies (dict): Rollover policy settings
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
+
+    Returns:
+        dict: index, reason, size, shard_size, days and the _rollover
+            conditions of the write index to roll over, or None
+    """
+    settings = load_settings()
+    if not is_rollover_alias(alias, snapshot):
+        return None
+    # Pull back information about the index - need size and creation_date
+    index = snapshot.get_index(alias['index'])
+    if index is None:
+        # Index was created after the snapshot was taken
+        return None
+    # Get the index specific rollover policy
+    policy = get_policy_matcher(
+        client_config, 'rollover', index_rollover_policies).match(alias['index'])
+    # Get current datetime
+    current_date = datetime.utcnow()
+    # Get index datetime
+    index_date = datetime.strptime(
+        index['creation.date.string'], '%Y-%m-%dT%H:%M:%S.%fZ')
+    # Figure out how many days since current_date vs. index_date
+    days_ago = (current_date - index_date).days
+    # Grab the primary store size (bytes) and convert to GB
+    index_size_in_gb = round(
+        int(index['pri.store.size']) / 1024 / 1024 / 1024, 0)
+    primary_shard_size = index_size_in_gb / int(index['shardsPrimary'])
+    if settings['settings']['debug']:
+        print("Write index " + str(index['index']) + ' created ' + str(days_ago) +
+              " days ago for alias " + alias['alias'] + " at " + str(index_size_in_gb) +
+              f" GB with shard size of {primary_shard_size}")
+    print("Write index " + str(index['index']) + ' created ' + str(days_ago) +
+              " days ago for alias " + alias['alias'] + " at " + str(index_size_in_gb) +
+              f" GB with shard size of {primary_shard_size}")
+    size_check = get_size_check(
+        index_rollover_policies[policy], int(index['shardsPrimary']))
+    # Set initial rollover values
+    rollover = False
+    rollover_reason = ""
+    # If size exceeds the policy's size check, set rollover
+    if index_size_in_gb >= size_check:
+        rollover_reason = 'Size Policy'
+        rollover = True
+
+    # If the # of days exceeds the policy's day check and the index size is at
+    # least 10 GB or settings['rollover']['shard_minimum_size'], set rollover
+    minimum_size = get_shard_minimum_size()
+    # A data stream that received nothing since its write index was created
+    # would only gain another empty backing index from an age rollover
+    idle = 'maximum_timestamp' in alias and \
+        alias['maximum_timestamp'] < int(index['creation.date'])
+    if days_ago >= index_rollover_policies[policy]["days"] and idle:
+        print(f"Data stream {alias['alias']} has no documents newer than its " +
+              f"write index {index['index']}. Skipping days policy")
+    elif days_ago >= index_rollover_policies[policy]["days"] and primary_shard_size >= minimum_size:
+        rollover_reason = 'Days Policy'
+        rollover = True
+    else:
+        if days_ago >= index_rollover_policies[policy]["days"]:
+            print(f"Index {index['index']} meets required days to rollover " + \
+                f"but is not larger than {minimum_size} gb. Skipping")
+
+    if 'docs' in index_rollover_policies[policy] and index['docsCount'] is not None and \
+            int(index['docsCount']) >= index_rollover_policies[policy]['docs']:
+        rollover_reason = 'Docs Policy'
+        rollover = True
+
+    if not rollover:
+        return None
+    print(
+        f"Adding index {index['index']} to rollover due to {rollover_reason}. " +
+        f"Size={index_size_in_gb} Shard Size={primary_shard_size} Age={days_ago}")
+    decision = {
+        'index': str(index['index']),
+        'reason': rollover_reason,
+        'size': index_size_in_gb,
+        'shard_size': primary_shard_size,
+        'days': days_ago,
+        'conditions': get_rollover_conditions(
+            index_rollover_policies[policy], size_check, int(index['shardsPrimary']),
+            get_size_condition(snapshot))
+    }
+    shards = None
+    # Data stream backing indices take their settings from the stream's template
+    if snapshot.get_data_stream(alias['alias']) is None:
+        shards = get_next_shard_count(
+            client_config, alias, index, index_rollover_policies[policy], snapshot)
+    if shards is not None:
+        decision['index_settings'] = {'index.number_of_shards': shards}
+        if shards != int(index['shardsPrimary']):
+            print(f"Next index for {alias['alias']} will have {shards} primary " +
+                  f"shards instead of {index['shardsPrimary']}")
+    # A pre-created next index is switched to instead of rolling over
+    successor = get_successor_name(alias, snapshot)
+    if successor is not None:
+        decision['successor_name'] = successor
+        if snapshot.get_index(successor) is not None:
+            decision['successor'] = successor
+    return decision
+
+
+def check_successor_created(decision, error):
+    """Checks if a rollover failed because its next index already exists
+
+    The snapshot can predate a successor pre-created since it was read. The
+    decision is switched to moving the alias to that index instead.
+
+    Args:
+        decision (dict): Result of get_rollover_decision
+        error (Exception): Error the rollover raised
+
+    Returns:
+        bool: True if the decision now uses the existing successor
+    """
+    if 'successor' in decision or 'successor_name' not in decision:
+        return False
+    if 'resource_already_exists_exception' not in str(error):
+        return False
+    print(f"Next index {decision['successor_name']} already exists. Moving the " +
+          "write alias to it instead")
+    decision['successor'] = decision['successor_name']
+    return True
+
+
+def notify_rollover_failure(client_config, alias, decision):
+    """Sends a notification for a write index that could not be rolled over"""
+    settings = load_settings()
+    message = "Rollover operation failed for client " + \
+        f"{client_config['client_name']}." + \
+        f"\nTried rolling over index {decision['index']} " + \
+        f"\nAlias/ds of {alias['alias']} " + \
+        f"due to {decision['reason']}. " + \
+        f"Size={decision['size']} Age={decision['days']}"
+
+    send_notification(
+        client_config,
+        "rollover",
+        "Failed",
+        message,
+        teams=settings['rollover']['ms-teams'],
+        jira=settings['rollover']['jira']
+    )
+
+
+def notify_rollover_health_failure(client_config):
+    """Sends a notification when cluster health never met the rollover level"""
+    settings = load_settings()
+    message = "Rollover operation failed.\n\nIt is also possible that connections " + \
+        "are unable to be made to the client/nginx node. Please fix.\n\nRemember " + \
+        "that in order for client's to be properly build you will need to get " + \
+        "their cluster status to **Green** or **Yellow** and then re-run the " + \
+        "following command:\n\n**python3 /opt/elastic-ilm/rollover.py --client " + \
+        client_config['client_name'] + "**"
+    send_notification(
+        client_config,
+        "rollover",
+        "Failed",
+        message,
+        teams=settings['rollover']['ms-teams'],
+        jira=settings['rollover']['jira']
+    )
+
+
+def apply_rollover_policy_to_alias(client_config, alias, index_rollover_policies, snapshot):
     """Applies rollovers to aliases that meet rollover policy conditions
 
     Args:
         client_config (dict): Client configuration
         alias (str): Alias to specific indices
         index_rollover_policies (dict): Rollover policy settings
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
+    """
+    decision = get_rollover_decision(
+        client_config, alias, index_rollover_policies, snapshot)
+    if decision is not None:
+        apply_rollover_decision(client_config, alias, decision)
+
+
+def apply_rollover_decision(client_config, alias, decision):
+    """Rolls over an alias or data stream whose write index met its policy
+
+    The rollover is sent with the decision's conditions so the cluster
+    confirms them against the current write index. If they are no longer
+    met, for example because the alias was already rolled over, nothing
+    happens and it is not treated as a failure.
+
+    Args:
+        client_config (dict): Client configuration
+        alias (dict): Alias entry
+        decision (dict): Result of get_rollover_decision
+
+    Returns:
+        bool: True if rolled over, no longer due, or would have been in
+            debug mode
     """
     settings = load_settings()
-    # Make sure alias does not match a special index
-    if not es.check_special_index(alias['alias']):
-        if alias['alias'] != 'tier2' and alias['is_write_index'] == 'true':
-            # Pull back information about the index - need size and creation_date
-            index = es.get_index_information(client_config, alias['index'])
-            # Get the index specific rollover policy
-            policy = es.check_index_rollover_policy(
-                alias['index'], index_rollover_policies)
-            # Get current datetime
-            current_date = datetime.utcnow()
-            # Get index datetime
-            index_date = datetime.strptime(
-                index['creation.date.string'], '%Y-%m-%dT%H:%M:%S.%fZ')
-            # Figure out how many days since current_date vs. index_date
-            days_ago = (current_date - index_date).days
-            # Grab the primary store size (bytes) and convert to GB
-            index_size_in_gb = round(
-                int(index['pri.store.size']) / 1024 / 1024 / 1024, 0)
-            primary_shard_size = index_size_in_gb / int(index['shardsPrimary'])
-            if settings['settings']['debug']:
-                print("Write index " + str(index['index']) + ' created ' + str(days_ago) +
-                      " days ago for alias " + alias['alias'] + " at " + str(index_size_in_gb) +
-                      f" GB with shard size of {primary_shard_size}")
-            print("Write index " + str(index['index']) + ' created ' + str(days_ago) +
-                      " days ago for alias " + alias['alias'] + " at " + str(index_size_in_gb) +
-                      f" GB with shard size of {primary_shard_size}")
-            # If policy is auto set size check to primary shard count times 50
-            if index_rollover_policies[policy]["size"] == "auto":
-                size_check = int(index['shardsPrimary']) * 50
-            else:
-                size_check = int(index_rollover_policies[policy]["size"])
-            # Set initial rollover values
-            rollover = False
-            rollover_reason = ""
-            # If size exceeds the policy's size check, set rollover
-            if index_size_in_gb >= size_check:
-                rollover_reason = 'Size Policy'
-                rollover = True
-
-            # If the # of days exceeds the policy's day check and the index size is at
-            # least 10 GB or settings['rollover']['shard_minimum_size'], set rollover
-            if 'shard_minimum_size' in settings['rollover']:
-                minimum_size = settings['rollover']['shard_minimum_size']
+    if settings['settings']['debug']:
+        print("Would have triggered rollover on " + decision['index'])
+        return True
+    retries = 3
+    success = False
+    while retries != 0 and success is False:
+        try:
+            # This triggers the actual rollover
+            if 'successor' in decision:
+                status = es.swap_write_index(
+                    client_config, str(alias['alias']), decision['index'],
+                    decision['successor'])
             else:
-                minimum_size = 10
-            if days_ago >= index_rollover_policies[policy]["days"] and primary_shard_size >= minimum_size:
-                rollover_reason = 'Days Policy'
-                rollover = True
+                status = es.rollover_alias(
+                    client_config, str(alias['alias']), decision['conditions'],
+                    decision.get('index_settings'))
+            print_rollover_result(alias, decision, status)
+            success = True
+        except Exception as e:
+            if check_successor_created(decision, e):
+                continue
+            print(f"Failed to rollover index {decision['index']} for alias/ds {alias['alias']}: {e}")
+            retries = retries - 1
+    if success is False:
+        notify_rollover_failure(client_config, alias, decision)
+    return success
+
+
+def print_rollover_result(alias, decision, status):
+    """Prints the outcome of a conditional _rollover request"""
+    if status.get('rolled_over'):
+        print(f"Rollover successful for {decision['index']}. " +
+              f"New write index for {alias['alias']} is {status.get('new_index')}")
+    else:
+        print(f"Skipped rollover of {decision['index']} as the cluster reports " +
+              f"no condition met: {status.get('conditions')}")
+
+
+async def apply_rollover_policy_to_alias_async(client_config, alias, decision, connection):
+    """Asyncio counterpart of apply_rollover_decision
+
+    Args:
+        client_config (dict): Client configuration
+        alias (dict): Alias entry
+        decision (dict): Result of get_rollover_decision
+        connection (AsyncElasticsearch): Async client
+    """
+    retries = 3
+    while retries != 0:
+        try:
+            if 'successor' in decision:
+                status = await run_sync(
+                    es.swap_write_index, client_config, alias['alias'],
+                    decision['index'], decision['successor'])
             else:
-                if days_ago >= index_rollover_policies[policy]["days"]:
-                    print(f"Index {index['index']} meets required days to rollover " + \
-                        f"but is not larger than {minimum_size} gb. Skipping")
-            
-            # If index is rollover ready, append to list
-            if rollover:
-                print(
-                    f"Adding index {index['index']} to rollover due to {rollover_reason}. " +
-                    f"Size={index_size_in_gb} Shard Size={primary_shard_size} Age={days_ago}")
-                # Rollover the index
-                if not settings['settings']['debug']:
-                    retries = 3
-                    success = False
-                    while retries != 0 and success is False:
-                        # This triggers the actual rollover
-                        if es.rollover_index(
-                                client_config,
-                                str(index['index']),
-                                str(alias['alias'])
-                            ):
-                            success = True
-                        else:
-                            retries = retries - 1
-                    if success is False:
-                        settings = load_settings()
-                        message = "Rollover operation failed for client " + \
-                            f"{client_config['client_name']}." + \
-                            f"\nTried rolling over index {index['index']} " + \
-                            f"\nAlias/ds of {alias['alias']} " + \
-                            f"due to {rollover_reason}. " + \
-                            f"Size={index_size_in_gb} Age={days_ago}"
-
-                        send_notification(
-                            client_config,
-                            "rollover",
-                            "Failed",
-                            message,
-                            teams=settings['rollover']['ms-teams'],
-                            jira=settings['rollover']['jira']
-                        )
-                else:
-                    print("Would have triggered rollover on " + index)
+                body = {'conditions': decision['conditions']}
+                if 'index_settings' in decision:
+                    body['settings'] = decision['index_settings']
+                status = await connection.indices.rollover(alias=alias['alias'], body=body)
+            print_rollover_result(alias, decision, status)
+            return
+        except Exception as e:
+            if check_successor_created(decision, e):
+                continue
+            print(f"Failed to rollover index {decision['index']} for alias/ds {alias['alias']}: {e}")
+        retries = retries - 1
+    await run_sync(notify_rollover_failure, client_config, alias, decision)
+
+
+def get_data_stream_write_aliases(snapshot):
+    """Returns alias style entries for the write index of every data stream
+
+    Built from the snapshot and one _data_stream/_stats request for all
+    data streams, so the data stream pass costs the same regardless of how
+    many streams a client has. Entries carry the stream's
+    maximum_timestamp when its stats are available.
+
+    Args:
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
+
+    Returns:
+        list: Entries shaped like _cat/aliases results
+    """
+    aliases = []
+    data_stream_stats = snapshot.get_data_stream_stats()
+    for data_stream in snapshot.data_streams:
+        # Backing indices are listed oldest first, so the write index is last
+        if len(data_stream['indices']) == 0:
+            continue
+        alias = {
+            'alias': data_stream['name'],
+            'index': data_stream['indices'][-1]['index_name'],
+            'filter': "-",
+            'routing_search': "-",
+            "is_write_index": 'true'
+        }
+        if data_stream['name'] in data_stream_stats:
+            alias['maximum_timestamp'] = \
+                data_stream_stats[data_stream['name']]['maximum_timestamp']
+        aliases.append(alias)
+    return aliases
+
+
+def get_rollover_candidates(client_config, index_rollover_policies, snapshot):
+    """Returns the aliases and data streams whose write index meets its policy
+
+    Decided from the snapshot alone so only candidates cost a request.
+
+    Args:
+        client_config (dict): Client configuration
+        index_rollover_policies (dict): Rollover policy settings
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
+
+    Returns:
+        list: (alias entry, decision) pairs
+    """
+    candidates = []
+    for alias in snapshot.aliases + get_data_stream_write_aliases(snapshot):
+        decision = get_rollover_decision(
+            client_config, alias, index_rollover_policies, snapshot)
+        if decision is not None:
+            candidates.append((alias, decision))
+    return candidates
+
+
+def update_rollover_forecast(client_config, index_rollover_policies, snapshot, rolled_over):
+    """Samples write index sizes and schedules each alias's next check
+
+    Args:
+        client_config (dict): Client configuration
+        index_rollover_policies (dict): Rollover policy settings
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
+        rolled_over (set): Aliases this run tried to roll over
+    """
+    forecast = get_rollover_forecast(client_config['client_name'])
+    forecast_settings = get_forecast_settings()
+    # Sizes are as of the snapshot, which later runs may reuse
+    now = snapshot.captured
+    seen = set()
+    for alias in snapshot.aliases + get_data_stream_write_aliases(snapshot):
+        if not is_rollover_alias(alias, snapshot):
+            continue
+        index = snapshot.get_index(alias['index'])
+        if index is None:
+            continue
+        seen.add(alias['alias'])
+        if alias['alias'] in rolled_over:
+            # Sample the new write index soon to learn its growth rate
+            forecast.schedule(alias['alias'], get_next_check_time(0, forecast_settings, now))
+            continue
+        size = int(index['pri.store.size'])
+        created = int(index['creation.date']) / 1000
+        rate = forecast.record(alias['alias'], alias['index'], size, created, now)
+        policy = get_policy_matcher(
+            client_config, 'rollover', index_rollover_policies).match(alias['index'])
+        primary_shards = int(index['shardsPrimary'])
+        thresholds = {
+            'size': get_size_check(index_rollover_policies[policy], primary_shards) * 1024 ** 3,
+            'minimum_size': get_shard_minimum_size() * primary_shards * 1024 ** 3,
+            'days': index_rollover_policies[policy]['days']
+        }
+        seconds = predict_seconds_to_rollover(rate, size, created, thresholds, now)
+        forecast.schedule(
+            alias['alias'], get_next_check_time(seconds, forecast_settings, now), now + seconds)
+    forecast.forget(set(forecast.next_checks) - seen)
+    forecast.refreshed = now
+
+
+def get_precreate_minutes():
+    """Returns how soon before a predicted rollover its next index is created
+
+    Returns:
+        float: Minutes, or None when settings.rollover.precreate is off
+    """
+    settings = load_settings()
+    if not settings['rollover'].get('precreate', False):
+        return None
+    if 'precreate_minutes' in settings['rollover']:
+        return settings['rollover']['precreate_minutes']
+    return 30
+
+
+def get_successor_settings(index, snapshot, shards=None):
+    """Returns settings that place a pre-created next index on hot nodes
+
+    Shard and replica counts follow the current write index unless a shard
+    count is given. Allocation
+    uses the same style, tier preference or box type, as the write index,
+    or as the cluster's nodes if the write index has none.
+
+    Args:
+        index (str): Current write index
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
+        shards (int, optional): Primary shard count. Defaults to the
+            write index's.
+
+    Returns:
+        dict: Index settings
+    """
+    index_info = snapshot.get_index(index)
+    if shards is None:
+        shards = int(index_info['shardsPrimary'])
+    index_settings = {
+        'index.number_of_shards': shards,
+        'index.number_of_replicas': int(index_info['shardsReplica'])
+    }
+    allocation = snapshot.get_index_settings(index).get('routing', {}).get('allocation', {})
+    if '_tier_preference' in allocation.get('include', {}):
+        index_settings['index.routing.allocation.include._tier_preference'] = 'data_hot'
+    elif 'box_type' in allocation.get('require', {}):
+        index_settings['index.routing.allocation.require.box_type'] = 'hot'
+    else:
+        for node in snapshot.nodes.values():
+            if 'data_hot' in node['roles']:
+                index_settings['index.routing.allocation.include._tier_preference'] = 'data_hot'
+                break
+            if 'box_type' in node.get('attributes', {}):
+                index_settings['index.routing.allocation.require.box_type'] = 'hot'
+                break
+    return index_settings
+
+
+def precreate_rollover_indices(client_config, index_rollover_policies, snapshot):
+    """Creates the next index of aliases predicted to roll over soon
+
+    The new index has time to allocate and go green on hot nodes before
+    writes move to it, and the rollover itself becomes an alias update.
+    Data streams create their own backing indices and are skipped.
+
+    Args:
+        client_config (dict): Client configuration
+        index_rollover_policies (dict): Rollover policy settings
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
+    """
+    settings = load_settings()
+    precreate_minutes = get_precreate_minutes()
+    if precreate_minutes is None:
+        return
+    forecast = get_rollover_forecast(client_config['client_name'])
+    due = set(forecast.get_predicted_aliases(time.time() + precreate_minutes * 60))
+    for alias in snapshot.aliases:
+        if alias['alias'] not in due or not is_rollover_alias(alias, snapshot):
+            continue
+        successor = get_successor_name(alias, snapshot)
+        if successor is None or snapshot.get_index(successor) is not None or \
+                snapshot.get_index(alias['index']) is None:
+            continue
+        if settings['settings']['debug']:
+            print(f"Would have pre-created {successor} for alias {alias['alias']}")
+            continue
+        policy = get_policy_matcher(
+            client_config, 'rollover', index_rollover_policies).match(alias['index'])
+        shards = get_next_shard_count(
+            client_config, alias, snapshot.get_index(alias['index']),
+            index_rollover_policies[policy], snapshot)
+        try:
+            es.create_rollover_successor(
+                client_config, alias['index'],
+                get_successor_settings(alias['index'], snapshot, shards))
+            print(f"Pre-created {successor} for alias {alias['alias']}")
+        except Exception as e:
+            print(f"Failed to pre-create {successor} for alias {alias['alias']}: {e}")
+
+
+def check_rollover_forecast_due(client_config):
+    """Checks if a predictive rollover run has any alias to check
+
+    Always due when settings.rollover.predictive is off, on the first run
+    and at least every predictive_max_check_minutes so new aliases are
+    found.
+
+    Args:
+        client_config (dict): Client configuration
+
+    Returns:
+        bool: True if the run should take a snapshot and check aliases
+    """
+    forecast_settings = get_forecast_settings()
+    if not forecast_settings['enabled']:
+        return True
+    forecast = get_rollover_forecast(client_config['client_name'])
+    now = time.time()
+    if forecast.refreshed is None or \
+            now - forecast.refreshed >= forecast_settings['max_check_minutes'] * 60:
+        return True
+    next_check = forecast.next_check()
+    return next_check is not None and next_check <= now
 
 
 def rollover_client_indicies(client_config):
@@ -153,6 +705,11 @@ def rollover_client_indicies(client_config):
         client_config (dict): Client configuration
     """
     settings = load_settings()
+    if not check_rollover_forecast_due(client_config):
+        if settings['settings']['debug']:
+            print("No rollover aliases due for " + client_config['client_name'])
+        return
+    print("Processing rollovers for " + client_config['client_name'])
     # Get the rollover policy for the client
     index_rollover_policies = get_rollover_policy(client_config)
     retry_count = 60
@@ -165,63 +722,27 @@ def rollover_client_indicies(client_config):
             settings['rollover']['health_check_level']
         ):
             # Get current aliases members
-            aliases = es.get_all_index_aliases(client_config)
-            with ThreadPoolExecutor(
-                max_workers=es.get_lowest_data_node_thread_count(client_config)
-            ) as executor:
-                # Apply rollover to aliases
-                for alias in aliases:
-                    executor.submit(apply_rollover_policy_to_alias,
-                                    client_config, alias, index_rollover_policies)
+            snapshot = get_cluster_snapshot(client_config, 'rollover')
+            candidates = get_rollover_candidates(
+                client_config, index_rollover_policies, snapshot)
+            limiter = get_adaptive_limiter(client_config, 'rollover')
+            with ThreadPoolExecutor(max_workers=limiter.max_limit) as executor:
+                # Each candidate is one conditional _rollover request
+                for alias, decision in candidates:
+                    executor.submit(limiter.run, apply_rollover_decision,
+                                    client_config, alias, decision)
+            update_rollover_forecast(
+                client_config, index_rollover_policies, snapshot,
+                {alias['alias'] for alias, _ in candidates})
+            precreate_rollover_indices(client_config, index_rollover_policies, snapshot)
             success = 1
-            aliases = []
-            data_stream_response = es.get_data_streams(client_config)
-            for data_stream in data_stream_response['data_streams']:
-                index_number = f"{data_stream['generation']:06}"
-                # Look through indices in reverse as the last entry is likely
-                # the most recent index
-                write_index = ""
-                for ds_index in reversed(data_stream['indices']):
-                    if ds_index['index_name'].endswith(str(index_number)):
-                        write_index = ds_index['index_name']
-                        break
-                if write_index != "":
-                    alias = {
-                        'alias': data_stream['name'],
-                        'index': write_index,
-                        'filter': "-",
-                        'routing_search': "-",
-                        "is_write_index": 'true'
-                    }
-                    aliases.append(alias)
-
-            with ThreadPoolExecutor(
-                max_workers=es.get_lowest_data_node_thread_count(client_config)
-            ) as executor:
-                # Apply rollover to aliases
-                for alias in aliases:
-                    executor.submit(apply_rollover_policy_to_alias,
-                                    client_config, alias, index_rollover_policies)
         else:
             if retry_count > 0:
                 print("Rollover operation failed for " +
                       client_config['client_name'] + ". Cluster health does not meet level:  " +
                       settings['rollover']['health_check_level'])
             else:
-                message = "Rollover operation failed.\n\nIt is also possible that connections " + \
-                    "are unable to be made to the client/nginx node. Please fix.\n\nRemember " + \
-                    "that in order for client's to be properly build you will need to get " + \
-                    "their cluster status to **Green** or **Yellow** and then re-run the " + \
-                    "following command:\n\n**python3 /opt/elastic-ilm/rollover.py --client " + \
-                    client_config['client_name'] + "**"
-                send_notification(
-                    client_config,
-                    "rollover",
-                    "Failed",
-                    message,
-                    teams=settings['rollover']['ms-teams'],
-                    jira=settings['rollover']['jira']
-                )
+                notify_rollover_health_failure(client_config)
         if success == 0:
             # Decrese retry count by one before trying while statement again
             retry_count = retry_count - 1
@@ -230,6 +751,51 @@ def rollover_client_indicies(client_config):
             time.sleep(sleep_time)
 
 
+async def rollover_client_indicies_async(client_config, snapshot, connection, limit):
+    """Processes rollover jobs for one client on the asyncio engine
+
+    Args:
+        client_config (dict): Client configuration
+        snapshot (ClusterSnapshot): Cluster metadata snapshot
+        connection (AsyncElasticsearch): Async client
+        limit (asyncio.Semaphore): In-flight request limit
+    """
+    settings = load_settings()
+    print("Processing rollovers for " + client_config['client_name'])
+    retry_count = 60
+    sleep_time = 60
+    while not await run_sync(
+            es.check_cluster_health_status, client_config,
+            settings['rollover']['health_check_level']):
+        if retry_count == 0:
+            print("Rollover operation failed for " +
+                  client_config['client_name'] + ". Cluster health does not meet level:  " +
+                  settings['rollover']['health_check_level'])
+            await run_sync(notify_rollover_health_failure, client_config)
+            return
+        retry_count = retry_count - 1
+        print("Retry attempts left for rollover operation set to " +
+              str(retry_count) + " sleeping for " + str(sleep_time) + " seconds")
+        await asyncio.sleep(sleep_time)
+    index_rollover_policies = get_rollover_policy(client_config)
+    # Load data stream stats before deciding so no request blocks the loop
+    await run_sync(snapshot.get_data_stream_stats)
+    rollovers = []
+    candidates = get_rollover_candidates(
+        client_config, index_rollover_policies, snapshot)
+    for alias, decision in candidates:
+        if settings['settings']['debug']:
+            print("Would have triggered rollover on " + decision['index'])
+        else:
+            rollovers.append(apply_rollover_policy_to_alias_async(
+                client_config, alias, decision, connection))
+    await gather_bounded(limit, rollovers)
+    await run_sync(update_rollover_forecast, client_config, index_rollover_policies,
+                   snapshot, {alias['alias'] for alias, _ in candidates})
+    await run_sync(precreate_rollover_indices, client_config,
+                   index_rollover_policies, snapshot)
+
+
 def apply_rollover_policies(client_to_process=""):
     """Starts overall rollover jobs
 
@@ -240,18 +806,19 @@ def apply_rollover_policies(client_to_process=""):
     if settings['rollover']['enabled']:
         # Load all client configurations from /opt/maintenance/*.json
         clients = load_configs()
-        # Loop through each client to perform accounting per client
-        for key, client_config in clients.items():
-            # Set nice variable names
-            client_name = key
-            # If client set at command line only run it otherwise
-            # execute for all clients
-            if client_to_process == "" or client_name == client_to_process:
-                if settings['settings']['limit_to_client'] == client_name or \
-                        settings['settings']['limit_to_client'] == "":
-                    print("Processing rollovers for " + client_name)
-                    # Trigger rollover process
-                    rollover_client_indicies(client_config)
+        # If client set at command line only run it otherwise
+        # execute for all clients
+        clients = {
+            client_name: client_config
+            for client_name, client_config in clients.items()
+            if (client_to_process == "" or client_name == client_to_process) and
+            (settings['settings']['limit_to_client'] == client_name or
+             settings['settings']['limit_to_client'] == "")
+        }
+        if get_engine('rollover') == "asyncio":
+            run_job_async('rollover', clients, rollover_client_indicies_async)
+        else:
+            run_for_clients('rollover', clients, rollover_client_indicies)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,25 @@
+"""Shared test setup"""
+import os
+import shutil
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# config exits on import when no settings.toml exists, so tests run against
+# the example settings unless a real settings file is installed
+SETTINGS_FILES = (
+    "/etc/elastic-ilm/settings.toml",
+    "/etc/maintenance/modules/settings.toml",
+    os.path.join(REPO_DIR, "settings.toml"),
+)
+created_settings_file = None
+if not any(os.path.exists(path) for path in SETTINGS_FILES):
+    created_settings_file = os.path.join(REPO_DIR, "settings.toml")
+    shutil.copyfile(
+        os.path.join(REPO_DIR, "settings.toml.example"), created_settings_file)
+
+
+def pytest_unconfigure(config):
+    if created_settings_file is not None and os.path.exists(created_settings_file):
+        os.remove(created_settings_file)
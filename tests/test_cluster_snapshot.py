@@ -0,0 +1,95 @@
+"""Tests for ClusterSnapshot index bookkeeping"""
+import threading
+import pytest
+import cluster
+import es
+
+
+class FakeCat:
+    def __init__(self, indices):
+        self.index_records = indices
+
+    def indices(self, **kwargs):
+        return list(self.index_records)
+
+    def aliases(self, **kwargs):
+        return []
+
+
+class FakeIndices:
+    def get_data_stream(self, **kwargs):
+        return {'data_streams': []}
+
+    def get_settings(self, **kwargs):
+        return {}
+
+
+class FakeConnection:
+    def __init__(self, indices):
+        self.cat = FakeCat(indices)
+        self.indices = FakeIndices()
+
+
+class FakeTopology:
+    nodes = {}
+
+
+@pytest.fixture
+def build_snapshot(monkeypatch):
+    def build(names):
+        connection = FakeConnection([{'index': name} for name in names])
+        monkeypatch.setattr(es, 'get_es_connection', lambda client_config: connection)
+        monkeypatch.setattr(cluster, 'get_cluster_topology', lambda client_config: FakeTopology())
+        return cluster.ClusterSnapshot({'client_name': 'test'})
+    return build
+
+
+def test_index_groups(build_snapshot):
+    snapshot = build_snapshot([
+        'logs-2022.08.03', 'logs-2022.08.04', 'metrics-000001', 'metrics-000002'])
+    assert snapshot.get_index_groups() == {
+        'logs': ['logs-2022.08.03', 'logs-2022.08.04'],
+        'metrics': ['metrics-000001', 'metrics-000002'],
+    }
+    assert snapshot.get_index_group('metrics-000002') == 'metrics'
+    # Names missing from the snapshot are grouped directly
+    assert snapshot.get_index_group('metrics-000003') == 'metrics'
+
+
+def test_discard_index_keeps_groups_consistent(build_snapshot):
+    snapshot = build_snapshot(['logs-2022.08.03', 'logs-2022.08.04', 'metrics-000001'])
+    snapshot.get_index_groups()
+    snapshot.discard_index('logs-2022.08.03')
+    snapshot.discard_index('metrics-000001')
+    snapshot.discard_index('missing')
+    assert [index['index'] for index in snapshot.indices] == ['logs-2022.08.04']
+    assert snapshot.get_index_groups() == {'logs': ['logs-2022.08.04']}
+    assert snapshot.get_index('logs-2022.08.03') is None
+
+
+def test_index_groups_are_copies(build_snapshot):
+    snapshot = build_snapshot(['logs-2022.08.03', 'logs-2022.08.04'])
+    groups = snapshot.get_index_groups()
+    snapshot.discard_index('logs-2022.08.03')
+    assert groups == {'logs': ['logs-2022.08.03', 'logs-2022.08.04']}
+
+
+def test_concurrent_discard(build_snapshot):
+    names = [f'logs-{number:06d}' for number in range(2000)] + \
+        [f'metrics-2022.08.{day:02d}' for day in range(1, 29)]
+    snapshot = build_snapshot(names)
+    snapshot.get_index_groups()
+    discarded = names[::2]
+    threads = [
+        threading.Thread(target=lambda chunk: [snapshot.discard_index(name) for name in chunk],
+                         args=(discarded[start::8],))
+        for start in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    remaining = sorted(names[1::2])
+    assert sorted(index['index'] for index in snapshot.indices) == remaining
+    groups = snapshot.get_index_groups()
+    assert sorted(index for members in groups.values() for index in members) == remaining
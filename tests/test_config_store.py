@@ -0,0 +1,61 @@
+"""Tests for the incremental client config store"""
+import json
+import os
+import pytest
+import config
+
+
+@pytest.fixture
+def client_folder(tmp_path, monkeypatch):
+    settings = {'settings': {'client_json_folder': str(tmp_path)}}
+    monkeypatch.setattr(config, 'load_settings', lambda: settings)
+    monkeypatch.setitem(config.client_store, 'clients', {})
+    monkeypatch.setitem(config.client_store, 'checked', 0)
+    monkeypatch.setattr(config, 'client_file_cache', {})
+    return tmp_path
+
+
+def write_client(folder, file_name, client):
+    with open(os.path.join(folder, file_name), 'w', encoding='utf_8') as file:
+        json.dump(client, file)
+
+
+def refresh():
+    # Skip the once per second scan throttle
+    config.client_store['checked'] = 0
+    return config.refresh_client_configs()
+
+
+def test_add_modify_delete(client_folder):
+    write_client(client_folder, "a.json", {'client_name': 'a', 'port': 9200})
+    assert list(refresh()) == ['a']
+
+    write_client(client_folder, "b.json", {'client_name': 'b', 'port': 9200})
+    assert sorted(refresh()) == ['a', 'b']
+
+    write_client(client_folder, "a.json", {'client_name': 'a', 'port': 9243})
+    assert refresh()['a']['port'] == 9243
+
+    os.remove(os.path.join(client_folder, "b.json"))
+    clients = refresh()
+    assert list(clients) == ['a']
+    assert config.get_client_config('b') is None
+    assert os.path.join(str(client_folder), "b.json") not in config.client_file_cache
+
+
+def test_unchanged_file_is_not_parsed_again(client_folder):
+    write_client(client_folder, "a.json", {'client_name': 'a'})
+    client = refresh()['a']
+    path = os.path.join(client_folder, "a.json")
+    stat = os.stat(path)
+    # Touch the file without changing it
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+    assert refresh()['a'] is client
+
+
+def test_non_json_files_are_ignored(client_folder):
+    write_client(client_folder, "a.json", {'client_name': 'a'})
+    write_client(client_folder, "a_newest_timestamps.cache", {})
+    assert list(refresh()) == ['a']
+    assert config.load_configs('a') == {'a': {'client_name': 'a'}}
+    assert config.load_configs('missing') == {}
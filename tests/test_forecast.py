@@ -0,0 +1,35 @@
+"""Tests for forecast.RolloverForecast"""
+import pytest
+from forecast import RolloverForecast
+
+GB = 1024 ** 3
+
+
+def test_first_sample_uses_size_and_age():
+    forecast = RolloverForecast("client")
+    rate = forecast.record("logs", "logs-000001", 10 * GB, created=0, now=36000)
+    assert rate == pytest.approx(GB)
+    assert forecast.get_rate("logs", "logs-000001") == pytest.approx(GB)
+
+
+def test_new_write_index_resets_rate():
+    forecast = RolloverForecast("client")
+    forecast.record("logs", "logs-000001", 10 * GB, created=0, now=36000)
+    rate = forecast.record("logs", "logs-000002", GB, created=36000, now=43200)
+    assert rate == pytest.approx(GB / 2)
+    assert forecast.get_rate("logs", "logs-000001") is None
+
+
+def test_later_samples_blend_rate():
+    forecast = RolloverForecast("client")
+    forecast.record("logs", "logs-000001", 10 * GB, created=0, now=36000)
+    # 3 GB in one hour measured against a previous rate of 1 GB an hour
+    rate = forecast.record("logs", "logs-000001", 13 * GB, created=0, now=39600)
+    assert rate == pytest.approx(0.5 * GB + 0.5 * 3 * GB)
+
+
+def test_sample_from_same_snapshot_is_ignored():
+    forecast = RolloverForecast("client")
+    forecast.record("logs", "logs-000001", 10 * GB, created=0, now=36000)
+    rate = forecast.record("logs", "logs-000001", 12 * GB, created=0, now=36000)
+    assert rate == pytest.approx(GB)
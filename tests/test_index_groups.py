@@ -0,0 +1,47 @@
+"""Tests for index grouping"""
+import re
+import es
+
+
+def get_index_group_legacy(index):
+    """Original per call regex grouping the precompiled version replaced"""
+    if str(index).startswith('.ds-'):
+        index = index[4:]
+    m = re.search(r'-20[0-9][0-9](\.|-|_|:)[0-9]{2}(\.|-|_|:)[0-9]{2}$', index)
+    if m:
+        index = index.replace(str(m.group(0)), '')
+    m = re.search(r'20[0-9][0-9](\.|-|_|:)[0-9]{2}(\.|-|_|:)[0-9]{2}-', index)
+    if m:
+        index = index.replace(str(m.group(0)), '')
+    m = re.search(r'-[0-9]{1,6}$', index)
+    if m:
+        index = index.replace(str(m.group(0)), '')
+    return index
+
+
+INDICES = [
+    '.ds-winlogbeat-ds-2022.08.04-000028', 'logstash-cisco',
+    'logstash-cisco-2022.08.04', 'logstash-cisco-2022.08.04-000001',
+    '.ds-winlogbeat-ds-2022-08-04-000028', 'logstash-cisco-2022-08-04',
+    'logstash-cisco-2022-08-04-000001', '.ds-winlogbeat-ds-2022:08:04-000028',
+    'logstash-cisco-2022:08:04', 'logstash-cisco-2022:08:04-000001',
+    '.ds-winlogbeat-ds-2022_08_04-000028', 'logstash-cisco-2022_08_04',
+    'logstash-cisco-2022_08_04-000001', 'logs-1234567', 'logs-7',
+    'logs-2022.08.04-extra', 'a-2022.08.04-2022.08.05', 'plain',
+]
+
+
+def test_matches_legacy_grouping():
+    for index in INDICES:
+        assert es.get_index_group(index) == get_index_group_legacy(index), index
+
+
+def test_group_indices():
+    groups = es.group_indices(INDICES)
+    assert sorted(index for members in groups.values() for index in members) == \
+        sorted(INDICES)
+    for group, members in groups.items():
+        for index in members:
+            assert get_index_group_legacy(index) == group
+    assert groups['logstash-cisco'] == [
+        index for index in INDICES if get_index_group_legacy(index) == 'logstash-cisco']
@@ -0,0 +1,35 @@
+"""Tests for policy.PolicyMatcher"""
+import random
+import string
+from policy import PolicyMatcher, check_index_policy_legacy
+
+
+def test_longest_prefix_wins():
+    matcher = PolicyMatcher(["logstash", "logstash-cisco", "logstash-cisco-asa", "global"])
+    assert matcher.match("logstash-cisco-asa-2022.08.04") == "logstash-cisco-asa"
+    assert matcher.match("logstash-cisco-2022.08.04") == "logstash-cisco"
+    assert matcher.match("logstash-2022.08.04") == "logstash"
+
+
+def test_unmatched_index_falls_back_to_global():
+    matcher = PolicyMatcher(["logstash", "winlogbeat", "global"])
+    assert matcher.match("filebeat-2022.08.04") == "global"
+    assert matcher.match("log") == "global"
+    assert matcher.match("") == "global"
+
+
+def test_global_only_policies():
+    matcher = PolicyMatcher(["global"])
+    assert matcher.match("logstash-2022.08.04") == "global"
+
+
+def test_matches_legacy_check():
+    generator = random.Random(0)
+    policies = ["global"] + [
+        "".join(generator.choices("abc-", k=generator.randint(1, 6)))
+        for _ in range(50)
+    ]
+    matcher = PolicyMatcher(policies)
+    for _ in range(2000):
+        index = "".join(generator.choices("abc-" + string.digits, k=generator.randint(0, 12)))
+        assert matcher.match(index) == check_index_policy_legacy(index, policies)
@@ -0,0 +1,57 @@
+"""Tests for the compiled special index classifier"""
+import random
+import es
+
+
+def check_special_index_legacy(index):
+    """Original chain of startswith checks the classifier replaced"""
+    special = False
+    for prefix in ("accounting", "elastic-ilm", ".kibana", ".async", ".fleet",
+                   ".reporting", ".opensearch", ".opendistro", ".security",
+                   ".tasks", ".apm", "ilm", "readonlyrest", "reflex-",
+                   ".readonlyrest", ".signal", "elastalert", ".siem-signals",
+                   ".transform", ".transform-internal"):
+        if str(index).startswith(prefix):
+            special = True
+    if str(index).startswith(".") and not str(index).startswith(".monitoring") \
+            and not str(index).startswith(".ds-"):
+        special = True
+    return special
+
+
+def test_known_indices():
+    classify = es.compile_special_index_classifier()
+    assert classify(".kibana_1")
+    assert classify(".security-7")
+    assert classify("ilm-history-000001")
+    assert classify("accounting-2022.08.04")
+    assert classify(".custom-system-index")
+    assert not classify(".monitoring-es-7-2022.08.04")
+    assert not classify(".ds-logs-2022.08.04-000001")
+    assert not classify("logstash-2022.08.04")
+    assert not classify("reflex")
+
+
+def test_matches_legacy_checks():
+    classify = es.compile_special_index_classifier()
+    generator = random.Random(0)
+    pieces = ["", ".", "-", "ds", "ds-", "monitoring", "kibana", "ilm", "reflex",
+              "accounting", "elastalert", "transform", "siem-signals", "logs",
+              "2022.08.04", "000001"]
+    for _ in range(5000):
+        index = "".join(generator.choice(pieces) for _ in range(generator.randint(1, 4)))
+        assert classify(index) == check_special_index_legacy(index), index
+
+
+def test_extra_prefixes():
+    classify = es.compile_special_index_classifier(("tenant-internal",))
+    assert classify("tenant-internal-2022.08.04")
+    assert not classify("tenant-logs-2022.08.04")
+
+
+def test_client_special_indices():
+    client_config = {'client_name': 'test', 'special_indices': ['audit']}
+    assert es.check_special_index("audit-2022.08.04", client_config)
+    assert not es.check_special_index("audit-2022.08.04")
+    assert es.get_special_indices(
+        [".kibana_1", "audit-1", "logs-1"], client_config) == {".kibana_1", "audit-1"}
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Watches configuration files for changes using inotify"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | \
+    IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class ConfigWatcher:
+    """Waits for changes to settings.toml or client JSON files
+
+    Uses inotify on Linux. On other platforms, or if inotify cannot be
+    initialised, wait() falls back to sleeping for the poll interval and
+    reporting a possible change so callers re-check the files themselves.
+    """
+
+    def __init__(self, settings_file, client_json_folder, poll_interval=5):
+        self.settings_file = os.path.abspath(settings_file)
+        self.client_json_folder = os.path.abspath(client_json_folder)
+        self.poll_interval = poll_interval
+        self.fd = None
+        self.watches = {}
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            return
+        try:
+            libc = ctypes.CDLL(libc_name, use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+        if fd < 0:
+            return
+        # Watch directories rather than files so editors that replace files
+        # by renaming over them are still seen
+        for folder in {os.path.dirname(self.settings_file), self.client_json_folder}:
+            wd = libc.inotify_add_watch(fd, folder.encode(), WATCH_MASK)
+            if wd >= 0:
+                self.watches[wd] = folder
+        if len(self.watches) == 0:
+            os.close(fd)
+            return
+        self.fd = fd
+
+    def is_relevant(self, folder, name):
+        """Checks if a changed file is settings.toml or a client JSON file"""
+        path = os.path.join(folder, name)
+        if path == self.settings_file:
+            return True
+        return folder == self.client_json_folder and name.endswith(".json")
+
+    def read_events(self):
+        """Drains pending inotify events
+
+        Returns:
+            bool: True if any event touched a watched configuration file
+        """
+        relevant = False
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return relevant
+            offset = 0
+            while offset < len(data):
+                wd, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b"\0").decode()
+                offset += length
+                if wd in self.watches and self.is_relevant(self.watches[wd], name):
+                    relevant = True
+
+    def wait(self, timeout=None, debounce=1.5):
+        """Blocks until a configuration file changes
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait. Defaults to None.
+            debounce (float, optional): Seconds to wait for a burst of writes
+                to settle. Defaults to 1.5.
+
+        Returns:
+            bool: True if configuration may have changed
+        """
+        if self.fd is None:
+            if timeout is None:
+                timeout = self.poll_interval
+            time.sleep(min(timeout, self.poll_interval))
+            return True
+        deadline = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = max(0, deadline - time.monotonic())
+            readable, _, _ = select.select([self.fd], [], [], remaining)
+            if not readable:
+                return False
+            if self.read_events():
+                break
+        time.sleep(debounce)
+        self.read_events()
+        return True
+
+    def close(self):
+        """Stops watching"""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None